@@ -0,0 +1,93 @@
+"""Benchmark moving ndarray data between two plugins with and without msgpack.
+
+Each message goes through the sending connection, the socketio packet
+encoding and decoding, and the receiving connection.
+
+Usage: python benchmarks/benchmark_binary_frames.py [--total-mb 100]
+       [--chunk-mb 1]
+"""
+import argparse
+import asyncio
+import time
+
+import numpy as np
+from socketio import packet
+
+from imjoy.core.connection import BasicConnection
+
+
+def transfer(frame):
+    """Encode and decode a frame as a socketio plugin_message event."""
+    encoded = packet.Packet(packet.EVENT, data=["plugin_message", frame]).encode()
+    if isinstance(encoded, str):
+        return packet.Packet(encoded_packet=encoded).data[1]
+    pkt = packet.Packet(encoded_packet=encoded[0])
+    for attachment in encoded[1:]:
+        pkt.add_attachment(attachment)
+    return pkt.data[1]
+
+
+async def measure(encoding, array, count):
+    """Return the throughput in MB/s for sending an array count times."""
+    received = []
+    receiver = BasicConnection(None)
+    receiver.on("method", received.append)
+
+    async def send(frame):
+        receiver.handle_message(transfer(frame))
+
+    sender = BasicConnection(send, encoding=encoding)
+    sender.peer_id = "sender"
+    # mimic the imjoy-rpc encoding of a method call with an ndarray argument
+    message = {
+        "type": "method",
+        "name": "process",
+        "args": [
+            {
+                "_rtype": "ndarray",
+                "_rvalue": array.tobytes(),
+                "_rshape": list(array.shape),
+                "_rdtype": str(array.dtype),
+            }
+        ],
+        "promise": {"resolve": "resolve-id", "reject": "reject-id"},
+    }
+    start = time.perf_counter()
+    for _ in range(count):
+        sender.emit(dict(message))
+    while len(received) < count:
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+    value = received[-1]["args"][0]
+    result = np.frombuffer(value["_rvalue"], dtype=value["_rdtype"])
+    assert np.array_equal(result.reshape(value["_rshape"]), array)
+    return array.nbytes * count / elapsed / 1024 ** 2
+
+
+async def run(args):
+    """Run the benchmark."""
+    size = int(args.chunk_mb * 1024 ** 2 / 4)
+    array = np.random.random(size).astype("float32")
+    count = max(int(args.total_mb / args.chunk_mb), 1)
+    for encoding in ("json", "msgpack"):
+        throughput = await measure(encoding, array, count)
+        print(
+            f"{encoding}: {array.nbytes * count / 1024 ** 2:.0f} MB "
+            f"in {count} messages, {throughput:.0f} MB/s"
+        )
+
+
+def main():
+    """Parse the arguments and run the benchmark."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--total-mb", type=float, default=100, help="total amount of data in MB"
+    )
+    parser.add_argument(
+        "--chunk-mb", type=float, default=1, help="size of each array in MB"
+    )
+    asyncio.get_event_loop().run_until_complete(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Benchmark the service cleanup when plugins disconnect from a busy workspace.
+
+Usage: python benchmarks/benchmark_disconnect.py [--plugins 1000]
+       [--services 50000] [--legacy]
+"""
+import argparse
+import asyncio
+import time
+
+import socketio
+
+from imjoy.core import VisibilityEnum, WorkspaceInfo, all_workspaces
+from imjoy.core.interface import CoreInterface
+from imjoy.server import initialize_socketio
+
+WORKSPACE = "benchmark-workspace"
+
+
+def legacy_cleanup(services, provider_ids):
+    """Remove services the way the disconnect handler used to."""
+    for provider_id in provider_ids:
+        for service in services.copy():
+            if service["providerId"] == provider_id:
+                services.remove(service)
+
+
+async def run(args):
+    """Run the benchmark."""
+    # pylint: disable=protected-access
+    sio = socketio.AsyncServer(async_mode="asgi")
+    initialize_socketio(sio, CoreInterface())
+    handlers = sio.handlers["/"]
+    workspace = WorkspaceInfo(
+        name=WORKSPACE,
+        owners=[],
+        persistent=True,
+        visibility=VisibilityEnum.public,
+        deny_list=[],
+    )
+    await all_workspaces.put(WORKSPACE, workspace)
+
+    # the disconnecting user owns half of the plugins
+    # the other half belongs to a user who stays connected
+    sids = {}
+    provider_ids = {"leaving": [], "staying": []}
+    for key in provider_ids:
+        sids[key] = sio.manager.connect(key, "/")
+        await handlers["connect"](sids[key], {})
+        for index in range(args.plugins):
+            ret = await handlers["register_plugin"](
+                sids[key], {"name": f"{key}-{index}", "workspace": WORKSPACE}
+            )
+            provider_ids[key].append(ret["plugin_id"])
+
+    providers = provider_ids["leaving"] + provider_ids["staying"]
+    per_provider = max(args.services // len(providers), 1)
+    legacy_services = []
+    for provider_id in providers:
+        for index in range(per_provider):
+            service = {"name": f"service-{index}", "providerId": provider_id}
+            workspace._services.append(service)
+            legacy_services.append(dict(service))
+    total = len(workspace._services)
+
+    start = time.perf_counter()
+    await handlers["disconnect"](sids["leaving"])
+    elapsed = time.perf_counter() - start
+    assert len(workspace._services) == total - per_provider * args.plugins
+    print(
+        f"disconnect: {args.plugins} plugins, {total} services "
+        f"in the workspace: {elapsed * 1000:.1f} ms"
+    )
+
+    if args.legacy:
+        start = time.perf_counter()
+        legacy_cleanup(legacy_services, provider_ids["leaving"])
+        elapsed = time.perf_counter() - start
+        print(f"legacy list scan cleanup: {elapsed * 1000:.1f} ms")
+
+    await asyncio.sleep(0)
+
+
+def main():
+    """Parse the arguments and run the benchmark."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--plugins", type=int, default=1000, help="number of disconnecting plugins"
+    )
+    parser.add_argument(
+        "--services",
+        type=int,
+        default=50000,
+        help="total number of services in the workspace",
+    )
+    parser.add_argument(
+        "--legacy",
+        action="store_true",
+        help="also time the previous list-based cleanup (slow)",
+    )
+    asyncio.get_event_loop().run_until_complete(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""Load test the socketio server with many clients and plugins.
+
+The server is started locally, each client process connects a number of
+plugins to a shared workspace. Every plugin exports an `echo` function and
+registers it as a service, then calls `get_services` and the `echo`
+function of random plugins of the other clients.
+
+The results are written as json, with the throughput and the p50/p99
+latencies of each operation and the server memory per plugin. When a
+baseline file from a previous run is given, the script exits with an
+error if the results regressed by more than the tolerance.
+
+Usage: python benchmarks/benchmark_load.py [--clients 4] [--plugins 5]
+       [--calls 50] [--output results.json] [--baseline previous.json]
+       [--tolerance 0.2]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import signal
+import subprocess
+import sys
+import time
+import uuid
+
+import requests
+from imjoy_rpc import connect_to_server
+from requests import RequestException
+
+from imjoy import __version__ as VERSION
+
+PORT = 38392
+SERVER_URL = f"http://127.0.0.1:{PORT}"
+OPERATIONS = ("register", "get_services", "rpc")
+
+
+def plugin_name(client, index):
+    """Return the name of a plugin."""
+    return f"client{client}-plugin{index}"
+
+
+async def timed(latencies, coro):
+    """Await a coroutine and record its latency."""
+    start = time.perf_counter()
+    result = await coro
+    latencies.append(time.perf_counter() - start)
+    return result
+
+
+async def register_plugin(client, index, config, latencies):
+    """Connect a plugin, export its api and register its service."""
+
+    def echo(data):
+        return data
+
+    start = time.perf_counter()
+    api = await connect_to_server(
+        dict(config, name=plugin_name(client, index), server_url=SERVER_URL)
+    )
+    await api.export({"echo": echo})
+    await api.register_service(
+        {"name": plugin_name(client, index), "type": "load-test", "echo": echo}
+    )
+    latencies.append(time.perf_counter() - start)
+    return api
+
+
+async def run_plugin(api, targets, calls, results):
+    """Call the server and the other plugins."""
+    plugins = {}
+    for _ in range(calls):
+        await timed(results["get_services"], api.get_services({"type": "load-test"}))
+        target = random.choice(targets)
+        if target not in plugins:
+            plugins[target] = await api.get_plugin(target)
+        await timed(results["rpc"], plugins[target].echo("ping"))
+
+
+async def run_client(client, args, config, events, queue):
+    """Register the plugins of a client, run them and send back the latencies."""
+    loop = asyncio.get_event_loop()
+    start, done = events
+    results = {operation: [] for operation in OPERATIONS}
+    apis = [
+        await register_plugin(client, index, config, results["register"])
+        for index in range(args.plugins)
+    ]
+    queue.put(None)
+    # keep serving the other clients while waiting
+    await loop.run_in_executor(None, start.wait)
+    targets = [
+        plugin_name(other, index)
+        for other in range(args.clients)
+        for index in range(args.plugins)
+        if other != client or args.clients == 1
+    ]
+    await asyncio.gather(
+        *[run_plugin(api, targets, args.calls, results) for api in apis]
+    )
+    queue.put(results)
+    await loop.run_in_executor(None, done.wait)
+
+
+def client_process(client, args, config, events, queue):
+    """Run a client in a new process."""
+    asyncio.get_event_loop().run_until_complete(
+        run_client(client, args, config, events, queue)
+    )
+
+
+async def create_workspace(workspace):
+    """Create the shared workspace and return a token for it."""
+    api = await connect_to_server({"name": "load-test", "server_url": SERVER_URL})
+    workspace_api = await api.create_workspace(
+        {
+            "name": workspace,
+            "owners": [],
+            "allow_list": [],
+            "deny_list": [],
+            "visibility": "protected",
+        }
+    )
+    return (await workspace_api.generate_token())["token"]
+
+
+def wait_for_server():
+    """Wait until the server answers."""
+    timeout = 10
+    while timeout > 0:
+        try:
+            if requests.get(f"{SERVER_URL}/health").ok:
+                return
+        except RequestException:
+            pass
+        timeout -= 0.1
+        time.sleep(0.1)
+    raise TimeoutError("The server did not start")
+
+
+def stop(proc):
+    """Stop a process and its children."""
+    os.killpg(proc.pid, signal.SIGTERM)
+    try:
+        proc.wait(5)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+
+
+def memory_usage(pid):
+    """Return the resident memory of a process in bytes, None if unknown."""
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as fil:
+            for line in fil:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile of sorted values."""
+    if not values:
+        return None
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+def summarize(latencies, duration):
+    """Return the statistics of the latencies of an operation."""
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "throughput": len(latencies) / duration if duration else None,
+        "p50": percentile(latencies, 0.5),
+        "p99": percentile(latencies, 0.99),
+    }
+
+
+def run(args):
+    """Run the load test and return the results."""
+    server = subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, "-m", "imjoy.server", f"--port={PORT}"],
+        start_new_session=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_server()
+        workspace = f"load-test-{uuid.uuid4()}"
+        token = asyncio.get_event_loop().run_until_complete(create_workspace(workspace))
+        config = {"workspace": workspace, "token": token}
+        memory_before = memory_usage(server.pid)
+        events = (multiprocessing.Event(), multiprocessing.Event())
+        queue = multiprocessing.Queue()
+        clients = [
+            multiprocessing.Process(
+                target=client_process,
+                args=(client, args, config, events, queue),
+            )
+            for client in range(args.clients)
+        ]
+        begin = time.perf_counter()
+        for client in clients:
+            client.start()
+        for _ in clients:
+            queue.get()  # registered
+        registration_time = time.perf_counter() - begin
+        memory_after = memory_usage(server.pid)
+        begin = time.perf_counter()
+        events[0].set()
+        latencies = {operation: [] for operation in OPERATIONS}
+        for _ in clients:
+            for operation, values in queue.get().items():
+                latencies[operation] += values
+        duration = time.perf_counter() - begin
+        events[1].set()
+        for client in clients:
+            client.join()
+    finally:
+        stop(server)
+
+    plugins = args.clients * args.plugins
+    operations = {
+        operation: summarize(
+            latencies[operation],
+            registration_time if operation == "register" else duration,
+        )
+        for operation in OPERATIONS
+    }
+    return {
+        "version": VERSION,
+        "python": platform.python_version(),
+        "config": {
+            "clients": args.clients,
+            "plugins": args.plugins,
+            "calls": args.calls,
+        },
+        "throughput": (operations["get_services"]["count"] + operations["rpc"]["count"])
+        / duration,
+        "operations": operations,
+        "memory_per_plugin": (memory_after - memory_before) / plugins
+        if memory_before is not None and memory_after is not None
+        else None,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return the regressions of the results compared to a baseline."""
+    regressions = []
+
+    def check(name, value, reference, higher_is_better):
+        if value is None or not reference:
+            return
+        change = value / reference - 1
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(f"{name}: {reference:.6g} -> {value:.6g}")
+
+    check("throughput", results["throughput"], baseline["throughput"], True)
+    for operation, stats in results["operations"].items():
+        reference = baseline["operations"].get(operation, {})
+        check(
+            f"{operation} throughput",
+            stats["throughput"],
+            reference.get("throughput"),
+            True,
+        )
+        for key in ("p50", "p99"):
+            check(f"{operation} {key}", stats[key], reference.get(key), False)
+    check(
+        "memory per plugin",
+        results["memory_per_plugin"],
+        baseline.get("memory_per_plugin"),
+        False,
+    )
+    return regressions
+
+
+def main():
+    """Parse the arguments and run the load test."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=4, help="client processes")
+    parser.add_argument("--plugins", type=int, default=5, help="plugins per client")
+    parser.add_argument("--calls", type=int, default=50, help="calls per plugin")
+    parser.add_argument(
+        "--output", type=str, default=None, help="write the results to a json file"
+    )
+    parser.add_argument(
+        "--baseline", type=str, default=None, help="results of a previous run"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="relative change allowed compared to the baseline",
+    )
+    args = parser.parse_args()
+
+    results = run(args)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fil:
+            fil.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fil:
+            regressions = compare(results, json.load(fil), args.tolerance)
+        for regression in regressions:
+            print(f"Regression of {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Benchmark the routing of plugin messages in the socketio server.
+
+Usage: python benchmarks/benchmark_plugin_message.py [--messages 100000]
+"""
+import argparse
+import asyncio
+import os
+import time
+from contextvars import copy_context
+
+import socketio
+
+from imjoy.core import (
+    VisibilityEnum,
+    WorkspaceInfo,
+    all_sessions,
+    all_workspaces,
+    current_plugin,
+    current_user,
+    current_workspace,
+)
+from imjoy.core.auth import _check_permission
+from imjoy.core.interface import CoreInterface
+from imjoy.server import initialize_socketio
+
+WORKSPACE = "benchmark-workspace"
+
+
+async def legacy_plugin_message(sid, data):
+    """Route a message the way the plugin_message handler used to."""
+    # pylint: disable=protected-access
+    user_info = all_sessions[sid]
+    plugin_id = data["plugin_id"]
+    ws, name = os.path.split(plugin_id)
+    if ws not in all_workspaces:
+        return {"success": False, "detail": f"Workspace not found: {ws}"}
+    workspace = all_workspaces[ws]
+    # the permission was checked on every message, without the cache
+    if user_info.id != ws and not _check_permission(workspace, user_info):
+        return {"success": False, "detail": "Permission denied"}
+    plugin = workspace._plugins.get(name)
+    if not plugin:
+        return {"success": False, "detail": f"Plugin {name} not found"}
+    current_user.set(user_info)
+    current_plugin.set(plugin)
+    current_workspace.set(workspace)
+    ctx = copy_context()
+    ctx.run(plugin.connection.handle_message, data)
+    return {"success": True}
+
+
+async def measure(handler, sid, data, count):
+    """Return the number of messages handled per second."""
+    start = time.perf_counter()
+    for _ in range(count):
+        await handler(sid, data)
+    return count / (time.perf_counter() - start)
+
+
+async def run(args):
+    """Run the benchmark."""
+    # pylint: disable=protected-access
+    sio = socketio.AsyncServer(async_mode="asgi")
+    initialize_socketio(sio, CoreInterface())
+    handlers = sio.handlers["/"]
+    # the sender is not the owner, so its permission is checked
+    await all_workspaces.put(
+        WORKSPACE,
+        WorkspaceInfo(
+            name=WORKSPACE,
+            owners=[],
+            persistent=True,
+            visibility=VisibilityEnum.public,
+            deny_list=[],
+        ),
+    )
+    sid = sio.manager.connect("benchmark", "/")
+    await handlers["connect"](sid, {})
+    ret = await handlers["register_plugin"](
+        sid, {"name": "benchmark-plugin", "workspace": WORKSPACE}
+    )
+    plugin_id = ret["plugin_id"]
+    ws, name = os.path.split(plugin_id)
+    received = []
+    all_workspaces[ws]._plugins[name].connection.on("benchmark", received.append)
+    data = {"type": "benchmark", "plugin_id": plugin_id}
+
+    before = await measure(legacy_plugin_message, sid, data, args.messages)
+    after = await measure(handlers["plugin_message"], sid, data, args.messages)
+    assert len(received) == 2 * args.messages
+    print(f"before: {before:.0f} messages/s")
+    print(f"after: {after:.0f} messages/s ({after / before:.2f}x)")
+
+
+def main():
+    """Parse the arguments and run the benchmark."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--messages", type=int, default=100000, help="number of messages to route"
+    )
+    asyncio.get_event_loop().run_until_complete(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
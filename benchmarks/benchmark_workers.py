@@ -0,0 +1,227 @@
+"""Benchmark the throughput of the socketio server with several workers.
+
+The workers share their state through a redis server (a local stand-in is
+started if no uri is given). Each client process connects first, then all
+the clients make their calls at the same time, with these workloads:
+
+- core: call `get_services` of the core in the own workspace of the client
+- echo: call the echo service of a provider in the own workspace of the
+  client, the messages go both ways through the worker of the workspace
+- hot: call the echo service of one provider in a workspace shared by all
+  the clients, it is hosted by a single worker
+
+The sessions connected to a worker which does not host their workspace are
+forwarded to the worker hosting it.
+
+Usage: python benchmarks/benchmark_workers.py [--workers 1,2,4]
+       [--workloads core,echo,hot] [--clients 8] [--calls 500]
+       [--payload 100] [--redis-uri redis://127.0.0.1:6379/0]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import requests
+from imjoy_rpc import connect_to_server
+from requests import RequestException
+
+PORT = 38390
+REDIS_PORT = 38391
+SERVER_URL = f"http://127.0.0.1:{PORT}"
+# seconds the processes wait for each other before giving up
+SETUP_TIMEOUT = 60
+
+
+async def serve_echo(api):
+    """Register an echo service, return the workspace and a token to use it."""
+    await api.register_service(
+        {"name": "echo-service", "echo": lambda msg: msg, "_rintf": True}
+    )
+    token = (await api.generate_token())["token"]
+    return {"workspace": api.config["workspace"], "token": token}
+
+
+async def connect_client(index, workload, target):
+    """Connect a client and return its call."""
+    config = {"name": f"benchmark-{index}", "server_url": SERVER_URL}
+    if workload == "core":
+        api = await connect_to_server(config)
+        return lambda payload: api.get_services({"name": "echo-service"})
+    if target is None:
+        provider = await connect_to_server(dict(config, name=f"provider-{index}"))
+        target = await serve_echo(provider)
+    api = await connect_to_server(dict(config, **target))
+    service = (await api.get_services({"name": "echo-service"}))[0]
+    return service.echo
+
+
+async def make_calls(call, count, payload):
+    """Make the calls one after the other, return their latencies."""
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        await call(payload)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def client_process(index, workload, target, args, ready, start, results):
+    """Connect a client, then make the calls once all the clients are ready."""
+    # pylint: disable=too-many-arguments
+    loop = asyncio.get_event_loop()
+    call = loop.run_until_complete(connect_client(index, workload, target))
+    ready.wait(SETUP_TIMEOUT)
+    start.wait()
+    payload = "x" * args.payload
+    results.put(loop.run_until_complete(make_calls(call, args.calls, payload)))
+
+
+def provider_process(targets, done):
+    """Serve the echo service of the hot workspace until done."""
+
+    async def serve():
+        api = await connect_to_server({"name": "provider", "server_url": SERVER_URL})
+        targets.put(await serve_echo(api))
+        await asyncio.get_event_loop().run_in_executor(None, done.wait)
+
+    asyncio.get_event_loop().run_until_complete(serve())
+
+
+def percentile(values, fraction):
+    """Return a percentile of some values, e.g. 0.99 for the 99th."""
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def wait_for_server():
+    """Wait until the server answers."""
+    timeout = 10
+    while timeout > 0:
+        try:
+            if requests.get(f"{SERVER_URL}/").ok:
+                return
+        except RequestException:
+            pass
+        timeout -= 0.1
+        time.sleep(0.1)
+    raise TimeoutError("The server did not start")
+
+
+def stop(proc):
+    """Stop a process and its children."""
+    os.killpg(proc.pid, signal.SIGTERM)
+    try:
+        proc.wait(5)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+
+
+def measure(workers, workload, args):
+    """Return the calls per second and the latencies of a workload."""
+    # pylint: disable=too-many-locals
+    server = subprocess.Popen(  # pylint: disable=consider-using-with
+        [
+            sys.executable,
+            "-m",
+            "imjoy.server",
+            f"--port={PORT}",
+            f"--workers={workers}",
+            f"--state-backend={args.redis_uri}",
+        ],
+        start_new_session=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    processes = []
+    done = multiprocessing.Event()
+    try:
+        wait_for_server()
+        target = None
+        if workload == "hot":
+            targets = multiprocessing.Queue()
+            processes.append(
+                multiprocessing.Process(target=provider_process, args=(targets, done))
+            )
+            processes[0].start()
+            target = targets.get(timeout=SETUP_TIMEOUT)
+        ready = multiprocessing.Barrier(args.clients + 1)
+        start = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        clients = [
+            multiprocessing.Process(
+                target=client_process,
+                args=(index, workload, target, args, ready, start, results),
+            )
+            for index in range(args.clients)
+        ]
+        processes.extend(clients)
+        for client in clients:
+            client.start()
+        ready.wait(SETUP_TIMEOUT)
+        begin = time.perf_counter()
+        start.set()
+        latencies = []
+        for _ in clients:
+            latencies.extend(results.get(timeout=SETUP_TIMEOUT + args.calls))
+        elapsed = time.perf_counter() - begin
+        return len(latencies) / elapsed, latencies
+    finally:
+        done.set()
+        for proc in processes:
+            proc.join(5)
+            if proc.is_alive():
+                proc.terminate()
+        stop(server)
+
+
+def main():
+    """Parse the arguments and run the benchmark."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--workers", type=str, default="1,2,4", help="worker counts to compare"
+    )
+    parser.add_argument(
+        "--workloads", type=str, default="core,echo,hot", help="workloads to run"
+    )
+    parser.add_argument("--clients", type=int, default=8, help="client processes")
+    parser.add_argument("--calls", type=int, default=500, help="calls per client")
+    parser.add_argument(
+        "--payload", type=int, default=100, help="characters sent to the echo"
+    )
+    parser.add_argument(
+        "--redis-uri", type=str, default=None, help="uri of the redis server"
+    )
+    args = parser.parse_args()
+
+    stand_in = None
+    if args.redis_uri is None:
+        stand_in = subprocess.Popen(  # pylint: disable=consider-using-with
+            [sys.executable, "-m", "tests.redis_stand_in", f"--port={REDIS_PORT}"],
+            start_new_session=True,
+        )
+        args.redis_uri = f"redis://127.0.0.1:{REDIS_PORT}/0"
+    print(f"{os.cpu_count()} cpu(s), {args.clients} clients x {args.calls} calls")
+    try:
+        for workload in args.workloads.split(","):
+            baseline = None
+            for workers in [int(count) for count in args.workers.split(",")]:
+                throughput, latencies = measure(workers, workload, args)
+                baseline = baseline or throughput
+                print(
+                    f"{workload}, {workers} worker(s): {throughput:.0f} calls/s "
+                    f"({throughput / baseline:.2f}x), "
+                    f"p50 {percentile(latencies, 0.5) * 1000:.1f} ms, "
+                    f"p99 {percentile(latencies, 0.99) * 1000:.1f} ms"
+                )
+    finally:
+        if stand_in is not None:
+            stop(stand_in)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Provide an on-disk cache for the remote plugin files."""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import time
+from os import environ as env
+
+import aiohttp
+
+logging.basicConfig(stream=sys.stdout)
+logger = logging.getLogger("plugin-cache")
+logger.setLevel(logging.INFO)
+
+PLUGIN_CACHE_DIR = env.get(
+    "PLUGIN_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".imjoy", "cache")
+)
+PLUGIN_FETCH_TIMEOUT = float(env.get("PLUGIN_FETCH_TIMEOUT", "30"))
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _write_atomic(path, data):
+    """Write a file so that readers never see it partially written."""
+    handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(handle, "wb") as fil:
+            fil.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _max_age(cache_control):
+    """Return the max-age of a Cache-Control header, None if not cacheable."""
+    if not cache_control or re.search(r"no-cache|no-store", cache_control):
+        return None
+    found = re.search(r"max-age=(\d+)", cache_control)
+    return int(found.group(1)) if found else None
+
+
+class PluginCache:
+    """Represent a content-addressed cache of remote plugin files.
+
+    The contents are stored by their sha256 digest, and the metadata of
+    each url (digest, ETag, Last-Modified and expiry) is stored next to
+    them. Cached urls are revalidated with conditional requests, unless
+    they are still fresh according to their Cache-Control max-age.
+    The files are replaced atomically, the cache can be shared by
+    several runner processes.
+    """
+
+    def __init__(self, cache_dir=None, offline=False, timeout=None):
+        """Set up instance."""
+        self.cache_dir = cache_dir or PLUGIN_CACHE_DIR
+        self.offline = offline
+        self.timeout = timeout or PLUGIN_FETCH_TIMEOUT
+        os.makedirs(os.path.join(self.cache_dir, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(self.cache_dir, "urls"), exist_ok=True)
+
+    def _meta_path(self, url):
+        return os.path.join(self.cache_dir, "urls", _digest(url.encode()) + ".json")
+
+    def _object_path(self, digest):
+        return os.path.join(self.cache_dir, "objects", digest)
+
+    def get_cached(self, url):
+        """Return the metadata and the content of a cached url, None if missing."""
+        try:
+            with open(self._meta_path(url)) as fil:
+                meta = json.load(fil)
+            with open(self._object_path(meta["digest"]), "rb") as fil:
+                data = fil.read()
+        except (OSError, ValueError, KeyError):
+            return None, None
+        if _digest(data) != meta["digest"]:
+            logger.warning("Ignoring corrupted cache entry for %s", url)
+            return None, None
+        return meta, data
+
+    def _store(self, url, response, data, meta=None):
+        meta = dict(meta or {})
+        if data is not None:
+            meta["digest"] = _digest(data)
+            path = self._object_path(meta["digest"])
+            if not os.path.exists(path):
+                _write_atomic(path, data)
+            meta["etag"] = response.headers.get("ETag")
+            meta["last_modified"] = response.headers.get("Last-Modified")
+        max_age = _max_age(response.headers.get("Cache-Control"))
+        meta["expires"] = time.time() + max_age if max_age else None
+        meta["url"] = url
+        _write_atomic(self._meta_path(url), json.dumps(meta).encode())
+
+    async def fetch(self, url):
+        """Return the content of a url, from the cache if it is still valid."""
+        meta, data = self.get_cached(url)
+        if self.offline:
+            if data is None:
+                raise Exception(f"{url} is not cached, cannot fetch it offline")
+            return data.decode("utf-8")
+        if data is not None and meta.get("expires") and time.time() < meta["expires"]:
+            return data.decode("utf-8")
+
+        headers = {}
+        if data is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        try:
+            async with aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            ) as session:
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 304 and data is not None:
+                        self._store(url, response, None, meta)
+                        return data.decode("utf-8")
+                    response.raise_for_status()
+                    body = await response.read()
+                    self._store(url, response, body)
+                    return body.decode("utf-8")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            if data is None:
+                raise
+            logger.warning("Failed to revalidate %s (%s), using the cache", url, err)
+            return data.decode("utf-8")
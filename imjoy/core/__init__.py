@@ -7,8 +7,12 @@ from pydantic import (  # pylint: disable=no-name-in-module
     BaseModel,
     EmailStr,
     PrivateAttr,
+    conint,
 )
 
+from imjoy.core.services import ServiceRegistry
+from imjoy.core.store import SharedRegistry
+
 
 class TokenConfig(BaseModel):
     """Represent a token configuration."""
@@ -52,14 +56,29 @@ class WorkspaceInfo(BaseModel):
     allow_list: Optional[List[str]]
     deny_list: Optional[List[str]]
     authorizer: Optional[str]
+    log_capacity: Optional[conint(ge=1)]  # entries kept in the log of each plugin
+    concurrency_limit: Optional[int]  # concurrent calls to its services
     _authorizer: Optional[Callable] = PrivateAttr(default_factory=lambda: None)
     _plugins: Dict[str, Any] = PrivateAttr(default_factory=lambda: {})  # name: plugin
-    _services: List[Dict[str, Any]] = PrivateAttr(default_factory=lambda: [])
+    _services: ServiceRegistry = PrivateAttr(default_factory=ServiceRegistry)
+    _limiter: Optional[Any] = PrivateAttr(default=None)
 
 
 current_user = ContextVar("current_user")
 current_plugin = ContextVar("current_plugin")
 current_workspace = ContextVar("current_workspace")
 all_sessions: Dict[str, UserInfo] = {}  # sid:user_info
-all_users: Dict[str, UserInfo] = {}  # uid:user_info
-all_workspaces: Dict[str, WorkspaceInfo] = {}  # wid:workspace_info
+# users and workspaces are shared between the workers through the state backend
+all_users = SharedRegistry("users", UserInfo)  # uid:user_info
+all_workspaces = SharedRegistry("workspaces", WorkspaceInfo)  # wid:workspace_info
+
+
+def set_state_backend(backend):
+    """Set the state backend of the user and workspace registries."""
+    all_users.set_backend(backend)
+    all_workspaces.set_backend(backend)
+
+
+def set_workspace_store(store):
+    """Set the store of the persistent workspaces."""
+    all_workspaces.set_store(store)
@@ -1,11 +1,15 @@
 """Provide authentication."""
+import asyncio
+import hashlib
 import json
 import logging
+import os
 import ssl
 import sys
 import time
 import traceback
 import uuid
+from collections import OrderedDict
 from os import environ as env
 from typing import List, Optional
 from urllib.request import urlopen
@@ -16,6 +20,7 @@ from jose import jwt
 from pydantic import BaseModel  # pylint: disable=no-name-in-module
 
 from imjoy.core import UserInfo, VisibilityEnum, TokenConfig, all_users, all_workspaces
+from imjoy.core.metrics import permission_check_latency, token_parse_latency
 
 logging.basicConfig(stream=sys.stdout)
 logger = logging.getLogger("imjoy-core")
@@ -27,10 +32,17 @@ if ENV_FILE:
 
 AUTH0_DOMAIN = env.get("AUTH0_DOMAIN", "imjoy.eu.auth0.com")
 AUTH0_AUDIENCE = env.get("AUTH0_AUDIENCE", "https://imjoy.eu.auth0.com/api/v2/")
+# the jwks endpoint can be an http(s) url, a file url or a local file path
+AUTH0_JWKS_URL = env.get(
+    "AUTH0_JWKS_URL", f"https://{AUTH0_DOMAIN}/.well-known/jwks.json"
+)
+JWKS_REFRESH_INTERVAL = float(env.get("JWKS_REFRESH_INTERVAL", "3600"))
+JWKS_MIN_REFETCH_INTERVAL = float(env.get("JWKS_MIN_REFETCH_INTERVAL", "30"))
 JWT_SECRET = env.get("JWT_SECRET")
 if not JWT_SECRET:
     logger.warning("JWT_SECRET is not defined")
     JWT_SECRET = str(uuid.uuid4())
+TOKEN_CACHE_SIZE = int(env.get("TOKEN_CACHE_SIZE", "1024"))
 
 
 class AuthError(Exception):
@@ -100,30 +112,126 @@ def get_user_info(token):
     }
 
 
-JWKS = None
+class JWKSKeyStore:
+    """Represent the auth0 signing keys, indexed by kid.
 
+    The keys are fetched in a thread so the event loop is never blocked,
+    refreshed periodically in the background once the store is used from
+    a coroutine, and refetched on unknown kids at most once per
+    `min_refetch_interval` seconds.
+    """
 
-def get_rsa_key(kid, refresh=False):
-    """Return an rsa key."""
-    global JWKS  # pylint: disable=global-statement
-    if JWKS is None or refresh:
+    def __init__(
+        self,
+        url=AUTH0_JWKS_URL,
+        refresh_interval=JWKS_REFRESH_INTERVAL,
+        min_refetch_interval=JWKS_MIN_REFETCH_INTERVAL,
+    ):
+        """Set up instance."""
+        self.url = url
+        self.refresh_interval = refresh_interval
+        self.min_refetch_interval = min_refetch_interval
+        self._keys = {}  # kid: rsa key
+        self._last_fetch = None
+        self._refreshing = None
+        self._refresh_task = None
+
+    def _fetch(self):
+        """Fetch the jwks, this blocks and should run in a thread."""
+        if os.path.isfile(self.url):
+            with open(self.url, "r") as fil:
+                return json.load(fil)
         with urlopen(
-            f"https://{AUTH0_DOMAIN}/.well-known/jwks.json",
+            self.url,
             # pylint: disable=protected-access
             context=ssl._create_unverified_context(),
+            timeout=10,
         ) as jsonurl:
-            JWKS = json.loads(jsonurl.read())
-    rsa_key = {}
-    for key in JWKS["keys"]:
-        if key["kid"] == kid:
-            rsa_key = {
+            return json.loads(jsonurl.read())
+
+    def _update(self, jwks):
+        self._keys = {
+            key["kid"]: {
                 "kty": key["kty"],
                 "kid": key["kid"],
                 "use": key["use"],
                 "n": key["n"],
                 "e": key["e"],
             }
-            break
+            for key in jwks["keys"]
+        }
+
+    def _can_refetch(self):
+        return (
+            self._last_fetch is None
+            or time.monotonic() - self._last_fetch >= self.min_refetch_interval
+        )
+
+    def get_key(self, kid):
+        """Return the rsa key for a kid without fetching, or an empty dict."""
+        return self._keys.get(kid, {})
+
+    def refresh_sync(self):
+        """Fetch the keys in the current thread, subject to rate limiting."""
+        if not self._can_refetch():
+            return
+        self._last_fetch = time.monotonic()
+        try:
+            self._update(self._fetch())
+        except Exception as err:  # pylint: disable=broad-except
+            logger.error("Failed to fetch the jwks from %s: %s", self.url, err)
+
+    async def _refresh(self):
+        self._last_fetch = time.monotonic()
+        loop = asyncio.get_event_loop()
+        try:
+            self._update(await loop.run_in_executor(None, self._fetch))
+        except Exception as err:  # pylint: disable=broad-except
+            logger.error("Failed to fetch the jwks from %s: %s", self.url, err)
+        finally:
+            self._refreshing = None
+
+    async def refresh(self):
+        """Fetch the keys in a thread, concurrent calls share the same fetch."""
+        if self._refreshing is None:
+            self._refreshing = asyncio.ensure_future(self._refresh())
+        await asyncio.shield(self._refreshing)
+
+    async def fetch_key(self, kid):
+        """Return the rsa key for a kid, refetch the keys if it is unknown."""
+        self.start()
+        if kid not in self._keys and (
+            self._refreshing is not None or self._can_refetch()
+        ):
+            await self.refresh()
+        return self.get_key(kid)
+
+    def start(self):
+        """Start refreshing the keys in the background."""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._refresh_periodically())
+
+    def stop(self):
+        """Stop refreshing the keys in the background."""
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+    async def _refresh_periodically(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self.refresh()
+
+
+jwks_store = JWKSKeyStore()
+
+
+def get_rsa_key(kid, refresh=False):
+    """Return an rsa key."""
+    rsa_key = jwks_store.get_key(kid)
+    if not rsa_key and refresh:
+        jwks_store.refresh_sync()
+        rsa_key = jwks_store.get_key(kid)
     return rsa_key
 
 
@@ -165,7 +273,7 @@ def valid_token(authorization: str, request: Optional[Request] = None):
 
         # Get RSA key
         rsa_key = get_rsa_key(unverified_header["kid"], refresh=False)
-        # Try to refresh jwks if failed
+        # Try to refresh jwks if failed (at most once per refetch interval)
         if not rsa_key:
             rsa_key = get_rsa_key(unverified_header["kid"], refresh=True)
 
@@ -205,8 +313,75 @@ def valid_token(authorization: str, request: Optional[Request] = None):
         raise HTTPException(status_code=401, detail=traceback.format_exc()) from err
 
 
-def parse_token(authorization):
+class TokenCache:
+    """Represent a bounded cache of verified token claims.
+
+    Entries are keyed by the digest of the token, they expire with the token
+    and the least recently used entry is evicted when the cache is full.
+    """
+
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE):
+        """Set up instance."""
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # digest: (expires_at, claims)
+
+    @staticmethod
+    def _digest(token):
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def get(self, token):
+        """Return a copy of the cached claims, or None if not found or expired."""
+        digest = self._digest(token)
+        entry = self._entries.get(digest)
+        if entry is not None:
+            expires_at, claims = entry
+            if expires_at is None or expires_at > time.time():
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return dict(claims)
+            del self._entries[digest]
+        self.misses += 1
+        return None
+
+    def put(self, token, claims, expires_at=None):
+        """Cache the verified claims of a token until it expires."""
+        if self.maxsize <= 0 or (expires_at is not None and expires_at <= time.time()):
+            return
+        digest = self._digest(token)
+        self._entries[digest] = (expires_at, dict(claims))
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all the cached tokens."""
+        self._entries.clear()
+
+    def get_stats(self):
+        """Return the cache statistics."""
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+token_cache = TokenCache()
+
+
+async def parse_token(authorization):
     """Parse the token."""
+    start = time.perf_counter()
+    try:
+        return await _parse_token(authorization)
+    finally:
+        token_parse_latency.observe(time.perf_counter() - start)
+
+
+async def _parse_token(authorization):
     parts = authorization.split()
     if parts[0].lower() != "bearer":
         raise Exception("Authorization header must start with" " Bearer")
@@ -216,12 +391,26 @@ def parse_token(authorization):
         raise Exception("Authorization header must be 'Bearer' token")
 
     token = parts[1]
+    user_info = token_cache.get(token)
+    if user_info is not None:
+        return user_info
+
     if not token.startswith("imjoy@"):
-        # auth0 token
-        return get_user_info(valid_token(authorization))
-    # generated token
-    token = token.lstrip("imjoy@")
-    return jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        # auth0 token, make sure the signing key is available
+        # so valid_token does not need to fetch it and block the loop
+        try:
+            await jwks_store.fetch_key(jwt.get_unverified_header(token).get("kid"))
+        except jwt.JWTError:
+            pass  # let valid_token report the invalid token
+        verified_token = valid_token(authorization)
+        user_info = get_user_info(verified_token)
+        expires_at = verified_token.credentials.get("exp")
+    else:
+        # generated token
+        user_info = jwt.decode(token.lstrip("imjoy@"), JWT_SECRET, algorithms=["HS256"])
+        expires_at = user_info.get("expires_at")
+    token_cache.put(token, user_info, expires_at)
+    return user_info
 
 
 def generate_presigned_token(user_info: UserInfo, config: TokenConfig):
@@ -257,15 +446,98 @@ def generate_presigned_token(user_info: UserInfo, config: TokenConfig):
     return {"token": "imjoy@" + token, "id": uid}
 
 
+class PermissionCache:
+    """Represent the cached permission decisions per (workspace, user).
+
+    Decisions must be invalidated whenever the workspace settings or the
+    user (or one of its ancestors) change, see `invalidate_workspace` and
+    `invalidate_user`.
+    """
+
+    def __init__(self):
+        """Set up instance."""
+        self._decisions = {}  # (workspace name, user id): allowed
+        self._by_workspace = {}  # workspace name: decision keys
+        self._by_user = {}  # user id: decision keys, including its children's
+        self._members = {}  # (workspace name, field): set of the list field
+
+    def get(self, workspace_name, user_id):
+        """Return the cached decision, or None if there is none."""
+        return self._decisions.get((workspace_name, user_id))
+
+    def put(self, workspace_name, user_info, allowed):
+        """Cache a decision which depends on the user and its ancestors."""
+        key = (workspace_name, user_info.id)
+        self._decisions[key] = allowed
+        self._by_workspace.setdefault(workspace_name, set()).add(key)
+        self._by_user.setdefault(user_info.id, set()).add(key)
+        # the ancestors are loaded by load_parents before the checks
+        ancestors = set()
+        parent = user_info.parent
+        while parent and parent not in ancestors:
+            ancestors.add(parent)
+            self._by_user.setdefault(parent, set()).add(key)
+            ancestor = all_users.get(parent)
+            parent = ancestor.parent if ancestor is not None else None
+
+    def get_members(self, workspace, field):
+        """Return a set with the entries of a list field of the workspace."""
+        key = (workspace.name, field)
+        members = self._members.get(key)
+        if members is None:
+            members = set(getattr(workspace, field) or [])
+            self._members[key] = members
+        return members
+
+    def invalidate_workspace(self, workspace_name):
+        """Drop the decisions for a workspace."""
+        for key in self._by_workspace.pop(workspace_name, ()):
+            self._decisions.pop(key, None)
+        for field in ("owners", "allow_list", "deny_list"):
+            self._members.pop((workspace_name, field), None)
+
+    def invalidate_user(self, user_id):
+        """Drop the decisions for a user and the users it is an ancestor of."""
+        for key in self._by_user.pop(user_id, ()):
+            self._decisions.pop(key, None)
+
+    def clear(self):
+        """Drop all the decisions."""
+        self._decisions.clear()
+        self._by_workspace.clear()
+        self._by_user.clear()
+        self._members.clear()
+
+
+permission_cache = PermissionCache()
+
+
+async def load_parents(user_info):
+    """Load the parents of a user from the backend, check_permission uses them."""
+    while user_info is not None and user_info.parent:
+        user_info = await all_users.load(user_info.parent)
+
+
 def check_permission(workspace, user_info):
     """Check user permission for a workspace."""
-    # pylint: disable=too-many-return-statements
     if isinstance(workspace, str):
-        workspace = all_workspaces.get(workspace)
+        workspace_name = workspace
+        workspace = all_workspaces.get(workspace_name)
         if not workspace:
-            logger.warning("Workspace %s not found", workspace)
+            logger.warning("Workspace %s not found", workspace_name)
             return False
 
+    allowed = permission_cache.get(workspace.name, user_info.id)
+    if allowed is None:
+        start = time.perf_counter()
+        allowed = _check_permission(workspace, user_info)
+        permission_check_latency.observe(time.perf_counter() - start)
+        permission_cache.put(workspace.name, user_info, allowed)
+    return allowed
+
+
+def _check_permission(workspace, user_info):
+    # pylint: disable=too-many-return-statements
     if workspace.name == user_info.id:
         return True
 
@@ -283,14 +555,14 @@ def check_permission(workspace, user_info):
 
     _id = user_info.email or user_info.id
 
-    if _id in workspace.owners:
+    if _id in permission_cache.get_members(workspace, "owners"):
         return True
 
     if workspace.visibility == VisibilityEnum.public:
-        if user_info.email not in workspace.deny_list:
+        if user_info.email not in permission_cache.get_members(workspace, "deny_list"):
             return True
     elif workspace.visibility == VisibilityEnum.protected:
-        if user_info.email in workspace.allow_list:
+        if user_info.email in permission_cache.get_members(workspace, "allow_list"):
             return True
 
     if "admin" in user_info.roles:
@@ -3,24 +3,159 @@ import asyncio
 import logging
 import sys
 import time
+from collections import deque
 
 from imjoy_rpc.utils import MessageEmitter, dotdict
 
+from imjoy.core.metrics import (
+    dropped_messages,
+    outbound_queue_depth,
+    relayed_bytes,
+    relayed_messages,
+)
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 logging.basicConfig(stream=sys.stdout)
 logger = logging.getLogger("core-connection")
 logger.setLevel(logging.WARNING)
 
 all_connections = {}
 
+# keys kept in the clear in binary frames, the rest is packed with msgpack
+FRAME_HEADER_KEYS = ("type", "plugin_id", "peer_id", "target_id", "access_token")
+# bytes values from this size are sent as separate binary attachments
+MIN_ATTACHMENT_SIZE = 1024
+# msgpack extension type referring to an attachment by its index
+ATTACHMENT_EXT_TYPE = 1
+
+
+def _detach_buffers(value, buffers):
+    """Replace the large bytes values by references to attachments."""
+    if isinstance(value, dict):
+        return {key: _detach_buffers(item, buffers) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_detach_buffers(item, buffers) for item in value]
+    if isinstance(value, bytes) and len(value) >= MIN_ATTACHMENT_SIZE:
+        buffers.append(value)
+        return msgpack.ExtType(ATTACHMENT_EXT_TYPE, str(len(buffers) - 1).encode())
+    return value
+
+
+def encode_frame(msg):
+    """Encode a message as a binary frame.
+
+    The frame keeps the routing keys as they are and packs the rest of the
+    message with msgpack. The large bytes values are not copied into the
+    packed body, they are listed in `_buffers` and sent by socketio as
+    separate binary attachments.
+    """
+    header = {}
+    body = {}
+    for key, value in msg.items():
+        if key in FRAME_HEADER_KEYS:
+            header[key] = value
+        else:
+            body[key] = value
+    buffers = []
+    header["_msgpack"] = msgpack.packb(
+        _detach_buffers(body, buffers), use_bin_type=True
+    )
+    if buffers:
+        header["_buffers"] = buffers
+    return header
+
+
+def decode_frame(frame):
+    """Decode a binary frame into a message."""
+    if msgpack is None:
+        raise Exception("Binary frames require msgpack, please install it.")
+    buffers = frame.get("_buffers", ())
+
+    def attach(code, data):
+        if code == ATTACHMENT_EXT_TYPE:
+            return buffers[int(data)]
+        return msgpack.ExtType(code, data)
+
+    msg = msgpack.unpackb(frame["_msgpack"], raw=False, ext_hook=attach)
+    for key in FRAME_HEADER_KEYS:
+        if key in frame:
+            msg[key] = frame[key]
+    return msg
+
 
 class BasicConnection(MessageEmitter):
-    """Represent a base connection."""
+    """Represent a base connection.
+
+    Outbound messages go through a queue served by a single writer task.
+    When the queue reaches `high_watermark` messages the connection is
+    paused and the `overflow_policy` applies:
+     - "await": the message is queued, producers should `await drain()`
+       which returns once the queue is back to `low_watermark`
+     - "drop": the message is dropped and counted in `dropped`
+     - "disconnect": the queue is cleared and "disconnected" is fired
+
+    The frames relayed to another peer are queued by that peer, which
+    makes the relaying connection `congested` while that queue is paused,
+    `drain()` then waits for it as well.
+
+    Batching is enabled by setting `batch_window` (in seconds) and/or
+    `batch_size`, messages emitted within the window (or until the size
+    is reached) are then sent in order as a single frame:
+    `{"type": "batch", "peer_id": ..., "messages": [...]}`.
 
-    def __init__(self, send):
+    With `encoding="msgpack"` the frames are sent as binary frames,
+    see `encode_frame`. Binary frames are always accepted when msgpack
+    is installed.
+
+    A connection can be suspended while its peer is away, the messages
+    are then kept in the queue and sent once it is resumed. Nothing can
+    drain the queue meanwhile, so the "await" policy drops the messages
+    beyond `high_watermark` like the "drop" policy.
+    """
+
+    # pylint: disable=too-many-instance-attributes, too-many-arguments
+
+    def __init__(
+        self,
+        send,
+        batch_window=None,
+        batch_size=None,
+        high_watermark=None,
+        low_watermark=None,
+        overflow_policy="await",
+        encoding="json",
+    ):
         """Set up instance."""
         super().__init__(logger)
+        if overflow_policy not in ("await", "drop", "disconnect"):
+            raise ValueError(f"Invalid overflow policy: {overflow_policy}")
+        if encoding not in ("json", "msgpack"):
+            raise ValueError(f"Invalid encoding: {encoding}")
+        if encoding == "msgpack" and msgpack is None:
+            raise Exception("The msgpack encoding requires msgpack, please install it.")
+        self.encoding = encoding
         self.plugin_config = dotdict()
         self._send = send
+        self._batch_window = batch_window
+        self._batch_size = batch_size
+        self._high_watermark = high_watermark
+        if low_watermark is None and high_watermark is not None:
+            low_watermark = high_watermark // 2
+        self._low_watermark = low_watermark or 0
+        self._overflow_policy = overflow_policy
+        self._queue = deque()
+        self._writer = None
+        self._writable = None
+        self.paused = False
+        self.suspended = False
+        self._congested_peers = set()
+        # target peer id: values of the relayed messages and bytes metrics
+        self._relay_stats = {}
+        self.dropped = 0
         self._access_token = None
         self._expires_in = None
         self._plugin_origin = "*"
@@ -68,17 +203,47 @@ class BasicConnection(MessageEmitter):
         """Handle a message."""
         target_id = data.get("target_id")
         if target_id and self.peer_id and target_id != self.peer_id:
-            conn = all_connections[target_id]
-            if conn:
-                conn._fire(data.type, data)  # pylint: disable=protected-access
-            else:
-                logger.warning(
-                    "Connection with target_id %s not found, discarding data: %s",
-                    target_id,
-                    data,
-                )
-        else:
-            self._fire(data["type"], data)
+            self._relay(target_id, data)
+            return
+        if "_msgpack" in data:
+            data = decode_frame(data)
+        if data.get("type") == "batch":
+            for message in data["messages"]:
+                self.handle_message(message)
+            return
+        self._fire(data["type"], data)
+
+    def _relay(self, target_id, frame):
+        """Forward a frame to another peer without decoding its body."""
+        conn = all_connections.get(target_id)
+        if conn is None:
+            logger.warning(
+                "Connection with target_id %s not found, discarding data: %s",
+                target_id,
+                frame,
+            )
+            return
+        stats = self._relay_stats.get(target_id)
+        if stats is None:
+            stats = self._relay_stats[target_id] = (
+                relayed_messages.labels(self.peer_id, target_id),
+                relayed_bytes.labels(self.peer_id, target_id),
+            )
+        stats[0].value += 1
+        if "_msgpack" in frame:
+            stats[1].value += len(frame["_msgpack"]) + sum(
+                len(buffer) for buffer in frame.get("_buffers", ())
+            )
+            if conn.encoding != "msgpack":
+                frame = decode_frame(frame)
+        # only the header is copied, it gets the peer id and the access token
+        # of the receiver like the messages emitted to it
+        frame = dict(frame)
+        frame.pop("access_token", None)
+        frame["peer_id"] = target_id
+        conn.emit(frame)
+        if conn.paused:
+            self._congested_peers.add(conn)
 
     def connect(self):
         """Connect."""
@@ -97,9 +262,136 @@ class BasicConnection(MessageEmitter):
 
             msg["access_token"] = self._access_token
         msg["peer_id"] = msg.get("peer_id") or self.peer_id
-        asyncio.ensure_future(self._send(msg))
+        self._enqueue(msg)
+
+    def _enqueue(self, msg):
+        """Queue a message or an already encoded frame to be sent."""
+        if self._high_watermark and len(self._queue) >= self._high_watermark:
+            policy = self._overflow_policy
+            if policy == "await" and self.suspended:
+                # nothing drains the queue before the connection is resumed
+                policy = "drop"
+            else:
+                self.paused = True
+            if policy == "drop":
+                self.dropped += 1
+                dropped_messages.inc()
+                logger.warning("Send queue of %s is full, dropping data", self.peer_id)
+                return
+            if policy == "disconnect":
+                outbound_queue_depth.dec(len(self._queue))
+                self._queue.clear()
+                self._set_writable()
+                logger.error("Send queue of %s is full, disconnecting", self.peer_id)
+                self._fire(
+                    "disconnected",
+                    {"error": True, "message": "The peer cannot keep up"},
+                )
+                return
+        self._queue.append(msg)
+        outbound_queue_depth.inc()
+        if self._writer is None and not self.suspended:
+            self._writer = asyncio.ensure_future(self._write())
+
+    @property
+    def queue_size(self):
+        """Return the number of messages waiting to be sent."""
+        return len(self._queue)
+
+    def _next_frame(self):
+        if self._batch_window is None and self._batch_size is None:
+            frame = self._queue.popleft()
+            outbound_queue_depth.dec()
+        else:
+            count = min(len(self._queue), self._batch_size or len(self._queue))
+            messages = [self._queue.popleft() for _ in range(count)]
+            outbound_queue_depth.dec(count)
+            if len(messages) == 1:
+                frame = messages[0]
+            else:
+                frame = {"type": "batch", "peer_id": self.peer_id, "messages": messages}
+        if self.encoding == "msgpack" and "_msgpack" not in frame:
+            try:
+                return encode_frame(frame)
+            except (TypeError, ValueError, OverflowError) as err:
+                # fall back to a regular frame for data msgpack cannot handle
+                logger.warning("Failed to encode a binary frame: %s", err)
+        return frame
+
+    async def _write(self):
+        """Send the queued messages in order."""
+        try:
+            while self._queue and not self.suspended:
+                if self._batch_window and (
+                    not self._batch_size or len(self._queue) < self._batch_size
+                ):
+                    await asyncio.sleep(self._batch_window)
+                if not self._queue:
+                    break
+                frame = self._next_frame()
+                try:
+                    await self._send(frame)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception("Failed to send data to %s", self.peer_id)
+                if self.paused and len(self._queue) <= self._low_watermark:
+                    self._set_writable()
+        finally:
+            self._writer = None
+            self._set_writable()
+
+    def _set_writable(self):
+        self.paused = False
+        if self._writable is not None:
+            self._writable.set()
+
+    @property
+    def congested(self):
+        """Return whether this queue or the queue of a relay target is paused."""
+        return self.paused or bool(self._congested_peers)
 
-    def disconnect(self, details):
+    async def drain(self):
+        """Wait until the send queue is back to the low watermark.
+
+        The queues of the peers which got frames relayed while paused are
+        drained as well.
+        """
+        while self.paused:
+            if self._writable is None:
+                self._writable = asyncio.Event()
+            self._writable.clear()
+            await self._writable.wait()
+        while self._congested_peers:
+            await self._congested_peers.pop().drain()
+
+    def suspend(self):
+        """Keep the outgoing messages in the queue until resumed."""
+        self.suspended = True
+
+    def resume(self):
+        """Send the messages queued while suspended."""
+        self.suspended = False
+        if self._queue and self._writer is None:
+            self._writer = asyncio.ensure_future(self._write())
+
+    def disconnect(self, details=None):
         """Disconnect the plugin."""
+        if self.suspended:
+            # the peer is gone, the queued messages will never be sent
+            outbound_queue_depth.dec(len(self._queue))
+            self._queue.clear()
+            self._set_writable()
         if self.peer_id and self.peer_id in all_connections:
             del all_connections[self.peer_id]
+        self._remove_relay_stats()
+
+    def _remove_relay_stats(self):
+        """Remove the relay metrics from and to this peer."""
+        for target_id in self._relay_stats:
+            relayed_messages.remove(self.peer_id, target_id)
+            relayed_bytes.remove(self.peer_id, target_id)
+        self._relay_stats.clear()
+        for conn in all_connections.values():
+            # pylint: disable=protected-access
+            if conn._relay_stats.pop(self.peer_id, None) is not None:
+                relayed_messages.remove(conn.peer_id, self.peer_id)
+                relayed_bytes.remove(conn.peer_id, self.peer_id)
@@ -1,23 +1,77 @@
 """Provide interface functions for the core."""
+import asyncio
+import inspect
 import logging
 import sys
-from functools import partial
+from functools import partial, wraps
+from os import environ as env
 from typing import Optional
 
 from imjoy.core import (
     TokenConfig,
     WorkspaceInfo,
+    all_users,
     all_workspaces,
     current_plugin,
     current_user,
     current_workspace,
 )
-from imjoy.core.auth import check_permission, generate_presigned_token
+from imjoy.core.auth import (
+    check_permission,
+    generate_presigned_token,
+    load_parents,
+    permission_cache,
+)
+from imjoy.core.limits import (
+    WORKSPACE_CONCURRENCY_LIMIT,
+    ConcurrencyLimiter,
+    limit_calls,
+)
+from imjoy.core.logs import LOG_LEVELS
 
 logging.basicConfig(stream=sys.stdout)
 logger = logging.getLogger("imjoy-core")
 logger.setLevel(logging.INFO)
 
+# seconds get_plugin waits for a plugin which is still initializing
+PLUGIN_READY_TIMEOUT = float(env.get("PLUGIN_READY_TIMEOUT", "30"))
+
+
+async def _await_in_workspace(awaitable, workspace):
+    """Await a result with the current workspace set to a workspace."""
+    token = current_workspace.set(workspace)
+    try:
+        return await awaitable
+    finally:
+        current_workspace.reset(token)
+
+
+def _remote_kwargs(func):
+    """Accept the keyword arguments of remote calls.
+
+    imjoy-rpc passes them as a trailing dict, it is unpacked when a dict
+    is not expected at its position and its keys are parameter names.
+    """
+    params = list(inspect.signature(func).parameters.values())
+    names = {param.name for param in params}
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if args and isinstance(args[-1], dict) and not kwargs:
+            index = len(args) - 1
+            expects_dict = index < len(params) and params[index].annotation is dict
+            if not expects_dict and set(args[-1]) <= names:
+                return func(*args[:-1], **args[-1])
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _caller_priority():
+    """Return the priority of the calls made by the current plugin."""
+    plugin = current_plugin.get(None)
+    return (plugin.config.get("priority") or 0) if plugin else 0
+
 
 class CoreInterface:
     """Represent the interface of the ImJoy core."""
@@ -35,39 +89,77 @@ class CoreInterface:
         service.provider = plugin.name
         service.providerId = plugin.id
         service._rintf = True
+        if workspace._limiter is None:
+            workspace._limiter = ConcurrencyLimiter(
+                workspace.concurrency_limit or WORKSPACE_CONCURRENCY_LIMIT
+            )
+        limiters = (plugin.limiter, workspace._limiter)
+        # the calls going through the core are counted for load balancing
+        # and wait for a slot if the plugin or the workspace is at its limit
+        for key, value in list(service.items()):
+            if callable(value) and not key.startswith("_"):
+                service[key] = workspace._services.track(
+                    plugin.id, limit_calls(value, limiters, _caller_priority)
+                )
         workspace._services.append(service)
 
-    def get_plugin(self, name):
-        """Return a plugin by its name."""
+    @_remote_kwargs
+    async def get_plugin(self, name: str, timeout: Optional[float] = None):
+        """Return a plugin by its name, wait until it is ready."""
         workspace = current_workspace.get()
 
         if name in workspace._plugins:
-            return workspace._plugins[name].api
+            timeout = PLUGIN_READY_TIMEOUT if timeout is None else timeout
+            try:
+                return await workspace._plugins[name].get_api(timeout)
+            except asyncio.TimeoutError:
+                raise Exception(
+                    f"Plugin {name} is not ready after {timeout}s"
+                ) from None
         raise Exception(f"Plugin {name} not found")
 
     def get_services(self, query: dict):
         """Return a list of services based on the query."""
         workspace = current_workspace.get()
-        ret = []
-        for service in workspace._services:
-            match = True
-            for key in query:
-                if service[key] != query[key]:
-                    match = False
-            if match:
-                ret.append(service)
-        return ret
+        return workspace._services.query(query)
+
+    @_remote_kwargs
+    def get_service(self, query: dict, strategy: str = "round-robin"):
+        """Return one of the services matching the query, balancing the load."""
+        workspace = current_workspace.get()
+        service = workspace._services.select(query, strategy)
+        if service is None:
+            raise Exception(f"Service not found: {query}")
+        return service
 
     def log(self, msg):
         """Log a plugin message."""
         plugin = current_plugin.get()
+        plugin._logs.append("info", msg)
         logger.info("%s: %s", plugin.name, msg)
 
     def error(self, msg):
         """Log a plugin error message."""
         plugin = current_plugin.get()
+        plugin._logs.append("error", msg)
         logger.error("%s: %s", plugin.name, msg)
 
+    @_remote_kwargs
+    def get_logs(
+        self,
+        plugin: str,
+        since: Optional[float] = None,
+        level: Optional[str] = None,
+        limit: Optional[int] = None,
+    ):
+        """Return the latest log entries of a plugin in the current workspace."""
+        workspace = current_workspace.get()
+        if plugin not in workspace._plugins:
+            raise Exception(f"Plugin {plugin} not found")
+        if level is not None and level not in LOG_LEVELS:
+            raise Exception(f"Invalid log level: {level}")
+        return workspace._plugins[plugin]._logs.get(since, level, limit)
+
     def generate_token(self, config: Optional[dict] = None):
         """Generate a token for the current workspace."""
         workspace = current_workspace.get()
@@ -78,11 +170,11 @@ class CoreInterface:
         token_config = TokenConfig.parse_obj(config)
         return generate_presigned_token(current_user.get(), token_config)
 
-    def create_workspace(self, config: dict):
+    async def create_workspace(self, config: dict):
         """Create a new workspace."""
         config["persistent"] = config.get("persistent") or False
         workspace = WorkspaceInfo.parse_obj(config)
-        if workspace.name in all_workspaces:
+        if await all_workspaces.load(workspace.name) is not None:
             raise Exception(f"Workspace {workspace.name} already exists.")
         if workspace.authorizer:
             raise Exception("Workspace authorizer is not supported yet.")
@@ -93,44 +185,54 @@ class CoreInterface:
             workspace.owners.append(_id)
         workspace.owners = [o.strip() for o in workspace.owners if o.strip()]
         user_info.scopes.append(workspace.name)
-        all_workspaces[workspace.name] = workspace
-        return self.get_workspace(workspace.name)
+        await all_users.save(user_info.id)
+        await all_workspaces.put(workspace.name, workspace)
+        permission_cache.invalidate_workspace(workspace.name)
+        permission_cache.invalidate_user(user_info.id)
+        return await self.get_workspace(workspace.name)
 
-    def _update_workspace(self, name, config: dict):
+    async def _update_workspace(self, name, config: dict):
         """Bind the context to the generated workspace."""
         if not name:
             raise Exception("Workspace name is not specified.")
-        if name not in all_workspaces:
+        workspace = await all_workspaces.load(name)
+        if workspace is None:
             raise Exception(f"Workspace {name} not found")
-        workspace = all_workspaces[name]
         user_info = current_user.get()
+        await load_parents(user_info)
         if not check_permission(workspace, user_info):
             raise PermissionError(f"Permission denied for workspace {name}")
 
         if "name" in config:
             raise Exception("Changing workspace name is not allowed.")
 
-        # make sure all the keys are valid
-        # TODO: verify the type
+        # make sure all the keys and values are valid
         for key in config:
             if key.startswith("_") or not hasattr(workspace, key):
                 raise KeyError(f"Invalid key: {key}")
+        updated = WorkspaceInfo.parse_obj(dict(workspace.dict(), **config))
 
         for key in config:
-            if not key.startswith("_") and hasattr(workspace, key):
-                setattr(workspace, key, config[key])
+            setattr(workspace, key, getattr(updated, key))
+        if "concurrency_limit" in config and workspace._limiter is not None:
+            workspace._limiter.resize(
+                workspace.concurrency_limit or WORKSPACE_CONCURRENCY_LIMIT
+            )
         # make sure we add the user's email to owners
         _id = user_info.email or user_info.id
         if _id not in workspace.owners:
             workspace.owners.append(_id)
         workspace.owners = [o.strip() for o in workspace.owners if o.strip()]
+        permission_cache.invalidate_workspace(name)
+        await all_workspaces.save(name)
 
-    def get_workspace(self, name: str):
+    async def get_workspace(self, name: str):
         """Bind the context to the generated workspace."""
-        if name not in all_workspaces:
+        workspace = await all_workspaces.load(name)
+        if workspace is None:
             raise Exception(f"Workspace {name} not found")
-        workspace = all_workspaces[name]
         user_info = current_user.get()
+        await load_parents(user_info)
         if not check_permission(workspace, user_info):
             raise PermissionError(f"Permission denied for workspace {name}")
 
@@ -149,6 +251,9 @@ class CoreInterface:
                         raise exp
                     finally:
                         current_workspace.set(workspace_bk)
+                    if inspect.isawaitable(ret):
+                        # coroutines run after the context is restored
+                        return _await_in_workspace(ret, workspace)
                     return ret
 
                 bound_interface[key] = partial(wrap_func, interface[key])
@@ -170,9 +275,13 @@ class CoreInterface:
             "register_service": self.register_service,
             "getServices": self.get_services,
             "get_services": self.get_services,
+            "getService": self.get_service,
+            "get_service": self.get_service,
             "utils": {},
             "getPlugin": self.get_plugin,
             "get_plugin": self.get_plugin,
+            "getLogs": self.get_logs,
+            "get_logs": self.get_logs,
             "generateToken": self.generate_token,
             "generate_token": self.generate_token,
             "create_workspace": self.create_workspace,
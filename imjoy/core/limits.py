@@ -0,0 +1,131 @@
+"""Provide concurrency limits for the calls going through the core."""
+import asyncio
+import heapq
+import inspect
+import itertools
+import time
+from os import environ as env
+
+from imjoy.core import metrics
+
+# maximum number of concurrent calls to the services of a plugin, 0 for no limit
+PLUGIN_CONCURRENCY_LIMIT = int(env.get("PLUGIN_CONCURRENCY_LIMIT", "0"))
+# maximum number of concurrent calls to the services of a workspace
+WORKSPACE_CONCURRENCY_LIMIT = int(env.get("WORKSPACE_CONCURRENCY_LIMIT", "0"))
+# maximum number of calls waiting for a slot, they are rejected beyond it
+CALL_QUEUE_MAX_DEPTH = int(env.get("CALL_QUEUE_MAX_DEPTH", "1000"))
+# seconds a call can wait for a slot, 0 to wait forever
+CALL_QUEUE_TIMEOUT = float(env.get("CALL_QUEUE_TIMEOUT", "60"))
+
+
+class ConcurrencyLimiter:
+    """Represent a limit of concurrent calls with a queue for the extra calls.
+
+    The waiting calls get the free slots by priority (higher first), and in
+    arrival order for the same priority. A call is rejected if the queue is
+    full, or if it waits for longer than the timeout.
+    """
+
+    def __init__(self, limit=None, max_depth=None, timeout=None):
+        """Set up instance."""
+        self.limit = limit or None
+        self.max_depth = CALL_QUEUE_MAX_DEPTH if max_depth is None else max_depth
+        self.timeout = CALL_QUEUE_TIMEOUT if timeout is None else timeout
+        self.active = 0
+        self._queue = []  # heap of (-priority, arrival, future)
+        self._arrivals = itertools.count()
+
+    @property
+    def queue_size(self):
+        """Return the number of calls waiting for a slot."""
+        return len(self._queue)
+
+    async def acquire(self, priority=0):
+        """Wait for a free slot."""
+        if self.limit is None or (self.active < self.limit and not self._queue):
+            self.active += 1
+            return
+        if len(self._queue) >= self.max_depth:
+            metrics.rejected_calls.inc()
+            raise Exception(f"Too many calls waiting for a slot (max {self.max_depth})")
+        future = asyncio.get_event_loop().create_future()
+        entry = (-priority, next(self._arrivals), future)
+        heapq.heappush(self._queue, entry)
+        metrics.queued_calls.inc()
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(future, self.timeout or None)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as err:
+            if future.done() and not future.cancelled():
+                # the slot was handed over meanwhile, pass it on
+                self.release()
+            elif entry in self._queue:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                metrics.queued_calls.dec()
+            if isinstance(err, asyncio.TimeoutError):
+                metrics.rejected_calls.inc()
+                raise Exception(
+                    f"The call waited for a slot for more than {self.timeout}s"
+                ) from None
+            raise
+        finally:
+            metrics.call_queue_time.observe(time.perf_counter() - start)
+
+    def release(self):
+        """Free a slot, or hand it over to the next waiting call."""
+        if self.limit is None or self.active <= self.limit:
+            if self._hand_over():
+                return
+        self.active -= 1
+
+    def resize(self, limit):
+        """Change the limit, the waiting calls get the new free slots."""
+        self.limit = limit or None
+        while self.limit is None or self.active < self.limit:
+            self.active += 1
+            if not self._hand_over():
+                self.active -= 1
+                break
+
+    def _hand_over(self):
+        """Give a slot to the next waiting call, return False if there is none."""
+        while self._queue:
+            _, _, future = heapq.heappop(self._queue)
+            metrics.queued_calls.dec()
+            if not future.done():
+                future.set_result(None)
+                return True
+        return False
+
+
+def limit_calls(func, limiters, get_priority=None):
+    """Wrap a function to wait for a slot of each limiter before calling it.
+
+    The limiters without a limit are skipped, the calls go straight to the
+    function if none of them has one (a limit can be set later by `resize`).
+    """
+
+    async def call(*args):
+        if all(limiter.limit is None for limiter in limiters):
+            result = func(*args)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        priority = get_priority() if get_priority else 0
+        acquired = []
+        try:
+            for limiter in limiters:
+                if limiter.limit is None:
+                    continue
+                await limiter.acquire(priority)
+                acquired.append(limiter)
+            result = func(*args)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        finally:
+            for limiter in reversed(acquired):
+                limiter.release()
+
+    return call
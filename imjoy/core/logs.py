@@ -0,0 +1,79 @@
+"""Provide the log history of the plugins."""
+import time
+from array import array
+from os import environ as env
+
+LOG_LEVELS = ("debug", "info", "warning", "error")
+PLUGIN_LOG_CAPACITY = int(env.get("PLUGIN_LOG_CAPACITY", "1000"))
+
+
+class LogBuffer:
+    """Represent a fixed-capacity ring buffer of log entries.
+
+    The timestamps and levels are kept in compact arrays, the oldest
+    entries are overwritten once the capacity is reached. Entries are
+    addressed by their sequence number, which keeps increasing.
+    """
+
+    def __init__(self, capacity=None):
+        """Set up instance."""
+        self.capacity = PLUGIN_LOG_CAPACITY if capacity is None else capacity
+        if self.capacity < 1:
+            raise ValueError(f"Invalid log capacity: {self.capacity}")
+        self._times = array("d", [0.0]) * self.capacity
+        self._levels = bytearray(self.capacity)
+        self._values = [None] * self.capacity
+        self._count = 0  # sequence number of the next entry
+
+    def __len__(self):
+        """Return the number of entries kept."""
+        return min(self._count, self.capacity)
+
+    @property
+    def first(self):
+        """Return the sequence number of the oldest entry kept."""
+        return self._count - len(self)
+
+    def append(self, level, value, timestamp=None):
+        """Append an entry, overwrite the oldest one if full."""
+        index = self._count % self.capacity
+        self._times[index] = timestamp or time.time()
+        self._levels[index] = LOG_LEVELS.index(level)
+        self._values[index] = value
+        self._count += 1
+
+    def _entry(self, seq):
+        index = seq % self.capacity
+        return {
+            "seq": seq,
+            "time": self._times[index],
+            "level": LOG_LEVELS[self._levels[index]],
+            "value": self._values[index],
+        }
+
+    def _find(self, since):
+        """Return the sequence number of the first entry logged at or after since."""
+        low, high = self.first, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._times[middle % self.capacity] < since:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get(self, since=None, level=None, limit=None):
+        """Return the latest entries matching the query, oldest first.
+
+        `since` is a timestamp, `level` the minimum severity.
+        """
+        start = self.first if since is None else self._find(since)
+        min_level = LOG_LEVELS.index(level) if level else 0
+        entries = []
+        seq = self._count - 1
+        while seq >= start and (limit is None or len(entries) < limit):
+            if self._levels[seq % self.capacity] >= min_level:
+                entries.append(self._entry(seq))
+            seq -= 1
+        entries.reverse()
+        return entries
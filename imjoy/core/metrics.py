@@ -0,0 +1,249 @@
+"""Provide the metrics of the core server in the prometheus text format."""
+import asyncio
+import time
+from bisect import bisect_left
+
+# the metrics are rendered in the order they are created
+REGISTRY = []
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+def _format_labels(names, values, extra=""):
+    labels = [
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\""),
+        )
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        """Increment the value."""
+        self.value += amount
+
+    def dec(self, amount=1):
+        """Decrement the value."""
+        self.value -= amount
+
+    def set(self, value):
+        """Set the value."""
+        self.value = value
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Count the value in its bucket."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Metric:
+    """Represent a metric with optional labels.
+
+    The values of each label combination are created on first use and
+    updated in place, so recording a value is a dict lookup at most.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        """Set up instance."""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            self._default = self.labels()
+        (REGISTRY if registry is None else registry).append(self)
+
+    def _create(self):  # pylint: disable=no-self-use
+        return _Value()
+
+    def labels(self, *values):
+        """Return the value of a label combination."""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._create()
+        return child
+
+    def remove(self, *values):
+        """Remove the value of a label combination."""
+        self._children.pop(values, None)
+
+    def _samples(self, values, child):
+        yield self.name + _format_labels(self.labelnames, values), child.value
+
+    def collect(self):
+        """Return the lines of the metric in the text format."""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for values, child in list(self._children.items()):
+            for sample, value in self._samples(values, child):
+                lines.append(f"{sample} {value}")
+        return lines
+
+
+class Counter(Metric):
+    """Represent a counter."""
+
+    type = "counter"
+
+    @property
+    def value(self):
+        """Return the value without labels."""
+        return self._default.value
+
+    def inc(self, amount=1):
+        """Increment the counter without labels."""
+        self._default.value += amount
+
+
+class Gauge(Metric):
+    """Represent a gauge."""
+
+    type = "gauge"
+
+    @property
+    def value(self):
+        """Return the value without labels."""
+        return self._default.value
+
+    def inc(self, amount=1):
+        """Increment the gauge without labels."""
+        self._default.value += amount
+
+    def dec(self, amount=1):
+        """Decrement the gauge without labels."""
+        self._default.value -= amount
+
+    def set(self, value):
+        """Set the gauge without labels."""
+        self._default.value = value
+
+
+class Histogram(Metric):
+    """Represent a histogram."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name,
+        documentation,
+        labelnames=(),
+        buckets=LATENCY_BUCKETS,
+        registry=None,
+    ):  # pylint: disable=too-many-arguments
+        """Set up instance."""
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _create(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        """Observe a value without labels."""
+        self._default.observe(value)
+
+    def _samples(self, values, child):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), child.counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, f'le="{bound}"')
+            yield f"{self.name}_bucket{labels}", cumulative
+        labels = _format_labels(self.labelnames, values)
+        yield f"{self.name}_sum{labels}", child.sum
+        yield f"{self.name}_count{labels}", cumulative
+
+
+def generate_latest(registry=None):
+    """Return all the metrics in the text format."""
+    lines = []
+    for metric in REGISTRY if registry is None else registry:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+plugin_messages = Counter(
+    "imjoy_plugin_messages_total",
+    "Messages dispatched to the plugins.",
+    ["workspace"],
+)
+plugin_message_latency = Histogram(
+    "imjoy_plugin_message_latency_seconds",
+    "Time spent handling a sample of the plugin messages, including backpressure.",
+)
+plugin_registrations = Counter(
+    "imjoy_plugin_registrations_total", "Plugin registration requests."
+)
+disconnections = Counter("imjoy_disconnections_total", "Disconnected sessions.")
+sessions = Gauge("imjoy_sessions", "Connected sessions.")
+users = Gauge("imjoy_users", "Users with at least one session.")
+workspaces = Gauge("imjoy_workspaces", "Workspaces with at least one plugin.")
+plugins = Gauge("imjoy_plugins", "Registered plugins.")
+parked_plugins = Gauge(
+    "imjoy_parked_plugins", "Plugins of disconnected users waiting to be resumed."
+)
+plugin_resumptions = Counter(
+    "imjoy_plugin_resumptions_total", "Plugins resumed by a new session."
+)
+permission_check_latency = Histogram(
+    "imjoy_permission_check_seconds", "Time spent checking workspace permissions."
+)
+token_parse_latency = Histogram(
+    "imjoy_token_parse_seconds", "Time spent parsing authentication tokens."
+)
+outbound_queue_depth = Gauge(
+    "imjoy_outbound_queue_depth", "Messages waiting in the send queues."
+)
+dropped_messages = Counter(
+    "imjoy_dropped_messages_total", "Messages dropped because a send queue was full."
+)
+relayed_messages = Counter(
+    "imjoy_relayed_messages_total",
+    "Frames relayed from a peer to another one.",
+    ["source", "target"],
+)
+relayed_bytes = Counter(
+    "imjoy_relayed_bytes_total",
+    "Bytes of the binary frames relayed from a peer to another one.",
+    ["source", "target"],
+)
+queued_calls = Gauge("imjoy_queued_calls", "Calls waiting for a concurrency slot.")
+call_queue_time = Histogram(
+    "imjoy_call_queue_seconds", "Time spent by the calls waiting for a slot."
+)
+rejected_calls = Counter(
+    "imjoy_rejected_calls_total",
+    "Calls rejected because the queue was full or the wait timed out.",
+)
+event_loop_lag = Gauge(
+    "imjoy_event_loop_lag_seconds", "Delay of the last event loop lag probe."
+)
+
+
+async def monitor_event_loop_lag(interval=1.0):
+    """Measure how late the event loop wakes up a sleeping task."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        event_loop_lag.set(max(time.perf_counter() - start - interval, 0.0))
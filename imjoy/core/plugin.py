@@ -7,6 +7,9 @@ import uuid
 from imjoy_rpc.rpc import RPC
 from imjoy_rpc.utils import ContextLocal, dotdict
 
+from imjoy.core.limits import PLUGIN_CONCURRENCY_LIMIT, ConcurrencyLimiter
+from imjoy.core.logs import LOG_LEVELS, LogBuffer
+
 logging.basicConfig(stream=sys.stdout)
 logger = logging.getLogger("dynamic-plugin")
 logger.setLevel(logging.INFO)
@@ -27,12 +30,18 @@ class DynamicPlugin:
         self.name = self.config.name
         self.initializing = False
         self._disconnected = True
-        self._log_history = []
+        self._logs = LogBuffer(workspace.log_capacity)
+        # limits the concurrent calls to the services of the plugin
+        self.limiter = ConcurrencyLimiter(
+            self.config.concurrency_limit or PLUGIN_CONCURRENCY_LIMIT
+        )
         self.connection = connection
         self.authorizer = None
         self.api = None
         self.running = False
         self.terminating = False
+        # resolved once the rpc is set up, shared by the callers waiting for it
+        self._ready = self.loop.create_future()
 
         # Note: we don't need to bind the interface
         # to the plugin as we do in the js version
@@ -50,9 +59,20 @@ class DynamicPlugin:
             if "error" in data:
                 self.error(data["error"])
                 logger.error("Plugin failed to initialize: %s", data["error"])
+                self._set_ready(Exception(data["error"]))
                 raise Exception(data["error"])
 
-            asyncio.ensure_future(self._setup_rpc(connection, data["config"]))
+            task = asyncio.ensure_future(self._setup_rpc(connection, data["config"]))
+            task.add_done_callback(setup_done)
+
+        def setup_done(task):
+            """Resolve the readiness of the plugin once the rpc is set up."""
+            if task.cancelled():
+                return
+            error = task.exception()
+            if error is not None:
+                logger.error("Failed to set up plugin %s: %s", self.name, error)
+            self._set_ready(error)
 
         self.connection.on("initialized", initialized)
         self.connection.connect()
@@ -106,25 +126,44 @@ class DynamicPlugin:
 
     def error(self, *args):
         """Log an error."""
-        self._log_history.append({"type": "error", "value": args})
+        self._logs.append("error", " ".join(map(str, args)))
         logger.error("Error in Plugin %s: $%s", self.id, args)
 
     def log(self, *args):
         """Log."""
         if isinstance(args[0], dict):
-            self._log_history.append(args[0])
+            level = args[0].get("type")
+            self._logs.append(level if level in LOG_LEVELS else "info", args[0])
             logger.info("Plugin $%s:%s", self.id, args[0])
         else:
             msg = " ".join(map(str, args))
-            self._log_history.append({"type": "info", "value": msg})
+            self._logs.append("info", msg)
             logger.info("Plugin $%s: $%s", self.id, msg)
 
+    def _set_ready(self, error=None):
+        """Resolve the readiness of the plugin, or fail it with an error."""
+        if self._ready.done():
+            return
+        if error is None:
+            self._ready.set_result(None)
+        else:
+            self._ready.set_exception(error)
+            # the error should not be reported if nobody waits for the plugin
+            self._ready.exception()
+
+    async def get_api(self, timeout=None):
+        """Return the api of the plugin, wait until it is set up."""
+        # a caller timing out does not cancel the wait of the others
+        await asyncio.wait_for(asyncio.shield(self._ready), timeout)
+        return self.api
+
     def _set_disconnected(self):
         """Set disconnected state."""
         self._disconnected = True
         self.running = False
         self.initializing = False
         self.terminating = False
+        self._set_ready(Exception(f"Plugin {self.name} is disconnected"))
 
     def _register_rpc_events(self):
         """Register rpc events."""
@@ -0,0 +1,95 @@
+"""Provide the routing table for plugin messages."""
+from contextvars import copy_context
+from typing import Any, Callable, Dict, NamedTuple, Set
+
+from imjoy.core import current_plugin, current_user, current_workspace, metrics
+
+
+class Route(NamedTuple):
+    """Represent a resolved route from a session to a plugin."""
+
+    workspace: str
+    user_id: str
+    connection: Any
+    dispatch: Callable
+    messages: Any  # value of the message counter of the workspace
+
+
+def _set_context(user_info, plugin, workspace):
+    current_user.set(user_info)
+    current_plugin.set(plugin)
+    current_workspace.set(workspace)
+
+
+def create_route(user_info, plugin, workspace):
+    """Create a route which dispatches messages within a bound context.
+
+    Each message runs in a fresh copy of the bound context, so the context
+    variables set while handling a message do not leak into the next one.
+    """
+    ctx = copy_context()
+    ctx.run(_set_context, user_info, plugin, workspace)
+    connection = plugin.connection
+    handle_message = connection.handle_message
+
+    def dispatch(data):
+        return ctx.copy().run(handle_message, data)
+
+    return Route(
+        workspace.name,
+        user_info.id,
+        connection,
+        dispatch,
+        metrics.plugin_messages.labels(workspace.name),
+    )
+
+
+class RoutingTable:
+    """Represent the routes from (session id, plugin id) to plugins.
+
+    Routes do not hold permission decisions, callers should check that
+    the permission of the user for the workspace is still granted.
+    """
+
+    def __init__(self):
+        """Set up instance."""
+        self._routes: Dict[str, Dict[str, Route]] = {}  # sid: plugin id: route
+        self._by_plugin: Dict[str, Set[str]] = {}  # plugin id: sids
+
+    def get(self, sid, plugin_id):
+        """Return the route, or None if there is none."""
+        routes = self._routes.get(sid)
+        if routes is None:
+            return None
+        return routes.get(plugin_id)
+
+    def add(self, sid, plugin_id, route):
+        """Add a route."""
+        self._routes.setdefault(sid, {})[plugin_id] = route
+        self._by_plugin.setdefault(plugin_id, set()).add(sid)
+
+    def remove_session(self, sid):
+        """Remove the routes of a session."""
+        for plugin_id in self._routes.pop(sid, {}):
+            sids = self._by_plugin.get(plugin_id)
+            if sids is not None:
+                sids.discard(sid)
+                if not sids:
+                    del self._by_plugin[plugin_id]
+
+    def remove_plugin(self, plugin_id):
+        """Remove the routes to a plugin."""
+        for sid in self._by_plugin.pop(plugin_id, ()):
+            routes = self._routes.get(sid)
+            if routes is not None:
+                routes.pop(plugin_id, None)
+                if not routes:
+                    del self._routes[sid]
+
+    def clear(self):
+        """Remove all the routes."""
+        self._routes.clear()
+        self._by_plugin.clear()
+
+
+routing_table = RoutingTable()
@@ -0,0 +1,189 @@
+"""Provide an indexed registry for services."""
+import inspect
+import itertools
+import random
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+INDEXED_KEYS = ("name", "type", "provider", "providerId")
+STRATEGIES = ("round-robin", "least-in-flight", "random")
+# number of queries whose round-robin position is kept
+CURSOR_CACHE_SIZE = 1024
+
+
+def _is_hashable(value):
+    """Return True if the value can be used as an index key."""
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+class ServiceRegistry:
+    """Represent the services of a workspace, indexed for fast lookups.
+
+    Services are indexed by `name`, `type`, `provider` and `providerId`,
+    a query starts from the smallest candidate set among its indexed keys
+    and the remaining keys are only checked against those candidates.
+    Results are returned in registration order.
+
+    The calls in flight are counted per provider for the functions wrapped
+    with `track`, `select` uses them to spread the calls over the providers
+    of the same service.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, indexed_keys=INDEXED_KEYS):
+        """Set up instance."""
+        self._counter = itertools.count()
+        self._services: Dict[int, Any] = {}  # service id: service
+        self._ids: Dict[int, int] = {}  # id(service): service id
+        self._indexed_keys = tuple(indexed_keys)
+        # key: value: service ids
+        self._index: Dict[str, Dict[Any, Set[int]]] = {
+            key: {} for key in self._indexed_keys
+        }
+        # key: service ids whose value for the key cannot be hashed
+        self._unhashable: Dict[str, Set[int]] = {
+            key: set() for key in self._indexed_keys
+        }
+        self.in_flight: Counter = Counter()  # provider id: calls in flight
+        self._cursors: OrderedDict = OrderedDict()  # query: round-robin position
+
+    def __len__(self):
+        """Return the number of services."""
+        return len(self._services)
+
+    def __iter__(self) -> Iterator[Any]:
+        """Iterate over the services in registration order."""
+        return iter(list(self._services.values()))
+
+    def __contains__(self, service):
+        """Return True if the service is registered."""
+        return id(service) in self._ids
+
+    def append(self, service):
+        """Register a service."""
+        if id(service) in self._ids:
+            return
+        sid = next(self._counter)
+        self._services[sid] = service
+        self._ids[id(service)] = sid
+        for key in self._indexed_keys:
+            if key not in service:
+                continue
+            value = service[key]
+            if _is_hashable(value):
+                self._index[key].setdefault(value, set()).add(sid)
+            else:
+                self._unhashable[key].add(sid)
+
+    def remove(self, service):
+        """Remove a service, raise ValueError if it is not registered."""
+        sid = self._ids.get(id(service))
+        if sid is None:
+            raise ValueError("Service is not registered.")
+        self._remove(sid)
+
+    def _remove(self, sid):
+        service = self._services.pop(sid)
+        del self._ids[id(service)]
+        for key in self._indexed_keys:
+            if key not in service:
+                continue
+            value = service[key]
+            if _is_hashable(value):
+                ids = self._index[key].get(value)
+                if ids is not None:
+                    ids.discard(sid)
+                    if not ids:
+                        del self._index[key][value]
+            else:
+                self._unhashable[key].discard(sid)
+        return service
+
+    def remove_by_provider(self, provider_id: str) -> List[Any]:
+        """Remove all the services registered by a provider."""
+        self.in_flight.pop(provider_id, None)
+        ids = self._index.get("providerId", {}).get(provider_id)
+        if not ids:
+            return []
+        return [self._remove(sid) for sid in sorted(ids)]
+
+    def _candidates(self, query: dict) -> Optional[Set[int]]:
+        """Return the candidate service ids, or None if a full scan is needed."""
+        candidates = None
+        for key in self._indexed_keys:
+            if key not in query:
+                continue
+            value = query[key]
+            if _is_hashable(value):
+                ids = self._index[key].get(value, set()) | self._unhashable[key]
+            else:
+                ids = self._unhashable[key]
+            if candidates is None or len(ids) < len(candidates):
+                candidates = ids
+            if not candidates:
+                break
+        return candidates
+
+    def query(self, query: dict) -> List[Any]:
+        """Return the services matching all the key/values in the query."""
+        candidates = self._candidates(query)
+        if candidates is None:
+            services = self._services.values()
+        else:
+            services = [self._services[sid] for sid in sorted(candidates)]
+        return [
+            service
+            for service in services
+            if all(key in service and service[key] == query[key] for key in query)
+        ]
+
+    def track(self, provider_id: str, func):
+        """Wrap a function of a service to count its calls in flight."""
+
+        async def call(*args):
+            self.in_flight[provider_id] += 1
+            try:
+                result = func(*args)
+                if inspect.isawaitable(result):
+                    result = await result
+                return result
+            finally:
+                self.in_flight[provider_id] -= 1
+                if self.in_flight[provider_id] <= 0:
+                    del self.in_flight[provider_id]
+
+        return call
+
+    def _next_cursor(self, query: dict) -> int:
+        key = repr(sorted(query.items()))
+        cursor = self._cursors.pop(key, 0)
+        self._cursors[key] = cursor + 1
+        if len(self._cursors) > CURSOR_CACHE_SIZE:
+            self._cursors.popitem(last=False)
+        return cursor
+
+    def select(self, query: dict, strategy: str = "round-robin") -> Optional[Any]:
+        """Return one of the services matching the query, None if there is none.
+
+        The strategy is one of "round-robin", "least-in-flight" (ties are
+        taken in turn) or "random".
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Invalid strategy: {strategy}")
+        services = self.query(query)
+        if not services:
+            return None
+        if strategy == "random":
+            return random.choice(services)
+        start = self._next_cursor(query) % len(services)
+        services = services[start:] + services[:start]
+        if strategy == "least-in-flight":
+            return min(
+                services, key=lambda service: self.in_flight[service.get("providerId")]
+            )
+        return services[0]
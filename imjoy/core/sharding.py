@@ -0,0 +1,368 @@
+"""Provide the sharding of workspaces across server nodes."""
+import asyncio
+import bisect
+import hashlib
+import logging
+import pickle
+import sys
+import time
+import uuid
+from os import environ as env
+
+from imjoy.core.store import (
+    call_backend,
+    encode_command,
+    open_redis_connection,
+    read_reply_async,
+)
+
+logging.basicConfig(stream=sys.stdout)
+logger = logging.getLogger("imjoy-sharding")
+logger.setLevel(logging.INFO)
+
+NODE_HEARTBEAT_INTERVAL = float(env.get("NODE_HEARTBEAT_INTERVAL", "5"))
+# a node is considered gone if it has not sent a heartbeat for this long
+NODE_TIMEOUT = float(env.get("NODE_TIMEOUT", "15"))
+NODE_REQUEST_TIMEOUT = float(env.get("NODE_REQUEST_TIMEOUT", "30"))
+
+
+class HashRing:
+    """Represent a consistent hash ring of nodes.
+
+    Each node is placed at several points (replicas) of the ring, a key
+    belongs to the first node found clockwise from its hash. Adding or
+    removing a node only moves the keys of its neighbouring points.
+    """
+
+    def __init__(self, nodes=(), replicas=64):
+        """Set up instance."""
+        self.replicas = replicas
+        self._points = []  # sorted hashes
+        self._nodes = {}  # hash: node
+        for node in nodes:
+            self.add_node(node)
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.sha1(key.encode("utf-8")).digest()[:8], "big")
+
+    @property
+    def nodes(self):
+        """Return the nodes of the ring."""
+        return set(self._nodes.values())
+
+    def add_node(self, node):
+        """Add a node to the ring."""
+        for index in range(self.replicas):
+            point = self._hash(f"{node}#{index}")
+            if point not in self._nodes:
+                bisect.insort(self._points, point)
+            self._nodes[point] = node
+
+    def remove_node(self, node):
+        """Remove a node from the ring."""
+        for index in range(self.replicas):
+            point = self._hash(f"{node}#{index}")
+            if self._nodes.get(point) == node:
+                del self._nodes[point]
+                del self._points[bisect.bisect_left(self._points, point)]
+
+    def get_node(self, key):
+        """Return the node of a key, or None if the ring is empty."""
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._nodes[self._points[index]]
+
+
+async def _never_busy(workspace):  # pylint: disable=unused-argument
+    return False
+
+
+class Cluster:  # pylint: disable=too-many-instance-attributes
+    """Represent the membership of the nodes and the workspace assignments.
+
+    The nodes send heartbeats to the state backend, the workspaces are
+    assigned to the nodes with a consistent hash ring and the assignments
+    are stored in the backend so a busy workspace stays on its node when
+    the ring changes. The leader (the first alive node) moves the idle
+    workspaces and the workspaces of the nodes which left.
+    The blocking backends are called in the backend thread, the ring and the
+    cached assignments are only changed in the event loop.
+    """
+
+    def __init__(self, backend, node_id=None, is_busy=None):
+        """Set up instance."""
+        self.backend = backend
+        self.node_id = node_id or str(uuid.uuid4())
+        self.is_busy = is_busy or _never_busy  # coroutine function
+        self.ring = HashRing([self.node_id])
+        self._owners = {}  # workspace: node id
+        self._last_heartbeat = time.time()
+        self._channel = None
+        self._heartbeat_task = None
+
+    async def start(self, handler):
+        """Join the cluster, the handler serves the requests of other nodes."""
+        self._channel = NodeChannel(self.backend.uri, self.node_id, handler)
+        await self._channel.start()
+        await self.heartbeat()
+        self._heartbeat_task = asyncio.ensure_future(self._heartbeat_periodically())
+        logger.info("Node %s joined the cluster", self.node_id)
+
+    async def stop(self):
+        """Leave the cluster."""
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        if self._channel is not None:
+            await self._channel.stop()
+        await self.leave()
+
+    async def _heartbeat_periodically(self):
+        while True:
+            await asyncio.sleep(NODE_HEARTBEAT_INTERVAL)
+            try:
+                await self.heartbeat()
+            except (OSError, ConnectionError) as err:
+                logger.error("Failed to send the heartbeat: %s", err)
+
+    async def request(self, node_id, method, *args):
+        """Send a request to another node and return its result."""
+        return await self._channel.request(node_id, method, *args)
+
+    @property
+    def nodes(self):
+        """Return the alive nodes."""
+        return self.ring.nodes
+
+    @property
+    def is_leader(self):
+        """Return True if this node moves the workspaces."""
+        return min(self.nodes) == self.node_id
+
+    async def _call(self, func, *args):
+        return await call_backend(self.backend.blocking, func, *args)
+
+    async def heartbeat(self, now=None):
+        """Update the alive nodes, return True if they changed."""
+        now = now or time.time()
+        self._last_heartbeat = now
+        alive = await self._call(self._alive_nodes, now)
+        # the leader may have moved some workspaces
+        self._owners.clear()
+        if alive == self.nodes:
+            return False
+        for node in self.nodes - alive:
+            self.ring.remove_node(node)
+        for node in alive - self.nodes:
+            self.ring.add_node(node)
+        logger.info("Nodes changed: %s", sorted(alive))
+        if self.is_leader:
+            await self.rebalance()
+        return True
+
+    def _alive_nodes(self, now):
+        """Send the heartbeat of this node and return the alive nodes."""
+        self.backend.set("nodes", self.node_id, str(now))
+        alive = {self.node_id}
+        for node in self.backend.keys("nodes"):
+            last_seen = self.backend.get("nodes", node)
+            if last_seen is not None and now - float(last_seen) < NODE_TIMEOUT:
+                alive.add(node)
+            elif node != self.node_id:
+                self.backend.delete("nodes", node)
+        return alive
+
+    async def leave(self):
+        """Remove this node from the cluster."""
+        await self._call(self.backend.delete, "nodes", self.node_id)
+
+    async def rebalance(self):
+        """Move the workspaces which are not on their ring node if possible."""
+        moved = 0
+        for workspace, node in (await self._call(self._assignments)).items():
+            target = self.ring.get_node(workspace)
+            if node == target:
+                continue
+            if node not in self.nodes or not await self.is_busy(workspace):
+                await self._call(self.backend.set, "shards", workspace, target)
+                moved += 1
+        if moved:
+            logger.info("Moved %d workspace(s)", moved)
+        return moved
+
+    def _assignments(self):
+        return {
+            workspace: self.backend.get("shards", workspace)
+            for workspace in self.backend.keys("shards")
+        }
+
+    async def get_owner(self, workspace):
+        """Return the node of a workspace, assign it if needed."""
+        node = self._owners.get(workspace)
+        if node is None:
+            node = await self._call(
+                self._assign, workspace, self.ring.get_node(workspace), self.nodes
+            )
+            self._owners[workspace] = node
+        return node
+
+    def _assign(self, workspace, target, nodes):
+        """Return the node of a workspace, assign it to the target if needed."""
+        node = self.backend.get("shards", workspace)
+        if node is None:
+            # another node may assign it at the same time
+            if self.backend.setnx("shards", workspace, target):
+                return target
+            return self.backend.get("shards", workspace)
+        if node not in nodes and not self._seen_recently(node):
+            self.backend.set("shards", workspace, target)
+            return target
+        return node
+
+    def _seen_recently(self, node):
+        """Return True if a node sent a heartbeat, e.g. it joined since ours."""
+        last_seen = self.backend.get("nodes", node)
+        return (
+            last_seen is not None
+            and self._last_heartbeat - float(last_seen) < NODE_TIMEOUT
+        )
+
+    async def remove_workspace(self, workspace):
+        """Remove the assignment of a deleted workspace."""
+        self._owners.pop(workspace, None)
+        await self._call(self.backend.delete, "shards", workspace)
+
+
+class NodeChannel:
+    """Represent the internal channel for the requests between the nodes.
+
+    Each node subscribes to its own pub/sub channel, requests and
+    responses are matched by their ids.
+    """
+
+    def __init__(self, uri, node_id, handler):
+        """Set up instance."""
+        self.uri = uri
+        self.node_id = node_id
+        self.handler = handler
+        self._pub = None
+        self._pub_lock = None
+        self._futures = {}  # request id: future
+        self._task = None
+
+    @staticmethod
+    def _channel(node_id):
+        return f"imjoy-node:{node_id}"
+
+    async def _subscribe(self):
+        reader, writer = await open_redis_connection(self.uri)
+        writer.write(encode_command("SUBSCRIBE", self._channel(self.node_id)))
+        await read_reply_async(reader)
+        return reader, writer
+
+    async def start(self):
+        """Subscribe to the channel of this node."""
+        self._pub_lock = asyncio.Lock()
+        subscription = await self._subscribe()
+        self._task = asyncio.ensure_future(self._listen(subscription))
+
+    async def stop(self):
+        """Unsubscribe and fail the pending requests."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._pub is not None:
+            self._pub[1].close()
+            self._pub = None
+        for future in self._futures.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Node channel closed"))
+
+    async def _publish(self, node_id, message):
+        payload = pickle.dumps(message)
+        async with self._pub_lock:
+            for retry in (True, False):
+                try:
+                    if self._pub is None:
+                        self._pub = await open_redis_connection(self.uri)
+                    reader, writer = self._pub
+                    writer.write(
+                        encode_command("PUBLISH", self._channel(node_id), payload)
+                    )
+                    return await read_reply_async(reader)
+                except (OSError, ConnectionError, asyncio.IncompleteReadError):
+                    self._pub = None
+                    if not retry:
+                        raise
+        return 0
+
+    async def request(self, node_id, method, *args):
+        """Send a request to a node and return its result."""
+        request_id = str(uuid.uuid4())
+        future = asyncio.get_event_loop().create_future()
+        self._futures[request_id] = future
+        try:
+            receivers = await self._publish(
+                node_id,
+                {
+                    "type": "request",
+                    "id": request_id,
+                    "from": self.node_id,
+                    "method": method,
+                    "args": args,
+                },
+            )
+            if not receivers:
+                raise ConnectionError(f"Node {node_id} is not available")
+            return await asyncio.wait_for(future, NODE_REQUEST_TIMEOUT)
+        finally:
+            del self._futures[request_id]
+
+    async def _listen(self, subscription):
+        retry_sleep = 1
+        while True:
+            reader, writer = subscription
+            try:
+                await self._receive(reader)
+            except (OSError, ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                logger.error(
+                    "Node channel of %s disconnected, retrying in %s s",
+                    self.node_id,
+                    retry_sleep,
+                )
+                await asyncio.sleep(retry_sleep)
+                try:
+                    subscription = await self._subscribe()
+                    retry_sleep = 1
+                except OSError:
+                    retry_sleep = min(retry_sleep * 2, 60)
+
+    async def _receive(self, reader):
+        while True:
+            reply = await read_reply_async(reader)
+            if reply[0] != b"message":
+                continue
+            message = pickle.loads(reply[2])
+            if message["type"] == "request":
+                # the requests are started in order, like socketio events
+                asyncio.ensure_future(self._handle(message))
+                continue
+            future = self._futures.get(message["id"])
+            if future is None or future.done():
+                continue
+            if "error" in message:
+                future.set_exception(Exception(message["error"]))
+            else:
+                future.set_result(message["result"])
+
+    async def _handle(self, message):
+        try:
+            result = await self.handler(message["method"], *message["args"])
+            response = {"type": "response", "id": message["id"], "result": result}
+        except Exception as err:  # pylint: disable=broad-except
+            logger.exception("Failed to handle %s: %s", message["method"], err)
+            response = {"type": "response", "id": message["id"], "error": str(err)}
+        await self._publish(message["from"], response)
@@ -0,0 +1,678 @@
+"""Provide the shared state backends."""
+import asyncio
+import logging
+import pickle
+import socket
+import sqlite3
+import sys
+import threading
+import uuid
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import urlparse
+
+from socketio.asyncio_pubsub_manager import AsyncPubSubManager
+
+logging.basicConfig(stream=sys.stdout)
+logger = logging.getLogger("imjoy-store")
+logger.setLevel(logging.INFO)
+
+# the blocking backends are called in one thread, so their calls keep their order
+backend_executor = ThreadPoolExecutor(  # pylint: disable=consider-using-with
+    1, thread_name_prefix="imjoy-backend"
+)
+
+
+class RedisError(Exception):
+    """Represent an error reply from a redis server."""
+
+
+def encode_command(*args):
+    """Encode a command with the redis serialization protocol (RESP)."""
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode("utf-8")
+        elif isinstance(arg, int):
+            arg = str(arg).encode("utf-8")
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+def _parse_line(line):
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("Connection closed by the redis server")
+    return line[:1], line[1:-2]
+
+
+def read_reply(fil):
+    """Read a reply from a file-like object."""
+    prefix, rest = _parse_line(fil.readline())
+    if prefix == b"+":
+        return rest.decode("utf-8")
+    if prefix == b"-":
+        raise RedisError(rest.decode("utf-8"))
+    if prefix == b":":
+        return int(rest)
+    if prefix == b"$":
+        if int(rest) < 0:
+            return None
+        return fil.read(int(rest) + 2)[:-2]
+    if prefix == b"*":
+        if int(rest) < 0:
+            return None
+        return [read_reply(fil) for _ in range(int(rest))]
+    raise RedisError(f"Invalid reply: {prefix + rest}")
+
+
+async def read_reply_async(reader):
+    """Read a reply from an asyncio stream reader."""
+    prefix, rest = _parse_line(await reader.readline())
+    if prefix == b"+":
+        return rest.decode("utf-8")
+    if prefix == b"-":
+        raise RedisError(rest.decode("utf-8"))
+    if prefix == b":":
+        return int(rest)
+    if prefix == b"$":
+        if int(rest) < 0:
+            return None
+        return (await reader.readexactly(int(rest) + 2))[:-2]
+    if prefix == b"*":
+        if int(rest) < 0:
+            return None
+        return [await read_reply_async(reader) for _ in range(int(rest))]
+    raise RedisError(f"Invalid reply: {prefix + rest}")
+
+
+def parse_redis_uri(uri):
+    """Return the host, port, password and db of a redis uri."""
+    parsed = urlparse(uri)
+    db_name = parsed.path.lstrip("/")
+    return (
+        parsed.hostname or "localhost",
+        parsed.port or 6379,
+        parsed.password,
+        int(db_name) if db_name else 0,
+    )
+
+
+async def call_backend(blocking, func, *args):
+    """Call a function using the backends, in the backend thread if they block."""
+    if not blocking:
+        return func(*args)
+    return await asyncio.get_event_loop().run_in_executor(
+        backend_executor, partial(func, *args)
+    )
+
+
+async def open_redis_connection(uri):
+    """Open an asyncio connection to a redis server."""
+    host, port, password, db_index = parse_redis_uri(uri)
+    reader, writer = await asyncio.open_connection(host, port)
+    if password:
+        writer.write(encode_command("AUTH", password))
+        await read_reply_async(reader)
+    if db_index:
+        writer.write(encode_command("SELECT", db_index))
+        await read_reply_async(reader)
+    return reader, writer
+
+
+class MemoryBackend:
+    """Represent a state backend which lives in the current process."""
+
+    shared = False
+    blocking = False
+
+    def __init__(self):
+        """Set up instance."""
+        self._data = {}  # namespace: key: value
+
+    def get(self, namespace, key):
+        """Return the value of a key, or None if not found."""
+        return self._data.get(namespace, {}).get(key)
+
+    def set(self, namespace, key, value):
+        """Set the value of a key."""
+        self._data.setdefault(namespace, {})[key] = value
+
+    def setnx(self, namespace, key, value):
+        """Set the value of a key if it does not exist, return True if set."""
+        values = self._data.setdefault(namespace, {})
+        if key in values:
+            return False
+        values[key] = value
+        return True
+
+    def delete(self, namespace, key):
+        """Delete a key, return True if it existed."""
+        return self._data.get(namespace, {}).pop(key, None) is not None
+
+    def keys(self, namespace):
+        """Return the keys of a namespace."""
+        return list(self._data.get(namespace, {}))
+
+    def incr(self, namespace, key, amount=1):
+        """Increment the integer value of a key and return it."""
+        value = int(self.get(namespace, key) or 0) + amount
+        self.set(namespace, key, str(value))
+        return value
+
+
+class RedisBackend:  # pylint: disable=too-many-instance-attributes
+    """Represent a state backend stored in a redis server.
+
+    Each namespace is stored as a redis hash named `<prefix>:<namespace>`.
+    Only the commands PING, AUTH, SELECT, HGET, HSET, HSETNX, HDEL, HKEYS and
+    HINCRBY are used, so any server speaking the redis protocol can be used.
+    """
+
+    shared = True
+    blocking = True
+
+    def __init__(self, uri, prefix="imjoy", timeout=5):
+        """Set up instance."""
+        self.uri = uri
+        self.prefix = prefix
+        self.timeout = timeout
+        self._host, self._port, self._password, self._db = parse_redis_uri(uri)
+        self._lock = threading.Lock()
+        self._socket = None
+        self._file = None
+
+    def _connect(self):
+        self._socket = socket.create_connection(
+            (self._host, self._port), timeout=self.timeout
+        )
+        self._file = self._socket.makefile("rb")
+        if self._password:
+            self._call("AUTH", self._password)
+        if self._db:
+            self._call("SELECT", self._db)
+
+    def _call(self, *args):
+        self._socket.sendall(encode_command(*args))
+        return read_reply(self._file)
+
+    def close(self):
+        """Close the connection."""
+        with self._lock:
+            if self._socket is not None:
+                self._file.close()
+                self._socket.close()
+                self._socket = None
+
+    def execute(self, *args):
+        """Execute a command and return the reply, reconnect once on failure."""
+        with self._lock:
+            for retry in (True, False):
+                try:
+                    if self._socket is None:
+                        self._connect()
+                    return self._call(*args)
+                except (OSError, ConnectionError):
+                    self._socket = None
+                    if not retry:
+                        raise
+        return None
+
+    def _name(self, namespace):
+        return f"{self.prefix}:{namespace}"
+
+    def get(self, namespace, key):
+        """Return the value of a key, or None if not found."""
+        value = self.execute("HGET", self._name(namespace), key)
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, namespace, key, value):
+        """Set the value of a key."""
+        self.execute("HSET", self._name(namespace), key, value)
+
+    def setnx(self, namespace, key, value):
+        """Set the value of a key if it does not exist, return True if set."""
+        return self.execute("HSETNX", self._name(namespace), key, value) == 1
+
+    def delete(self, namespace, key):
+        """Delete a key, return True if it existed."""
+        return self.execute("HDEL", self._name(namespace), key) > 0
+
+    def keys(self, namespace):
+        """Return the keys of a namespace."""
+        return [
+            key.decode("utf-8") for key in self.execute("HKEYS", self._name(namespace))
+        ]
+
+    def incr(self, namespace, key, amount=1):
+        """Increment the integer value of a key and return it."""
+        return self.execute("HINCRBY", self._name(namespace), key, amount)
+
+
+class SQLiteBackend:
+    """Represent a persistent backend stored in a SQLite database.
+
+    The database is opened in write-ahead log mode, so writes are appended
+    to the log instead of rewriting the database file, and several server
+    processes can share the same file.
+    """
+
+    shared = False
+    blocking = True
+
+    def __init__(self, path, timeout=5):
+        """Set up instance."""
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, timeout=timeout, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries (namespace TEXT, key TEXT, "
+            "value TEXT, PRIMARY KEY (namespace, key))"
+        )
+
+    def _execute(self, sql, *args):
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    def get(self, namespace, key):
+        """Return the value of a key, None if missing."""
+        rows = self._execute(
+            "SELECT value FROM entries WHERE namespace=? AND key=?", namespace, key
+        )
+        return rows[0][0] if rows else None
+
+    def set(self, namespace, key, value):
+        """Set the value of a key."""
+        self._execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", namespace, key, value
+        )
+
+    def delete(self, namespace, key):
+        """Delete a key, return True if it existed."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM entries WHERE namespace=? AND key=?", (namespace, key)
+            )
+            return cursor.rowcount > 0
+
+    def keys(self, namespace):
+        """Return the keys of a namespace."""
+        return [
+            row[0]
+            for row in self._execute(
+                "SELECT key FROM entries WHERE namespace=?", namespace
+            )
+        ]
+
+    def close(self):
+        """Close the database."""
+        self._conn.close()
+
+
+def create_store(uri):
+    """Create a persistent store from an uri, `sqlite://<path>` or `redis://...`."""
+    if uri.startswith("sqlite://"):
+        return SQLiteBackend(uri[len("sqlite://") :])
+    if uri.startswith("redis://"):
+        return RedisBackend(uri, prefix="imjoy-store")
+    raise ValueError(f"Unsupported store: {uri}")
+
+
+def create_backend(uri=None):
+    """Create a state backend from an uri, `memory` or `redis://...`."""
+    if not uri or uri == "memory":
+        return MemoryBackend()
+    if uri.startswith("redis://"):
+        return RedisBackend(uri)
+    raise ValueError(f"Unsupported state backend: {uri}")
+
+
+class SharedRegistry(Mapping):
+    """Represent a registry of models shared through a state backend.
+
+    The live objects (with their private attributes, e.g. plugins) are kept
+    in the current process, the backend holds their serialized fields so
+    other workers can `load` them. Reading the registry as a mapping only
+    sees the entries loaded in the process, it never waits for the backend.
+    In-place changes must be written to the backend with `save`.
+    The reference counts (`acquire`/`release`) let the workers decide when
+    an entry is no longer used by any of them.
+    The entries with a true `persistent` field are also written through to
+    the persistent store if there is one, and loaded from it by `load`,
+    e.g. after a restart.
+    The methods using the backend or the store are coroutines, the blocking
+    ones are called in the backend thread.
+    With a change feed, the saved and removed keys are published so the
+    other workers refresh their loaded copies.
+    """
+
+    def __init__(self, namespace, model, backend=None, store=None):
+        """Set up instance."""
+        self.namespace = namespace
+        self.model = model
+        self.backend = backend or MemoryBackend()
+        self.store = store
+        self.feed = None
+        self._local = {}
+        self._persisted = set()
+
+    def set_backend(self, backend):
+        """Switch to another backend and write the local entries to it."""
+        self.backend = backend
+        for key, value in self._local.items():
+            self._write(key, value.json(), getattr(value, "persistent", False))
+
+    def set_store(self, store):
+        """Set the persistent store of the entries."""
+        self.store = store
+        self._persisted = set()
+
+    @property
+    def _blocking(self):
+        return self.backend.blocking or (self.store is not None and self.store.blocking)
+
+    async def _call(self, func, *args):
+        return await call_backend(self._blocking, func, *args)
+
+    def __getitem__(self, key):
+        """Return an entry loaded in the process."""
+        return self._local[key]
+
+    def __iter__(self):
+        """Iterate over the keys of the entries loaded in the process."""
+        return iter(list(self._local))
+
+    def __len__(self):
+        """Return the number of entries loaded in the process."""
+        return len(self._local)
+
+    def loaded(self):
+        """Return the keys of the entries loaded in the process."""
+        return self._local.keys()
+
+    def forget(self, key):
+        """Drop the local copy of an entry, it stays in the backend."""
+        self._local.pop(key, None)
+
+    async def load(self, key):
+        """Return an entry, load it from the backend or the store if needed.
+
+        Return None if the entry does not exist.
+        """
+        value = self._local.get(key)
+        if value is None:
+            raw = await self._call(self._read, key)
+            # the entry may have been set while it was read
+            value = self._local.get(key)
+            if value is None and raw is not None:
+                value = self._local[key] = self.model.parse_raw(raw)
+        return value
+
+    def _read(self, key):
+        raw = self.backend.get(self.namespace, key) if self.backend.shared else None
+        if raw is None and self.store is not None:
+            raw = self.store.get(self.namespace, key)
+            if raw is None:
+                return None
+            self._persisted.add(key)
+            if self.backend.shared:
+                self.backend.set(self.namespace, key, raw)
+        return raw
+
+    async def put(self, key, value):
+        """Set an entry and write it to the backend."""
+        self._local[key] = value
+        await self.save(key)
+
+    async def save(self, key):
+        """Write an entry to the backend, and to the store if it is persistent."""
+        value = self._local[key]
+        # serialize now, the entry may change while it is written
+        await self._call(
+            self._write, key, value.json(), getattr(value, "persistent", False)
+        )
+        if self.feed is not None:
+            await self.feed.publish(self.namespace, key)
+
+    def _write(self, key, raw, persistent):
+        self.backend.set(self.namespace, key, raw)
+        if self.store is None:
+            return
+        if persistent:
+            self.store.set(self.namespace, key, raw)
+            self._persisted.add(key)
+        elif key in self._persisted:
+            self.store.delete(self.namespace, key)
+            self._persisted.discard(key)
+
+    async def remove(self, key):
+        """Delete an entry from the process and the backend.
+
+        Return True if it existed.
+        """
+        found = self._local.pop(key, None) is not None
+        found = await self._call(self._delete, key) or found
+        if self.feed is not None:
+            await self.feed.publish(self.namespace, key)
+        return found
+
+    async def refresh(self, key):
+        """Update the loaded copy of an entry changed by another worker.
+
+        The fields are updated in place and the private attributes are kept,
+        the copy is dropped if the entry was removed.
+        """
+        if key not in self._local:
+            return
+        raw = await self._call(self.backend.get, self.namespace, key)
+        value = self._local.get(key)
+        if value is None:
+            return
+        if raw is None:
+            del self._local[key]
+            return
+        changed = self.model.parse_raw(raw)
+        for name in changed.__fields__:
+            setattr(value, name, getattr(changed, name))
+
+    def _delete(self, key):
+        found = self.backend.delete(self.namespace, key)
+        self.backend.delete(f"{self.namespace}:refs", key)
+        if key in self._persisted:
+            self._persisted.discard(key)
+            found = self.store.delete(self.namespace, key) or found
+        return found
+
+    async def all_keys(self):
+        """Return the keys of the entries of all the workers and the store."""
+        return await self._call(self._keys, list(self._local))
+
+    def _keys(self, local_keys):
+        keys = dict.fromkeys(local_keys)
+        if self.backend.shared:
+            keys.update(dict.fromkeys(self.backend.keys(self.namespace)))
+        if self.store is not None:
+            keys.update(dict.fromkeys(self.store.keys(self.namespace)))
+        return list(keys)
+
+    async def references(self, key):
+        """Return the reference count of an entry."""
+        count = await self._call(self.backend.get, f"{self.namespace}:refs", key)
+        return int(count or 0)
+
+    async def acquire(self, key):
+        """Increment the reference count of an entry and return it."""
+        return await self._call(self.backend.incr, f"{self.namespace}:refs", key, 1)
+
+    async def release(self, key):
+        """Decrement the reference count of an entry and return it."""
+        return await self._call(self.backend.incr, f"{self.namespace}:refs", key, -1)
+
+
+class ChangeFeed:
+    """Represent the notifications of the registry changes between workers.
+
+    The registries publish the keys they save or remove, the other workers
+    refresh their loaded copies and call the callback of the registry, e.g.
+    to drop the cached permission decisions. It only needs the PUBLISH and
+    SUBSCRIBE commands of the redis protocol.
+    """
+
+    def __init__(self, uri, channel="imjoy-changes"):
+        """Set up instance."""
+        self.uri = uri
+        self.channel = channel
+        self.origin = str(uuid.uuid4())  # the own changes are skipped
+        self._registries = {}  # namespace: registry, callback
+        self._pub = None
+        self._pub_lock = None
+        self._task = None
+
+    def watch(self, registry, callback=None):
+        """Publish the changes of a registry and receive the other ones.
+
+        The callback is called with the key of each entry changed by another
+        worker, once the loaded copy is refreshed.
+        """
+        registry.feed = self
+        self._registries[registry.namespace] = registry, callback
+
+    async def _subscribe(self):
+        reader, writer = await open_redis_connection(self.uri)
+        writer.write(encode_command("SUBSCRIBE", self.channel))
+        await read_reply_async(reader)
+        return reader, writer
+
+    async def start(self):
+        """Subscribe to the changes of the other workers."""
+        self._pub_lock = asyncio.Lock()
+        subscription = await self._subscribe()
+        self._task = asyncio.ensure_future(self._listen(subscription))
+
+    async def stop(self):
+        """Unsubscribe from the changes."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._pub is not None:
+            self._pub[1].close()
+            self._pub = None
+
+    async def publish(self, namespace, key):
+        """Notify the other workers that an entry changed."""
+        if self._pub_lock is None:
+            self._pub_lock = asyncio.Lock()
+        payload = pickle.dumps((self.origin, namespace, key))
+        async with self._pub_lock:
+            for retry in (True, False):
+                try:
+                    if self._pub is None:
+                        self._pub = await open_redis_connection(self.uri)
+                    reader, writer = self._pub
+                    writer.write(encode_command("PUBLISH", self.channel, payload))
+                    await read_reply_async(reader)
+                    return
+                except (OSError, ConnectionError, asyncio.IncompleteReadError):
+                    self._pub = None
+                    if not retry:
+                        logger.error("Cannot publish to %s, giving up", self.uri)
+
+    async def _listen(self, subscription):
+        retry_sleep = 1
+        while True:
+            reader, writer = subscription
+            try:
+                while True:
+                    reply = await read_reply_async(reader)
+                    if reply[0] == b"message":
+                        self._received(*pickle.loads(reply[2]))
+            except (OSError, ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                logger.error("Change feed disconnected, retrying in %s s", retry_sleep)
+                await asyncio.sleep(retry_sleep)
+                try:
+                    subscription = await self._subscribe()
+                    retry_sleep = 1
+                except OSError:
+                    retry_sleep = min(retry_sleep * 2, 60)
+                    continue
+                # the changes published meanwhile were missed
+                for registry, callback in self._registries.values():
+                    for key in list(registry.loaded()):
+                        asyncio.ensure_future(self._refresh(registry, callback, key))
+
+    def _received(self, origin, namespace, key):
+        if origin == self.origin or namespace not in self._registries:
+            return
+        registry, callback = self._registries[namespace]
+        asyncio.ensure_future(self._refresh(registry, callback, key))
+
+    @staticmethod
+    async def _refresh(registry, callback, key):
+        try:
+            await registry.refresh(key)
+        except (OSError, ConnectionError) as err:
+            logger.error("Failed to refresh %s: %s", key, err)
+        if callback is not None:
+            callback(key)
+
+
+class RedisPubSubManager(AsyncPubSubManager):
+    """Represent a socketio client manager using redis pub/sub.
+
+    This lets several server workers deliver events to the clients
+    connected to any of them, it only needs the PUBLISH and SUBSCRIBE
+    commands of the redis protocol.
+    """
+
+    name = "imjoy-redis"
+
+    def __init__(self, uri, channel="imjoy-socketio", write_only=False):
+        """Set up instance."""
+        self.uri = uri
+        self._pub = None
+        self._sub = None
+        self._pub_lock = None
+        super().__init__(channel=channel, write_only=write_only)
+
+    async def _publish(self, data):
+        if self._pub_lock is None:
+            self._pub_lock = asyncio.Lock()
+        payload = pickle.dumps(data)
+        async with self._pub_lock:
+            for retry in (True, False):
+                try:
+                    if self._pub is None:
+                        self._pub = await open_redis_connection(self.uri)
+                    reader, writer = self._pub
+                    writer.write(encode_command("PUBLISH", self.channel, payload))
+                    return await read_reply_async(reader)
+                except (OSError, ConnectionError, asyncio.IncompleteReadError):
+                    self._pub = None
+                    if not retry:
+                        logger.error("Cannot publish to %s, giving up", self.uri)
+        return None
+
+    async def _listen(self):
+        retry_sleep = 1
+        while True:
+            try:
+                if self._sub is None:
+                    reader, writer = await open_redis_connection(self.uri)
+                    writer.write(encode_command("SUBSCRIBE", self.channel))
+                    await read_reply_async(reader)
+                    self._sub = reader, writer
+                reply = await read_reply_async(self._sub[0])
+                if reply[0] == b"message":
+                    return reply[2]
+            except (OSError, ConnectionError, asyncio.IncompleteReadError):
+                logger.error(
+                    "Cannot receive from %s, retrying in %s s", self.uri, retry_sleep
+                )
+                self._sub = None
+                await asyncio.sleep(retry_sleep)
+                retry_sleep = min(retry_sleep * 2, 60)
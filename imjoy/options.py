@@ -49,6 +49,35 @@ def parse_cmd_line(args=None):
         ),
     )
     parser.add_argument("--port", type=str, default="9527", help="server port")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes for the socketio server",
+    )
+    parser.add_argument(
+        "--state-backend",
+        type=str,
+        default=None,
+        help="state backend shared by the workers, memory or a redis uri",
+    )
+    parser.add_argument(
+        "--workspace-store",
+        type=str,
+        default=None,
+        help="store of the persistent workspaces, a sqlite://<path> or redis uri",
+    )
+    parser.add_argument(
+        "--enable-sharding",
+        action="store_true",
+        help="assign the workspaces to the server nodes sharing the state backend",
+    )
+    parser.add_argument(
+        "--node-id",
+        type=str,
+        default=None,
+        help="id of the server node for sharding, random if not set",
+    )
     parser.add_argument(
         "--workspace",
         type=str,
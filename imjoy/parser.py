@@ -0,0 +1,96 @@
+"""Provide a parser for the ImJoy plugin file format (.imjoy.html)."""
+import hashlib
+import re
+from collections import OrderedDict, namedtuple
+
+PARSER_CACHE_SIZE = 128
+
+Block = namedtuple("Block", ["name", "attrs", "content"])
+
+OPEN_TAG = re.compile(r"\s*<([a-zA-Z][\w-]*)((?:\s[^>]*)?)>")
+ATTRIBUTE = re.compile(
+    r"""([^\s=/>"']+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+)))?"""
+)
+
+_cache = OrderedDict()
+
+
+def parse_attributes(text):
+    """Return the attributes of a tag as a dict."""
+    attrs = {}
+    for match in ATTRIBUTE.finditer(text):
+        name, double, single, bare = match.groups()
+        value = next((v for v in (double, single, bare) if v is not None), "")
+        attrs[name] = value
+    return attrs
+
+
+def iter_blocks(lines):
+    """Parse the top-level blocks of a plugin file in one pass over its lines.
+
+    A block starts with an opening tag at the beginning of a line and ends
+    with the matching closing tag, the tags of the same name nested in a
+    block are balanced. Text outside of the blocks is ignored.
+    """
+    name = attrs = tags = None
+    depth = 0
+    content = []
+    for line in lines:
+        if name is None:
+            match = OPEN_TAG.match(line)
+            if match is None:
+                continue
+            name, attrs = match.group(1), parse_attributes(match.group(2))
+            tags = re.compile(rf"<{re.escape(name)}[\s>]|</{re.escape(name)}>")
+            depth = 0
+            content = []
+            line = line[match.end() :]
+            if not line.strip():
+                continue
+        for match in tags.finditer(line):
+            if not match.group().startswith("</"):
+                depth += 1
+            elif depth > 0:
+                depth -= 1
+            else:
+                content.append(line[: match.start()])
+                yield Block(name, attrs, "".join(content))
+                name = None
+                break
+        else:
+            content.append(line)
+
+
+def parse_plugin_source(source):
+    """Return the blocks of a plugin file, the results are cached by hash."""
+    key = hashlib.sha256(source.encode("utf-8")).digest()
+    blocks = _cache.get(key)
+    if blocks is None:
+        blocks = tuple(iter_blocks(source.splitlines(keepends=True)))
+        _cache[key] = blocks
+        if len(_cache) > PARSER_CACHE_SIZE:
+            _cache.popitem(last=False)
+    else:
+        _cache.move_to_end(key)
+    return blocks
+
+
+def select_block(blocks, name, lang=None, tag=None):
+    """Return the block of a name matching the language and the tag.
+
+    Blocks without a tag attribute apply to all the tags, a block with the
+    requested tag is preferred. Return None if no block matches.
+    """
+    candidates = [
+        block
+        for block in blocks
+        if block.name == name and (lang is None or block.attrs.get("lang") == lang)
+    ]
+    if tag is not None:
+        for block in candidates:
+            if block.attrs.get("tag") == tag:
+                return block
+    for block in candidates:
+        if "tag" not in block.attrs:
+            return block
+    return candidates[0] if candidates and tag is None else None
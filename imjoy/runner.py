@@ -3,76 +3,336 @@ import asyncio
 import json
 import logging
 import os
-import re
 import sys
-import urllib.request
+import uuid
 
+import socketio
 import yaml
 import imjoy_rpc
 from imjoy_rpc import connect_to_server
+from imjoy_rpc.connection.socketio_connection import SocketIOManager
+from imjoy_rpc.utils import ContextLocal, dotdict
+
+from imjoy.cache import PluginCache
+from imjoy.core.connection import decode_frame
+from imjoy.parser import parse_plugin_source, select_block
 
 logging.basicConfig(stream=sys.stdout)
 logger = logging.getLogger("plugin-runner")
 logger.setLevel(logging.INFO)
 
 
-async def run_plugin(plugin_file, default_config):
-    """Load plugin file."""
-    loop = asyncio.get_event_loop()
+async def read_plugin_file(plugin_file, cache=None):
+    """Return the path without query string and the content of a plugin file."""
     if os.path.isfile(plugin_file):
-        content = open(plugin_file).read()
+        with open(plugin_file) as fil:
+            content = fil.read()
     elif plugin_file.startswith("http"):
-        with urllib.request.urlopen(plugin_file) as response:
-            content = response.read().decode("utf-8")
+        content = await (cache or PluginCache()).fetch(plugin_file)
         # remove query string
         plugin_file = plugin_file.split("?")[0]
     else:
         raise Exception("Invalid input plugin file path: {}".format(plugin_file))
+    return plugin_file, content
+
+
+def parse_plugin(plugin_file, content, tag=None):
+    """Return the config and the python script of a plugin."""
     if plugin_file.endswith(".py"):
         filename, _ = os.path.splitext(os.path.basename(plugin_file))
-        default_config["name"] = filename[:32]
-        api = await connect_to_server(default_config)
-        try:
-            # patch imjoy_rpc api
-            imjoy_rpc.api = api
-            exec(content, globals())  # pylint: disable=exec-used
-            logger.info("Plugin executed")
-            if opt.quit_on_ready:
-                await asyncio.sleep(1)
-                loop.stop()
-        except Exception as err:  # pylint: disable=broad-except
-            logger.error("Failed to execute plugin %s", err)
-            loop.stop()
-
-    elif plugin_file.endswith(".imjoy.html"):
-        # load config
-        found = re.findall("<config (.*)>\n(.*)</config>", content, re.DOTALL)[0]
-        if "json" in found[0]:
-            plugin_config = json.loads(found[1])
-        elif "yaml" in found[0]:
-            plugin_config = yaml.safe_load(found[1])
-        default_config.update(plugin_config)
-        api = await connect_to_server(default_config)
-        # load script
-        found = re.findall("<script (.*)>\n(.*)</script>", content, re.DOTALL)[0]
-        if "python" in found[0]:
-            try:
-                # patch imjoy_rpc api
-                imjoy_rpc.api = api
-                exec(found[1], globals())  # pylint: disable=exec-used
-                logger.info("Plugin executed")
-                if opt.quit_on_ready:
-                    await asyncio.sleep(1)
-                    loop.stop()
-            except Exception as err:  # pylint: disable=broad-except
-                logger.error("Failed to execute plugin %s", err)
-                loop.stop()
+        return {"name": filename[:32]}, content
+    if plugin_file.endswith(".imjoy.html"):
+        blocks = parse_plugin_source(content)
+        config = select_block(blocks, "config", tag=tag)
+        if config is None:
+            raise Exception("No config found in file {}".format(plugin_file))
+        lang = config.attrs.get("lang", "")
+        if "json" in lang:
+            plugin_config = json.loads(config.content)
+        elif "yaml" in lang:
+            plugin_config = yaml.safe_load(config.content)
         else:
             raise Exception(
-                "Invalid script type ({}) in file {}".format(found[0], plugin_file)
+                "Invalid config type ({}) in file {}".format(lang, plugin_file)
             )
-    else:
-        raise Exception("Invalid script file type ({})".format(plugin_file))
+        script = select_block(blocks, "script", lang="python", tag=tag)
+        if script is None:
+            raise Exception(
+                "No python script{} found in file {}".format(
+                    f" (tag={tag})" if tag else "", plugin_file
+                )
+            )
+        return plugin_config, script.content
+    raise Exception("Invalid script file type ({})".format(plugin_file))
+
+
+def list_plugin_files(paths):
+    """Return the plugin files of a list of files, urls and directories."""
+    plugin_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            plugin_files += sorted(
+                os.path.join(path, name)
+                for name in os.listdir(path)
+                if name.endswith((".py", ".imjoy.html"))
+            )
+        else:
+            plugin_files.append(path)
+    return plugin_files
+
+
+class PluginChannel:
+    """Represent the socketio client of a plugin sharing a connection.
+
+    It stands in for the socketio client used by the imjoy-rpc connection
+    of the plugin, the events are dispatched to it by the shared client.
+    While the shared connection is reconnecting, the messages of the plugin
+    wait until it is resumed.
+    """
+
+    def __init__(self, client, peer_id, plugin_id, resume_token=None):
+        """Set up instance."""
+        self.client = client
+        self.peer_id = peer_id
+        self.plugin_id = plugin_id
+        self.resume_token = resume_token
+        self.handlers = {}
+        self.online = asyncio.Event()
+        self.online.set()
+
+    def event(self, handler):
+        """Register an event handler."""
+        self.handlers[handler.__name__] = handler
+        return handler
+
+    def fire(self, event, *args):
+        """Call the handler of an event."""
+        handler = self.handlers.get(event)
+        if handler:
+            handler(*args)
+
+    async def emit(self, event, data, callback=None):
+        """Emit an event over the shared connection."""
+        await self.online.wait()
+        await self.client.sio.emit(event, data, callback=callback)
+
+    async def disconnect(self):
+        """Stop dispatching the messages to the plugin.
+
+        The connection stays open for the other plugins, the server
+        removes the plugin when the connection is closed.
+        """
+        self.client.channels.pop(self.peer_id, None)
+
+
+class PluginManager(SocketIOManager):
+    """Represent the imjoy-rpc manager of a plugin sharing a connection."""
+
+    def __init__(self, rpc_context, client):
+        """Set up instance."""
+        super().__init__(rpc_context)
+        self.client = client
+
+    def register(self, on_ready_callback=None, on_error_callback=None):
+        """Register the plugin over the shared connection."""
+
+        def registered(config):
+            """Handle registration."""
+            if not config.get("success"):
+                logger.error(config.get("detail"))
+                if on_error_callback:
+                    on_error_callback(config.get("detail"))
+                return
+            peer_id = str(uuid.uuid4())
+            channel = PluginChannel(
+                self.client, peer_id, config["plugin_id"], config.get("resume_token")
+            )
+            self.client.channels[peer_id] = channel
+            self._create_new_connection(
+                channel,
+                config["plugin_id"],
+                peer_id,
+                on_ready_callback,
+                on_error_callback,
+            )
+
+        # the plugin can be resumed if the connection is interrupted
+        config = dict(self.default_config, resumable=True)
+        asyncio.ensure_future(
+            self.client.sio.emit("register_plugin", config, callback=registered)
+        )
+
+
+class SharedClient:
+    """Represent a socketio connection shared by several plugins.
+
+    Every plugin is registered over the same connection, the server tags
+    the messages it sends with the peer id of the plugin connection, which
+    is used to dispatch them.
+    When the connection is interrupted, the plugins are resumed with their
+    resume tokens once it is back, without running their handshake again.
+    """
+
+    def __init__(self, server_url, token=None):
+        """Set up instance."""
+        self.server_url = server_url
+        self.token = token
+        self.channels = {}
+        self._connected = None
+        self.sio = socketio.AsyncClient()
+        self.sio.on("plugin_message", self._dispatch)
+        self.sio.on("connect", self._on_connect)
+        self.sio.on("disconnect", self._disconnected)
+
+    async def connect(self):
+        """Connect to the server."""
+        self._connected = asyncio.get_event_loop().create_future()
+        await self.sio.connect(
+            self.server_url,
+            headers={"Authorization": f"Bearer {self.token}"} if self.token else {},
+            socketio_path="/socket.io",
+        )
+        # the namespace is connected after the connect call returns
+        await self._connected
+
+    def _on_connect(self):
+        if not self._connected.done():
+            self._connected.set_result(None)
+        for channel in list(self.channels.values()):
+            if not channel.online.is_set():
+                asyncio.ensure_future(self._resume(channel))
+
+    async def _resume(self, channel):
+        workspace, name = channel.plugin_id.split("/", 1)
+
+        def resumed(result):
+            if result.get("success"):
+                logger.info("Plugin resumed (%s)", channel.plugin_id)
+                channel.online.set()
+            else:
+                logger.error(
+                    "Failed to resume %s: %s", channel.plugin_id, result.get("detail")
+                )
+                self.channels.pop(channel.peer_id, None)
+                channel.fire("disconnect")
+
+        await self.sio.emit(
+            "register_plugin",
+            {
+                "workspace": workspace,
+                "name": name,
+                "resume_token": channel.resume_token,
+            },
+            callback=resumed,
+        )
+
+    def _dispatch(self, data):
+        if "_msgpack" in data:
+            data = decode_frame(data)
+        if data.get("type") == "batch":
+            for message in data["messages"]:
+                self._dispatch(message)
+            return
+        channel = self.channels.get(data.get("peer_id"))
+        if channel is None:
+            logger.warning("Dropping message for unknown peer %s", data.get("peer_id"))
+            return
+        channel.fire("plugin_message", data)
+
+    def _disconnected(self):
+        for channel in list(self.channels.values()):
+            if channel.resume_token:
+                # wait for the reconnection
+                channel.online.clear()
+            else:
+                channel.fire("disconnect")
+
+    def register(self, config):
+        """Register a plugin and return a future of its api."""
+        fut = asyncio.get_event_loop().create_future()
+
+        def on_ready_callback(result):
+            if not fut.done():
+                fut.set_result(result)
+
+        def on_error_callback(detail):
+            if not fut.done():
+                fut.set_exception(Exception(f"Plugin failed with error: {detail}"))
+            elif detail:
+                logger.error(str(detail))
+
+        rpc_context = ContextLocal()
+        rpc_context.default_config = config
+        manager = PluginManager(rpc_context, self)
+        rpc_context.api = dotdict(
+            init=manager.init,
+            export=manager.set_interface,
+            registerCodec=manager.register_codec,
+        )
+        rpc_context.api.export({})
+        manager.register(on_ready_callback, on_error_callback)
+        return fut
+
+
+async def load_plugin(client, plugin_file, default_config, cache=None):
+    """Run a plugin in its own namespace over a shared connection."""
+    plugin_file, content = await read_plugin_file(plugin_file, cache)
+    plugin_config, script = parse_plugin(
+        plugin_file, content, default_config.get("tag")
+    )
+    api = await client.register(dict(default_config, **plugin_config))
+    namespace = {"__name__": "__main__", "__file__": plugin_file}
+    # `from imjoy_rpc import api` is resolved while executing the script
+    original_api = imjoy_rpc.api
+    try:
+        imjoy_rpc.api = api
+        exec(script, namespace)  # pylint: disable=exec-used
+    finally:
+        imjoy_rpc.api = original_api
+    logger.info("Plugin executed (%s)", plugin_file)
+    return namespace
+
+
+async def run_plugins(plugin_files, default_config, quit_on_ready=False, cache=None):
+    """Run many plugins in one process, sharing one server connection."""
+    loop = asyncio.get_event_loop()
+    client = SharedClient(default_config["server_url"], default_config["token"])
+    await client.connect()
+    results = await asyncio.gather(
+        *[
+            load_plugin(client, plugin_file, default_config, cache)
+            for plugin_file in plugin_files
+        ],
+        return_exceptions=True,
+    )
+    for plugin_file, result in zip(plugin_files, results):
+        if isinstance(result, Exception):
+            logger.error("Failed to execute plugin %s: %s", plugin_file, result)
+    if quit_on_ready:
+        await asyncio.sleep(1)
+        loop.stop()
+
+
+async def run_plugin(plugin_file, default_config, quit_on_ready=False, cache=None):
+    """Load plugin file."""
+    loop = asyncio.get_event_loop()
+    plugin_file, content = await read_plugin_file(plugin_file, cache)
+    plugin_config, script = parse_plugin(
+        plugin_file, content, default_config.get("tag")
+    )
+    default_config.update(plugin_config)
+    api = await connect_to_server(default_config)
+    try:
+        # patch imjoy_rpc api
+        imjoy_rpc.api = api
+        exec(script, globals())  # pylint: disable=exec-used
+        logger.info("Plugin executed")
+        if quit_on_ready:
+            await asyncio.sleep(1)
+            loop.stop()
+    except Exception as err:  # pylint: disable=broad-except
+        logger.error("Failed to execute plugin %s", err)
+        loop.stop()
 
 
 def start_runner(args):
@@ -83,7 +343,18 @@ def start_runner(args):
         "server_url": args.server_url,
         "token": args.token,
     }
-    asyncio.ensure_future(run_plugin(args.file, default_config))
+    if args.tag:
+        default_config["tag"] = args.tag
+    cache = PluginCache(args.cache_dir, args.offline)
+    plugin_files = list_plugin_files(args.files)
+    if len(plugin_files) == 1 and not os.path.isdir(args.files[0]):
+        asyncio.ensure_future(
+            run_plugin(plugin_files[0], default_config, args.quit_on_ready, cache)
+        )
+    else:
+        asyncio.ensure_future(
+            run_plugins(plugin_files, default_config, args.quit_on_ready, cache)
+        )
     loop.run_forever()
 
 
@@ -91,7 +362,15 @@ if __name__ == "__main__":
     import argparse
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("file", type=str, help="path to a plugin file")
+    parser.add_argument(
+        "files",
+        type=str,
+        nargs="+",
+        help=(
+            "paths or urls to plugin files, or directories of plugin files, "
+            "several plugins run in one process and share the server connection"
+        ),
+    )
     parser.add_argument(
         "--server-url",
         type=str,
@@ -112,6 +391,26 @@ if __name__ == "__main__":
         help="quit the server when the plugin is ready",
     )
 
+    parser.add_argument(
+        "--tag",
+        type=str,
+        default=None,
+        help="tag of the script block to run in .imjoy.html files",
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="directory for caching the remote plugin files",
+    )
+
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="load the remote plugin files from the cache only",
+    )
+
     opt = parser.parse_args()
 
     start_runner(opt)
@@ -1,10 +1,13 @@
 """Provide the server."""
 import asyncio
 import os
+import secrets
+import socket
+import time
 import uuid
-from contextvars import copy_context
+from itertools import count, islice
 from os import environ as env
-from typing import Union
+from typing import Dict, Set, Tuple, Union
 
 import socketio
 import uvicorn
@@ -12,6 +15,8 @@ from dotenv import find_dotenv, load_dotenv
 from fastapi import FastAPI
 from fastapi.logger import logger
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from uvicorn.supervisors import Multiprocess
 
 from imjoy import __version__ as VERSION
 from imjoy.core import (
@@ -20,24 +25,73 @@ from imjoy.core import (
     WorkspaceInfo,
     all_users,
     all_sessions,
-    current_user,
-    current_plugin,
-    current_workspace,
     all_workspaces,
+    set_state_backend,
+    set_workspace_store,
 )
-from imjoy.core.auth import parse_token, check_permission
-from imjoy.core.connection import BasicConnection
+from imjoy.core import metrics
+from imjoy.core.auth import (
+    JWT_SECRET,
+    check_permission,
+    load_parents,
+    parse_token,
+    permission_cache,
+)
+from imjoy.core.connection import BasicConnection, msgpack
 from imjoy.core.interface import CoreInterface
+from imjoy.core.limits import WORKSPACE_CONCURRENCY_LIMIT
 from imjoy.core.plugin import DynamicPlugin
+from imjoy.core.routing import create_route, routing_table
+from imjoy.core.sharding import Cluster
+from imjoy.core.store import (
+    ChangeFeed,
+    RedisPubSubManager,
+    create_backend,
+    create_store,
+)
 
 ENV_FILE = find_dotenv()
 if ENV_FILE:
     load_dotenv(ENV_FILE)
 
-
-def initialize_socketio(sio, core_api):
-    """Initialize socketio."""
-    # pylint: disable=too-many-statements, unused-variable, protected-access
+SEND_QUEUE_HIGH_WATERMARK = int(env.get("SEND_QUEUE_HIGH_WATERMARK", "1000"))
+SEND_QUEUE_LOW_WATERMARK = int(env.get("SEND_QUEUE_LOW_WATERMARK", "500"))
+# one of "await", "drop" or "disconnect"
+SEND_QUEUE_OVERFLOW_POLICY = env.get("SEND_QUEUE_OVERFLOW_POLICY", "await")
+# "memory" or a redis uri (e.g. redis://localhost:6379/0), required for workers
+STATE_BACKEND = env.get("STATE_BACKEND", "memory")
+# "sqlite://<path>" or a redis uri for keeping the persistent workspaces
+WORKSPACE_STORE = env.get("WORKSPACE_STORE")
+# assign the workspaces to the nodes sharing the state backend
+ENABLE_SHARDING = env.get("ENABLE_SHARDING", "false").lower() == "true"
+NODE_ID = env.get("NODE_ID")
+# maximum number of items returned by the detailed stats listings
+STATS_PAGE_SIZE = int(env.get("STATS_PAGE_SIZE", "100"))
+# seconds the resumable plugins of a disconnected user are kept, 0 to disable
+# clients may only notice a broken connection after the ping timeout
+PLUGIN_RESUME_GRACE_PERIOD = float(env.get("PLUGIN_RESUME_GRACE_PERIOD", "60"))
+# the latency of one plugin message out of this number is measured
+PLUGIN_MESSAGE_LATENCY_SAMPLING = int(env.get("PLUGIN_MESSAGE_LATENCY_SAMPLING", "100"))
+
+
+async def _dispatch(route, data):
+    """Dispatch a message through a resolved route."""
+    route.dispatch(data)
+    route.messages.value += 1
+    if route.connection.congested:
+        # apply backpressure by delaying the acknowledgement
+        await route.connection.drain()
+    return {"success": True}
+
+
+def initialize_socketio(sio, core_api, cluster=None):
+    """Initialize socketio, return the handler of the requests from other nodes."""
+    # pylint: disable=too-many-statements, too-many-locals, unused-variable, protected-access
+    forwarded_sessions: Dict[str, Set[str]] = {}  # sid: node ids
+    anonymous_users: Set[str] = set()
+    resume_tokens: Dict[str, Tuple[str, UserInfo]] = {}  # plugin id: token, owner
+    parked_plugins: Dict[str, asyncio.TimerHandle] = {}  # plugin id: expiry
+    message_seq = count()
 
     @sio.event
     async def connect(sid, environ):
@@ -45,7 +99,7 @@ def initialize_socketio(sio, core_api):
         if "HTTP_AUTHORIZATION" in environ:
             try:
                 authorization = environ["HTTP_AUTHORIZATION"]  # JWT token
-                user_info = parse_token(authorization)
+                user_info = await parse_token(authorization)
                 uid = user_info["user_id"]
                 email = user_info["email"]
                 roles = user_info["roles"]
@@ -65,10 +119,14 @@ def initialize_socketio(sio, core_api):
             parent = None
             scopes = []
             expires_at = None
+            anonymous_users.add(uid)
             logger.info("Anonymized User connected: %s", uid)
 
-        if uid not in all_users:
-            all_users[uid] = UserInfo(
+        user_info = await all_users.load(uid)
+        if user_info is None:
+            # the user may be the parent of users with cached decisions
+            permission_cache.invalidate_user(uid)
+            user_info = UserInfo(
                 id=uid,
                 email=email,
                 parent=parent,
@@ -76,18 +134,103 @@ def initialize_socketio(sio, core_api):
                 scopes=scopes,
                 expires_at=expires_at,
             )
-        all_users[uid]._sessions.append(sid)
-        all_sessions[sid] = all_users[uid]
+            await all_users.put(uid, user_info)
+        if not user_info._sessions:
+            metrics.users.inc()
+        user_info._sessions.append(sid)
+        all_sessions[sid] = user_info
+        metrics.sessions.inc()
+        await all_users.acquire(uid)
+
+    async def get_owner(ws):
+        """Return the node of a workspace if it is not the current node."""
+        if cluster is None:
+            return None
+        node = await cluster.get_owner(ws)
+        return node if node != cluster.node_id else None
+
+    async def forward(node, method, sid, data):
+        """Forward a request of a session to another node."""
+        forwarded_sessions.setdefault(sid, set()).add(node)
+        return await cluster.request(node, method, sid, all_sessions[sid].id, data)
+
+    async def handle_node_request(method, sid, user_id, data):
+        """Handle the requests forwarded by other nodes."""
+        if method == "disconnect":
+            if sid in all_sessions:
+                await disconnect_session(sid)
+            return None
+        if sid not in all_sessions:
+            # attach the session of the other node
+            user_info = await all_users.load(user_id)
+            if user_info is None:
+                raise Exception(f"User not found: {user_id}")
+            # another request of the session may have attached it meanwhile
+            if sid not in all_sessions:
+                if not user_info._sessions:
+                    metrics.users.inc()
+                user_info._sessions.append(sid)
+                all_sessions[sid] = user_info
+                await all_users.acquire(user_id)
+        if method == "register_plugin":
+            return await register_plugin_locally(sid, data)
+        if method == "plugin_message":
+            return await route_plugin_message(sid, data)
+        if method == "resume_connection":
+            return resume_connection(sid, data)
+        raise Exception(f"Invalid node request: {method}")
 
     @sio.event
     async def register_plugin(sid, config):
+        metrics.plugin_registrations.inc()
         user_info = all_sessions[sid]
         ws = config.get("workspace") or user_info.id
         config["workspace"] = ws
         config["name"] = config.get("name") or str(uuid.uuid4())
-        if ws in all_workspaces:
-            workspace = all_workspaces[ws]
+        plugin_id = f"{ws}/{config['name'].replace('/', '-')}"
+        resuming = bool(config.get("resume_token"))
+        if not resuming:
+            # the session must not join the room of a plugin it cannot use
+            workspace = await all_workspaces.load(ws)
+            if workspace is None and ws != user_info.id:
+                return {"success": False, "detail": f"Workspace {ws} does not exist."}
+            if workspace is not None and user_info.id != ws:
+                await load_parents(user_info)
+                if not check_permission(workspace, user_info):
+                    return {
+                        "success": False,
+                        "detail": f"Permission denied for workspace: {ws}",
+                    }
+        joined = plugin_id not in sio.rooms(sid)
+        if not resuming:
+            # join the room first, the plugin starts sending right after creation
+            sio.enter_room(sid, plugin_id)
+        node = await get_owner(ws)
+        if node is not None:
+            result = await forward(node, "register_plugin", sid, config)
         else:
+            result = await register_plugin_locally(sid, config)
+        if result["success"] and resuming:
+            # the resume token is checked, the queued messages follow the join
+            sio.enter_room(sid, plugin_id)
+            if node is not None:
+                await forward(node, "resume_connection", sid, plugin_id)
+            else:
+                resume_connection(sid, plugin_id)
+        elif not result["success"] and joined and not resuming:
+            # the session may have been in the room before, e.g. the owner
+            sio.leave_room(sid, plugin_id)
+        return result
+
+    async def register_plugin_locally(sid, config):
+        """Register a plugin in a workspace of the current node."""
+        user_info = all_sessions[sid]
+        ws = config["workspace"]
+        if config.get("resume_token"):
+            # the resume token stands for the permission of the owner
+            return await resume_plugin(sid, config)
+        workspace = await all_workspaces.load(ws)
+        if workspace is None:
             if ws == user_info.id:
                 # create the user workspace automatically
                 workspace = WorkspaceInfo(
@@ -96,20 +239,28 @@ def initialize_socketio(sio, core_api):
                     visibility=VisibilityEnum.protected,
                     persistent=(config.get("persistent") is True),
                 )
-                all_workspaces[ws] = workspace
+                await all_workspaces.put(ws, workspace)
+                permission_cache.invalidate_workspace(ws)
             else:
                 return {"success": False, "detail": f"Workspace {ws} does not exist."}
 
-        if user_info.id != ws and not check_permission(workspace, user_info):
-            return {
-                "success": False,
-                "detail": f"Permission denied for workspace: {ws}",
-            }
+        if user_info.id != ws:
+            await load_parents(user_info)
+            if not check_permission(workspace, user_info):
+                return {
+                    "success": False,
+                    "detail": f"Permission denied for workspace: {ws}",
+                }
 
         name = config["name"].replace("/", "-")  # prevent hacking of the plugin name
         plugin_id = f"{ws}/{name}"
         config["id"] = plugin_id
-        sio.enter_room(sid, plugin_id)
+        if plugin_id in parked_plugins:
+            # the plugin is registered again from scratch
+            await remove_plugin(resume_tokens[plugin_id][1], workspace._plugins[name])
+        if all_workspaces.get(ws) is not workspace:
+            # the workspace was removed meanwhile, e.g. with the replaced plugin
+            return await register_plugin_locally(sid, config)
 
         async def send(data):
             await sio.emit(
@@ -118,31 +269,156 @@ def initialize_socketio(sio, core_api):
                 room=plugin_id,
             )
 
-        connection = BasicConnection(send)
+        # batching is opt-in since the client has to unpack the batch frames
+        # the binary frame encoding is negotiated at registration
+        encoding = "json"
+        if config.get("encoding") == "msgpack":
+            if msgpack is not None:
+                encoding = "msgpack"
+            else:
+                logger.warning("msgpack is not installed, using the json encoding")
+        connection = BasicConnection(
+            send,
+            batch_window=config.get("message_batch_window"),
+            batch_size=config.get("message_batch_size"),
+            high_watermark=SEND_QUEUE_HIGH_WATERMARK,
+            low_watermark=SEND_QUEUE_LOW_WATERMARK,
+            overflow_policy=SEND_QUEUE_OVERFLOW_POLICY,
+            encoding=encoding,
+        )
+        if SEND_QUEUE_OVERFLOW_POLICY == "disconnect":
+            # the connection fires disconnected when the client cannot keep up
+            connection.on(
+                "disconnected", lambda _: asyncio.ensure_future(sio.disconnect(sid))
+            )
         plugin = DynamicPlugin(config, core_api.get_interface(), connection, workspace)
 
         user_info._plugins[plugin.id] = plugin
-        if plugin.name in workspace._plugins:
+        routing_table.remove_plugin(plugin.id)
+        replaced = plugin.name in workspace._plugins
+        if replaced:
             # kill the plugin if already exist
             asyncio.ensure_future(plugin.terminate(True))
             del user_info._plugins[plugin.id]
+        else:
+            if not workspace._plugins:
+                metrics.workspaces.inc()
+            metrics.plugins.inc()
         workspace._plugins[plugin.name] = plugin
+        if not replaced:
+            await all_workspaces.acquire(ws)
         logger.info("New plugin registered successfully (%s)", plugin_id)
-        return {"success": True, "plugin_id": plugin_id}
+        result = {"success": True, "plugin_id": plugin_id, "encoding": encoding}
+        if config.get("resumable") and PLUGIN_RESUME_GRACE_PERIOD > 0:
+            resume_tokens[plugin_id] = (secrets.token_urlsafe(32), user_info)
+            result["resume_token"] = resume_tokens[plugin_id][0]
+        return result
+
+    async def resume_plugin(sid, config):
+        """Attach a plugin kept after a disconnection to a new session.
+
+        The state of the plugin is reused as is, its handshake is not
+        run again and the messages queued meanwhile are sent.
+        """
+        plugin_id = f"{config['workspace']}/{config['name'].replace('/', '-')}"
+        token = config["resume_token"]
+        expected, owner = resume_tokens.get(plugin_id, (None, None))
+        if expected is None or not secrets.compare_digest(expected, token):
+            return {"success": False, "detail": f"Cannot resume plugin {plugin_id}"}
+        user_info = all_sessions[sid]
+        if user_info.id != owner.id:
+            # anonymous users get a new id on each connection, the token
+            # proves that the session is the owner reconnecting
+            if not (
+                user_info.id in anonymous_users
+                and owner.id in anonymous_users
+                and not user_info._plugins
+            ):
+                return {"success": False, "detail": "Permission denied"}
+            await adopt_session(sid, owner)
+        handle = parked_plugins.pop(plugin_id, None)
+        if handle is not None:
+            handle.cancel()
+            metrics.parked_plugins.dec()
+        plugin = owner._plugins[plugin_id]
+        # the connection is resumed once the session joined the room
+        metrics.plugin_resumptions.inc()
+        logger.info("Plugin resumed (%s)", plugin_id)
+        return {
+            "success": True,
+            "plugin_id": plugin_id,
+            "encoding": plugin.connection.encoding,
+            "resume_token": token,
+            "resumed": True,
+        }
+
+    def resume_connection(sid, plugin_id):
+        """Send the messages queued for a resumed plugin of the session."""
+        plugin = all_sessions[sid]._plugins.get(plugin_id)
+        if plugin is not None and plugin.connection.suspended:
+            plugin.connection.resume()
+
+    async def adopt_session(sid, owner):
+        """Move a session of an anonymous user to another user."""
+        user_info = all_sessions[sid]
+        user_info._sessions.remove(sid)
+        if not owner._sessions:
+            metrics.users.inc()
+        owner._sessions.append(sid)
+        all_sessions[sid] = owner
+        await all_users.acquire(owner.id)
+        user_sessions = await all_users.release(user_info.id)
+        if not user_info._sessions:
+            metrics.users.dec()
+            await remove_user(user_info, user_sessions)
 
     @sio.event
     async def plugin_message(sid, data):
+        start = (
+            None
+            if next(message_seq) % PLUGIN_MESSAGE_LATENCY_SAMPLING
+            else time.perf_counter()
+        )
+        try:
+            route = routing_table.get(sid, data["plugin_id"])
+            if route is None:
+                node = await get_owner(os.path.dirname(data["plugin_id"]))
+                if node is not None:
+                    return await forward(node, "plugin_message", sid, data)
+            elif route.user_id == route.workspace or permission_cache.get(
+                route.workspace, route.user_id
+            ):
+                # fast path of route_plugin_message for the resolved routes
+                return await _dispatch(route, data)
+            return await route_plugin_message(sid, data, route)
+        finally:
+            if start is not None:
+                metrics.plugin_message_latency.observe(time.perf_counter() - start)
+
+    async def route_plugin_message(sid, data, route=None):
+        """Route a message to a plugin of the current node."""
+        route = route or routing_table.get(sid, data["plugin_id"])
+        if route is not None and (
+            route.user_id == route.workspace
+            or permission_cache.get(route.workspace, route.user_id)
+        ):
+            return await _dispatch(route, data)
+
         user_info = all_sessions[sid]
         plugin_id = data["plugin_id"]
         ws, name = os.path.split(plugin_id)
-        if ws not in all_workspaces:
+        workspace = await all_workspaces.load(ws)
+        if workspace is None:
             return {"success": False, "detail": f"Workspace not found: {ws}"}
-        workspace = all_workspaces[ws]
-        if user_info.id != ws and not check_permission(workspace, user_info):
-            logger.error(
-                "Permission denied: workspace=%s, user_id=%s", workspace, user_info.id
-            )
-            return {"success": False, "detail": "Permission denied"}
+        if user_info.id != ws:
+            await load_parents(user_info)
+            if not check_permission(workspace, user_info):
+                logger.error(
+                    "Permission denied: workspace=%s, user_id=%s",
+                    workspace,
+                    user_info.id,
+                )
+                return {"success": False, "detail": "Permission denied"}
 
         plugin = workspace._plugins.get(name)
         if not plugin:
@@ -152,42 +428,126 @@ def initialize_socketio(sio, core_api):
                 "detail": f"Plugin {name} not found in workspace {workspace.name}",
             }
 
-        current_user.set(user_info)
-        current_plugin.set(plugin)
-        current_workspace.set(workspace)
-        ctx = copy_context()
-        ctx.run(plugin.connection.handle_message, data)
-        return {"success": True}
+        # resolve the route once, the following messages are dispatched directly
+        route = create_route(user_info, plugin, workspace)
+        routing_table.add(sid, plugin_id, route)
+        return await _dispatch(route, data)
 
     @sio.event
     async def disconnect(sid):
         """Event handler called when the client is disconnected."""
-        user_info = all_sessions[sid]
-        all_users[user_info.id]._sessions.remove(sid)
-        # if the user has no more all_sessions
-        if not all_users[user_info.id]._sessions:
-            del all_users[user_info.id]
-            for pid in list(user_info._plugins.keys()):
-                plugin = user_info._plugins[pid]
-                # TODO: how to allow plugin running when the user disconnected
-                # we will also need to handle the case when the user login again
-                # the plugin should be reclaimed for the user
-                del plugin.workspace._plugins[plugin.name]
-                # if there is no plugins in the workspace then we remove it
-                if not plugin.workspace._plugins and not plugin.workspace.persistent:
-                    del all_workspaces[plugin.workspace.name]
-                asyncio.ensure_future(plugin.terminate())
-                del user_info._plugins[pid]
-
-                # TODO: if a workspace has no plugins anymore
-                # we should destroy it completely
-                # Importantly, if we want to recycle the workspace name,
-                # we need to make sure we don't mess up with the permission
-                # with the plugins of the previous owners
-                for service in plugin.workspace._services.copy():
-                    if service.providerId == plugin.id:
-                        plugin.workspace._services.remove(service)
-        del all_sessions[sid]
+        for node in forwarded_sessions.pop(sid, ()):
+            try:
+                await cluster.request(node, "disconnect", sid, None, None)
+            except Exception as err:  # pylint: disable=broad-except
+                logger.warning("Failed to disconnect %s from %s: %s", sid, node, err)
+        metrics.disconnections.inc()
+        metrics.sessions.dec()
+        await disconnect_session(sid)
+
+    async def disconnect_session(sid):
+        """Remove a session and the plugins of its user if it was the last one."""
+        user_info = all_sessions.pop(sid)
+        user_info._sessions.remove(sid)
+        routing_table.remove_session(sid)
+        if not user_info._sessions:
+            metrics.users.dec()
+        # the user may still have sessions in other workers
+        user_sessions = await all_users.release(user_info.id)
+        # if the user has no more sessions, a new one may have connected meanwhile
+        if not user_info._sessions:
+            resumable = [
+                plugin
+                for plugin in user_info._plugins.values()
+                if plugin.id in resume_tokens
+            ]
+            if resumable and PLUGIN_RESUME_GRACE_PERIOD > 0:
+                await park_plugins(user_info, resumable)
+            else:
+                await remove_user(user_info, user_sessions)
+
+    async def park_plugins(user_info, resumable):
+        """Keep the resumable plugins of a user for the grace period."""
+        loop = asyncio.get_event_loop()
+        for plugin in list(user_info._plugins.values()):
+            if plugin not in resumable:
+                await remove_plugin(user_info, plugin)
+                continue
+            plugin.connection.suspend()
+            if plugin.id not in parked_plugins:
+                metrics.parked_plugins.inc()
+            else:
+                parked_plugins[plugin.id].cancel()
+            parked_plugins[plugin.id] = loop.call_later(
+                PLUGIN_RESUME_GRACE_PERIOD, expire_plugin, user_info, plugin
+            )
+            logger.info("Plugin parked for resumption (%s)", plugin.id)
+
+    def expire_plugin(user_info, plugin):
+        """Remove a plugin which was not resumed in time."""
+        logger.info("Plugin was not resumed in time (%s)", plugin.id)
+        asyncio.ensure_future(remove_expired_plugin(user_info, plugin))
+
+    async def remove_expired_plugin(user_info, plugin):
+        """Remove an expired plugin, and its user if it has nothing left."""
+        if plugin.id not in parked_plugins:
+            # resumed meanwhile
+            return
+        await remove_plugin(user_info, plugin)
+        if not user_info._sessions and not user_info._plugins:
+            await remove_user(user_info, await all_users.references(user_info.id))
+
+    async def remove_user(user_info, user_sessions):
+        """Remove a user without sessions and its plugins."""
+        if user_sessions > 0:
+            all_users.forget(user_info.id)
+        else:
+            await all_users.remove(user_info.id)
+        anonymous_users.discard(user_info.id)
+        permission_cache.invalidate_user(user_info.id)
+        for plugin in list(user_info._plugins.values()):
+            await remove_plugin(user_info, plugin)
+
+    async def remove_plugin(user_info, plugin):
+        """Remove a plugin from its workspace and terminate it."""
+        # TODO: if a workspace has no plugins anymore
+        # we should destroy it completely
+        # Importantly, if we want to recycle the workspace name,
+        # we need to make sure we don't mess up with the permission
+        # with the plugins of the previous owners
+        workspace = plugin.workspace
+        del workspace._plugins[plugin.name]
+        metrics.plugins.dec()
+        if not workspace._plugins:
+            metrics.workspaces.dec()
+        routing_table.remove_plugin(plugin.id)
+        handle = parked_plugins.pop(plugin.id, None)
+        if handle is not None:
+            handle.cancel()
+            metrics.parked_plugins.dec()
+        resume_tokens.pop(plugin.id, None)
+        terminated = asyncio.ensure_future(plugin.terminate())
+        if plugin.connection.suspended:
+            # the messages of a parked plugin are dropped once it is terminated
+            terminated.add_done_callback(lambda _: plugin.connection.disconnect())
+        del user_info._plugins[plugin.id]
+        workspace._services.remove_by_provider(plugin.id)
+        workspace_plugins = await all_workspaces.release(workspace.name)
+        # if there is no plugins in the workspace then we remove it,
+        # unless a plugin was registered meanwhile
+        if (
+            workspace_plugins <= 0
+            and not workspace._plugins
+            and not workspace.persistent
+            and all_workspaces.get(workspace.name) is workspace
+        ):
+            await all_workspaces.remove(workspace.name)
+            metrics.plugin_messages.remove(workspace.name)
+            permission_cache.invalidate_workspace(workspace.name)
+            if cluster is not None:
+                await cluster.remove_workspace(workspace.name)
+
+    return handle_node_request
 
 
 def create_application(allow_origins) -> FastAPI:
@@ -210,47 +570,196 @@ def create_application(allow_origins) -> FastAPI:
         allow_headers=["Content-Type", "Authorization"],
     )
 
+    @app.on_event("startup")
+    async def start_monitoring():
+        asyncio.ensure_future(metrics.monitor_event_loop_lag())
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def get_metrics():
+        return PlainTextResponse(
+            metrics.generate_latest(), media_type="text/plain; version=0.0.4"
+        )
+
     @app.get("/")
     async def root():
+        return {"name": "ImJoy Core Server", "version": VERSION}
+
+    @app.get("/health")
+    async def health():
+        return {"status": "OK"}
+
+    @app.get("/stats")
+    async def get_stats():
+        # the counters are maintained by the socketio event handlers
         return {
-            "name": "ImJoy Core Server",
-            "version": VERSION,
-            "all_users": {u: all_users[u]._sessions for u in all_users},
-            "all_workspaces": {
-                w.name: len(w._plugins) for w in all_workspaces.values()
-            },
+            "sessions": int(metrics.sessions.value),
+            "users": int(metrics.users.value),
+            "workspaces": int(metrics.workspaces.value),
+            "plugins": int(metrics.plugins.value),
+        }
+
+    @app.get("/stats/workspaces")
+    async def list_workspaces(offset: int = 0, limit: int = STATS_PAGE_SIZE):
+        offset = max(offset, 0)
+        limit = min(max(limit, 0), STATS_PAGE_SIZE)
+        items = []
+        for name in islice(all_workspaces.loaded(), offset, offset + limit):
+            workspace = all_workspaces[name]
+            items.append({"name": name, "plugins": len(workspace._plugins)})
+        return {
+            "total": len(all_workspaces.loaded()),
+            "offset": offset,
+            "limit": limit,
+            "items": items,
         }
 
     return app
 
 
+def workspace_changed(name):
+    """Apply the changes of a workspace made by another worker."""
+    # pylint: disable=protected-access
+    permission_cache.invalidate_workspace(name)
+    workspace = all_workspaces.get(name)
+    if workspace is not None and workspace._limiter is not None:
+        workspace._limiter.resize(
+            workspace.concurrency_limit or WORKSPACE_CONCURRENCY_LIMIT
+        )
+
+
 def setup_socketio_server(
     app: FastAPI,
     mount_location: str = "/",
     socketio_path: str = "socket.io",
     allow_origins: Union[str, list] = "*",
+    state_backend: str = "memory",
+    sharding: bool = False,
+    node_id: str = None,
+    workspace_store: str = None,
 ) -> None:
     """Set up the socketio server."""
+    # pylint: disable=too-many-arguments
     if allow_origins == ["*"]:
         allow_origins = "*"
-    sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins=allow_origins)
+    backend = create_backend(state_backend)
+    set_state_backend(backend)
+    if workspace_store:
+        # the workspaces are loaded on first access
+        set_workspace_store(create_store(workspace_store))
+    if backend.shared:
+        # deliver the events to the clients connected to the other workers
+        client_manager = RedisPubSubManager(state_backend)
+        # refresh the users and workspaces changed by the other workers
+        change_feed = ChangeFeed(state_backend)
+        change_feed.watch(all_users, permission_cache.invalidate_user)
+        change_feed.watch(all_workspaces, workspace_changed)
+        app.on_event("startup")(change_feed.start)
+        app.on_event("shutdown")(change_feed.stop)
+    else:
+        client_manager = None
+    sio = socketio.AsyncServer(
+        async_mode="asgi",
+        cors_allowed_origins=allow_origins,
+        client_manager=client_manager,
+    )
     _app = socketio.ASGIApp(socketio_server=sio, socketio_path=socketio_path)
 
+    cluster = None
+    if sharding:
+        if not backend.shared:
+            raise Exception("Sharding requires a shared state backend")
+
+        async def is_busy(ws):
+            return await all_workspaces.references(ws) > 0
+
+        cluster = Cluster(backend, node_id, is_busy=is_busy)
+
+        @app.get("/cluster")
+        async def get_cluster():  # pylint: disable=unused-variable
+            return {"node_id": cluster.node_id, "nodes": sorted(cluster.nodes)}
+
     app.mount(mount_location, _app)
     app.sio = sio
     core_api = CoreInterface()
-    initialize_socketio(sio, core_api)
+    handle_node_request = initialize_socketio(sio, core_api, cluster)
+    if cluster is not None:
+
+        @app.on_event("startup")
+        async def join_cluster():  # pylint: disable=unused-variable
+            await cluster.start(handle_node_request)
+
+        app.on_event("shutdown")(cluster.stop)
     return sio
 
 
+def create_worker_application() -> FastAPI:
+    """Create the application of a worker from the environment variables."""
+    allow_origin = env.get("ALLOW_ORIGINS", "*").split(",")
+    application = create_application(allow_origin)
+    setup_socketio_server(
+        application,
+        allow_origins=allow_origin,
+        state_backend=STATE_BACKEND,
+        sharding=ENABLE_SHARDING,
+        # every worker is a node
+        node_id=f"{NODE_ID}-{os.getpid()}" if NODE_ID else None,
+        workspace_store=WORKSPACE_STORE,
+    )
+    return application
+
+
 def start_server(args):
     """Start the socketio server."""
     if args.allow_origin:
         allow_origin = args.allow_origin.split(",")
     else:
         allow_origin = env.get("ALLOW_ORIGINS", "*").split(",")
+    state_backend = args.state_backend or STATE_BACKEND
+    sharding = args.enable_sharding or ENABLE_SHARDING
+    node_id = args.node_id or NODE_ID
+    workspace_store = args.workspace_store or WORKSPACE_STORE
+    if args.workers > 1:
+        if not create_backend(state_backend).shared:
+            raise Exception(
+                "Multiple workers require a shared state backend, "
+                "e.g. --state-backend=redis://localhost:6379/0"
+            )
+        # the plugins and services live in the worker of their workspace,
+        # the requests of the sessions connected to other workers are forwarded
+        sharding = True
+        # the workers are started in new processes which read the environment
+        # the tokens generated by a worker are verified by the others
+        env["JWT_SECRET"] = JWT_SECRET
+        env["ALLOW_ORIGINS"] = ",".join(allow_origin)
+        env["STATE_BACKEND"] = state_backend
+        env["ENABLE_SHARDING"] = str(sharding).lower()
+        if node_id:
+            env["NODE_ID"] = node_id
+        if workspace_store:
+            env["WORKSPACE_STORE"] = workspace_store
+        config = uvicorn.Config(
+            "imjoy.server:create_worker_application",
+            factory=True,
+            host=args.host,
+            port=int(args.port),
+            workers=args.workers,
+        )
+        sock = config.bind_socket()
+        # the sockets accepted from a shared socket do not disable nagle,
+        # which delays the small rpc messages by up to 40ms
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        server = uvicorn.Server(config)
+        Multiprocess(config, target=server.run, sockets=[sock]).run()
+        return
     application = create_application(allow_origin)
-    setup_socketio_server(application, allow_origins=allow_origin)
+    setup_socketio_server(
+        application,
+        allow_origins=allow_origin,
+        state_backend=state_backend,
+        sharding=sharding,
+        node_id=node_id,
+        workspace_store=workspace_store,
+    )
     uvicorn.run(application, host=args.host, port=int(args.port))
 
 
@@ -276,5 +785,34 @@ if __name__ == "__main__":
         default="*",
         help="origins for the socketio server",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes for the socketio server",
+    )
+    parser.add_argument(
+        "--state-backend",
+        type=str,
+        default=None,
+        help="state backend shared by the workers, memory or a redis uri",
+    )
+    parser.add_argument(
+        "--workspace-store",
+        type=str,
+        default=None,
+        help="store of the persistent workspaces, a sqlite://<path> or redis uri",
+    )
+    parser.add_argument(
+        "--enable-sharding",
+        action="store_true",
+        help="assign the workspaces to the server nodes sharing the state backend",
+    )
+    parser.add_argument(
+        "--node-id",
+        type=str,
+        default=None,
+        help="id of the server node for sharding, random if not set",
+    )
     opt = parser.parse_args()
     start_server(opt)
@@ -0,0 +1,306 @@
+"""Provide a supervisor running plugins in a pool of runner processes."""
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from imjoy.runner import list_plugin_files
+from imjoy.utils import get_psutil, kill_process
+
+logging.basicConfig(stream=sys.stdout)
+logger = logging.getLogger("plugin-supervisor")
+logger.setLevel(logging.INFO)
+
+# a runner alive for this long is considered healthy, its backoff is reset
+HEALTHY_RUNTIME = 60
+
+
+def distribute(plugin_files, processes):
+    """Split the plugin files into at most `processes` groups."""
+    groups = [plugin_files[index::processes] for index in range(processes)]
+    return [group for group in groups if group]
+
+
+class ProcessUsage:
+    """Measure the cpu and memory usage of a process.
+
+    psutil is used if available, otherwise the usage is read from /proc.
+    """
+
+    def __init__(self, pid, psutil=None):
+        """Set up instance."""
+        self.pid = pid
+        self._process = psutil.Process(pid) if psutil else None
+        self._last = None  # (wall time, cpu time) of the previous sample
+
+    def _cpu_time(self):
+        with open(f"/proc/{self.pid}/stat") as fil:
+            # skip the command name, it may contain spaces
+            fields = fil.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def _memory(self):
+        with open(f"/proc/{self.pid}/status") as fil:
+            for line in fil:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+        return None
+
+    def sample(self):
+        """Return the cpu percentage since the last sample and the memory."""
+        try:
+            if self._process is not None:
+                return {
+                    "cpu_percent": self._process.cpu_percent(None),
+                    "memory": self._process.memory_info().rss,
+                }
+            now, cpu_time = time.monotonic(), self._cpu_time()
+            last, self._last = self._last, (now, cpu_time)
+            cpu_percent = None
+            if last is not None and now > last[0]:
+                cpu_percent = 100 * (cpu_time - last[1]) / (now - last[0])
+            return {"cpu_percent": cpu_percent, "memory": self._memory()}
+        except Exception:  # pylint: disable=broad-except
+            # the process exited or the platform has no /proc
+            return {"cpu_percent": None, "memory": None}
+
+
+class RunnerProcess:
+    """Represent a runner process hosting a group of plugins."""
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, index, plugin_files, runner_args=()):
+        """Set up instance."""
+        self.index = index
+        self.plugin_files = plugin_files
+        self.runner_args = list(runner_args)
+        self.proc = None
+        self.usage = None
+        self.started_at = None
+        self.restarts = 0
+        self.backoff = None
+        self.restart_at = None
+
+    def start(self, psutil=None):
+        """Start the runner process."""
+        # pylint: disable=consider-using-with
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "imjoy.runner", *self.plugin_files]
+            + self.runner_args
+        )
+        self.usage = ProcessUsage(self.proc.pid, psutil)
+        self.usage.sample()  # start measuring the cpu usage
+        self.started_at = time.monotonic()
+        self.restart_at = None
+        logger.info(
+            "Runner %s started (pid=%s, plugins=%s)",
+            self.index,
+            self.proc.pid,
+            len(self.plugin_files),
+        )
+
+    def stop(self):
+        """Stop the runner process and its children."""
+        if self.proc is None or self.proc.poll() is not None:
+            return
+        kill_process(self.proc.pid, logger)
+        if self.proc.poll() is None:
+            # kill_process does nothing without psutil
+            self.proc.kill()
+        self.proc.wait()
+
+
+class Supervisor:
+    """Represent a pool of runner processes restarted when they crash."""
+
+    def __init__(
+        self, plugin_files, processes, runner_args=(), backoff=1.0, max_backoff=60.0
+    ):  # pylint: disable=too-many-arguments
+        """Set up instance."""
+        self.runners = [
+            RunnerProcess(index, group, runner_args)
+            for index, group in enumerate(distribute(plugin_files, processes))
+        ]
+        self.initial_backoff = backoff
+        self.max_backoff = max_backoff
+        self._psutil = get_psutil()
+
+    def start(self):
+        """Start all the runner processes."""
+        for runner in self.runners:
+            runner.start(self._psutil)
+
+    def check(self, now=None):
+        """Schedule the restart of the crashed runners and restart the due ones."""
+        now = time.monotonic() if now is None else now
+        for runner in self.runners:
+            if runner.restart_at is not None:
+                if now >= runner.restart_at:
+                    runner.restarts += 1
+                    runner.start(self._psutil)
+                continue
+            code = runner.proc.poll()
+            if code is None:
+                continue
+            if runner.backoff is None or now - runner.started_at >= HEALTHY_RUNTIME:
+                runner.backoff = self.initial_backoff
+            else:
+                runner.backoff = min(runner.backoff * 2, self.max_backoff)
+            runner.restart_at = now + runner.backoff
+            logger.warning(
+                "Runner %s exited with code %s, restarting in %.1fs",
+                runner.index,
+                code,
+                runner.backoff,
+            )
+
+    def report(self):
+        """Return the status and the resource usage of the runners."""
+        reports = []
+        for runner in self.runners:
+            running = runner.proc is not None and runner.proc.poll() is None
+            usage = runner.usage.sample() if running else {}
+            reports.append(
+                {
+                    "index": runner.index,
+                    "pid": runner.proc.pid if running else None,
+                    "plugins": len(runner.plugin_files),
+                    "restarts": runner.restarts,
+                    "cpu_percent": usage.get("cpu_percent"),
+                    "memory": usage.get("memory"),
+                }
+            )
+        return reports
+
+    def stop(self):
+        """Stop all the runner processes."""
+        for runner in self.runners:
+            runner.stop()
+
+
+def log_report(reports):
+    """Log the resource usage of the runners."""
+    for report in reports:
+        cpu = report["cpu_percent"]
+        memory = report["memory"]
+        logger.info(
+            "Runner %s (pid=%s, plugins=%s, restarts=%s): cpu %s, memory %s",
+            report["index"],
+            report["pid"],
+            report["plugins"],
+            report["restarts"],
+            "n/a" if cpu is None else f"{cpu:.1f}%",
+            "n/a" if memory is None else f"{memory / 1024 ** 2:.1f}MB",
+        )
+
+
+def start_supervisor(args):
+    """Start the supervisor and run until it is terminated."""
+    runner_args = []
+    if args.server_url:
+        runner_args.append(f"--server-url={args.server_url}")
+    if args.token:
+        runner_args.append(f"--token={args.token}")
+    if args.tag:
+        runner_args.append(f"--tag={args.tag}")
+    if args.cache_dir:
+        runner_args.append(f"--cache-dir={args.cache_dir}")
+    if args.offline:
+        runner_args.append("--offline")
+    supervisor = Supervisor(
+        list_plugin_files(args.files),
+        args.processes,
+        runner_args,
+        backoff=args.backoff,
+        max_backoff=args.max_backoff,
+    )
+
+    def terminate(*_):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, terminate)
+    supervisor.start()
+    next_report = time.monotonic() + args.report_interval
+    try:
+        while True:
+            time.sleep(0.5)
+            supervisor.check()
+            if time.monotonic() >= next_report:
+                log_report(supervisor.report())
+                next_report += args.report_interval
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "files",
+        type=str,
+        nargs="+",
+        help="paths or urls to plugin files, or directories of plugin files",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of runner processes, defaults to the number of cpus",
+    )
+    parser.add_argument(
+        "--server-url",
+        type=str,
+        default=None,
+        help="url to the plugin socketio server",
+    )
+    parser.add_argument(
+        "--token",
+        type=str,
+        default=None,
+        help="token for the plugin socketio server",
+    )
+    parser.add_argument(
+        "--tag",
+        type=str,
+        default=None,
+        help="tag of the script block to run in .imjoy.html files",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="directory for caching the remote plugin files",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="load the remote plugin files from the cache only",
+    )
+    parser.add_argument(
+        "--backoff",
+        type=float,
+        default=1.0,
+        help="delay before restarting a crashed runner, doubled on each crash",
+    )
+    parser.add_argument(
+        "--max-backoff",
+        type=float,
+        default=60.0,
+        help="maximum delay before restarting a crashed runner",
+    )
+    parser.add_argument(
+        "--report-interval",
+        type=float,
+        default=60.0,
+        help="interval in seconds for reporting the cpu and memory usage",
+    )
+
+    opt = parser.parse_args()
+
+    start_supervisor(opt)
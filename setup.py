@@ -53,6 +53,7 @@ setup(
     install_requires=REQUIREMENTS,
     extras_require={
         "jupyter": ["jupyter>=1.0.0", "ipykernel>=5.1.4", "imjoy-jupyter-extension"],
+        "msgpack": ["msgpack>=1.0.0"],
     },
     zip_safe=False,
     entry_points={"console_scripts": ["imjoy = imjoy.__main__:main"]},
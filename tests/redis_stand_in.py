@@ -0,0 +1,123 @@
+"""Provide a minimal redis protocol server for testing the state backends.
+
+It supports the hash, pub/sub and connection commands used by imjoy.
+
+Usage: python -m tests.redis_stand_in [--port 6380]
+"""
+import argparse
+import asyncio
+
+from imjoy.core.store import encode_command
+
+
+def _encode_reply(value):
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, str):
+        return b"+%s\r\n" % value.encode("utf-8")
+    if isinstance(value, Exception):
+        return b"-ERR %s\r\n" % str(value).encode("utf-8")
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(_encode_reply(v) for v in value)
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+async def _read_command(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    count = int(line[1:-2])
+    args = []
+    for _ in range(count):
+        length = int((await reader.readline())[1:-2])
+        args.append((await reader.readexactly(length + 2))[:-2])
+    return args
+
+
+class RedisStandIn:
+    """Represent a redis protocol server keeping its data in memory."""
+
+    def __init__(self):
+        """Set up instance."""
+        self.hashes = {}
+        self.subscribers = {}  # channel: writers
+        self.server = None
+
+    def _execute(self, writer, name, args):
+        # pylint: disable=too-many-return-statements
+        if name == b"PING":
+            return "PONG"
+        if name in (b"AUTH", b"SELECT"):
+            return "OK"
+        if name == b"HGET":
+            return self.hashes.get(args[0], {}).get(args[1])
+        if name == b"HSET":
+            fields = self.hashes.setdefault(args[0], {})
+            created = args[1] not in fields
+            fields[args[1]] = args[2]
+            return int(created)
+        if name == b"HSETNX":
+            fields = self.hashes.setdefault(args[0], {})
+            if args[1] in fields:
+                return 0
+            fields[args[1]] = args[2]
+            return 1
+        if name == b"HDEL":
+            return int(self.hashes.get(args[0], {}).pop(args[1], None) is not None)
+        if name == b"HKEYS":
+            return list(self.hashes.get(args[0], {}))
+        if name == b"HINCRBY":
+            fields = self.hashes.setdefault(args[0], {})
+            value = int(fields.get(args[1], 0)) + int(args[2])
+            fields[args[1]] = str(value).encode("utf-8")
+            return value
+        if name == b"PUBLISH":
+            writers = self.subscribers.get(args[0], set())
+            for subscriber in writers:
+                subscriber.write(encode_command("message", args[0], args[1]))
+            return len(writers)
+        if name == b"SUBSCRIBE":
+            self.subscribers.setdefault(args[0], set()).add(writer)
+            return [b"subscribe", args[0], 1]
+        return Exception(f"unknown command '{name.decode('utf-8')}'")
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                command = await _read_command(reader)
+                if command is None:
+                    break
+                reply = self._execute(writer, command[0].upper(), command[1:])
+                writer.write(_encode_reply(reply))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for writers in self.subscribers.values():
+                writers.discard(writer)
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=6380):
+        """Start the server."""
+        self.server = await asyncio.start_server(self._handle, host, port)
+
+    async def stop(self):
+        """Stop the server."""
+        self.server.close()
+        await self.server.wait_closed()
+
+
+def main():
+    """Parse the arguments and run the server."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="host")
+    parser.add_argument("--port", type=int, default=6380, help="port")
+    args = parser.parse_args()
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(RedisStandIn().start(args.host, args.port))
+    loop.run_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Test the authentication helpers."""
+import json
+import time
+
+import pytest
+from jose import jwt
+
+from imjoy.core import UserInfo, WorkspaceInfo, all_users
+from imjoy.core.auth import (
+    JWT_SECRET,
+    JWKSKeyStore,
+    TokenCache,
+    check_permission,
+    parse_token,
+    permission_cache,
+    token_cache,
+)
+
+
+def test_token_cache():
+    """Test expiry and LRU eviction of the token cache."""
+    cache = TokenCache(maxsize=2)
+    cache.put("token1", {"user_id": "1"})
+    cache.put("token2", {"user_id": "2"}, time.time() + 60)
+    cache.put("expired", {"user_id": "3"}, time.time() - 1)
+    assert cache.get("token1") == {"user_id": "1"}
+    cache.put("token3", {"user_id": "3"})
+    # token2 is the least recently used one
+    assert cache.get("token2") is None
+    assert cache.get("expired") is None
+    assert cache.get("token3") == {"user_id": "3"}
+    assert cache.get_stats() == {"size": 2, "maxsize": 2, "hits": 2, "misses": 2}
+
+    cache.put("token4", {"user_id": "4"}, time.time() + 0.01)
+    time.sleep(0.02)
+    assert cache.get("token4") is None
+
+
+@pytest.mark.asyncio
+async def test_parse_token_cache():
+    """Test that parse_token serves repeated tokens from the cache."""
+    claims = {
+        "user_id": "test-user",
+        "email": None,
+        "roles": [],
+        "scopes": ["test-workspace"],
+        "expires_at": time.time() + 60,
+        "parent": "parent-user",
+    }
+    token = "imjoy@" + jwt.encode(claims, JWT_SECRET, algorithm="HS256")
+    stats = token_cache.get_stats()
+    assert await parse_token(f"Bearer {token}") == claims
+    user_info = await parse_token(f"Bearer {token}")
+    assert user_info == claims
+    assert token_cache.get_stats()["hits"] == stats["hits"] + 1
+    assert token_cache.get_stats()["misses"] == stats["misses"] + 1
+
+
+@pytest.mark.asyncio
+async def test_jwks_key_store(tmp_path):
+    """Test fetching and rate-limited refetching of the jwks."""
+    key = {"kid": "key1", "kty": "RSA", "use": "sig", "n": "abc", "e": "AQAB"}
+    jwks_file = tmp_path / "jwks.json"
+    jwks_file.write_text(json.dumps({"keys": [key]}))
+    store = JWKSKeyStore(url=str(jwks_file), min_refetch_interval=60)
+    try:
+        assert store.get_key("key1") == {}
+        assert await store.fetch_key("key1") == key
+
+        # unknown kids do not trigger another fetch within the refetch interval
+        key2 = dict(key, kid="key2")
+        jwks_file.write_text(json.dumps({"keys": [key, key2]}))
+        assert await store.fetch_key("key2") == {}
+        store.min_refetch_interval = 0
+        assert await store.fetch_key("key2") == key2
+
+        # the file url scheme works too
+        store.url = jwks_file.as_uri()
+        await store.refresh()
+        assert store.get_key("key2") == key2
+    finally:
+        store.stop()
+
+
+@pytest.mark.asyncio
+async def test_permission_cache():
+    """Test caching and invalidation of permission decisions."""
+    workspace = WorkspaceInfo(
+        name="test-permission-workspace",
+        persistent=False,
+        owners=["owner@imjoy.io"],
+        visibility="protected",
+        allow_list=[],
+    )
+    user = UserInfo(id="test-permission-user", roles=[], email="user@imjoy.io")
+    assert not check_permission(workspace, user)
+
+    workspace.allow_list.append("user@imjoy.io")
+    # the cached decision is kept until the workspace is invalidated
+    assert not check_permission(workspace, user)
+    permission_cache.invalidate_workspace(workspace.name)
+    assert check_permission(workspace, user)
+
+    child = UserInfo(
+        id="test-permission-child",
+        roles=[],
+        parent=user.id,
+        scopes=[workspace.name],
+    )
+    # the parent is not connected
+    assert not check_permission(workspace, child)
+    await all_users.put(user.id, user)
+    try:
+        permission_cache.invalidate_user(user.id)
+        assert check_permission(workspace, child)
+    finally:
+        await all_users.remove(user.id)
+        permission_cache.invalidate_user(user.id)
+    assert not check_permission(workspace, child)
+
+
+@pytest.mark.asyncio
+async def test_permission_cache_ancestors():
+    """Test dropping the decisions of the descendants of a removed user."""
+    workspace = WorkspaceInfo(
+        name="test-ancestors-workspace",
+        persistent=False,
+        owners=["grandparent@imjoy.io"],
+        visibility="protected",
+        allow_list=[],
+    )
+    grandparent = UserInfo(
+        id="test-grandparent", roles=[], email="grandparent@imjoy.io"
+    )
+    parent = UserInfo(
+        id="test-parent", roles=[], parent=grandparent.id, scopes=[workspace.name]
+    )
+    child = UserInfo(
+        id="test-child", roles=[], parent=parent.id, scopes=[workspace.name]
+    )
+    await all_users.put(grandparent.id, grandparent)
+    await all_users.put(parent.id, parent)
+    try:
+        assert check_permission(workspace, child)
+        await all_users.remove(grandparent.id)
+        permission_cache.invalidate_user(grandparent.id)
+        assert not check_permission(workspace, child)
+    finally:
+        await all_users.remove(parent.id)
+        permission_cache.invalidate_user(parent.id)
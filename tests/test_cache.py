@@ -0,0 +1,82 @@
+"""Test the cache of the remote plugin files."""
+import pytest
+from aiohttp import web
+
+from imjoy.cache import PluginCache
+
+# All test coroutines will be treated as marked.
+pytestmark = pytest.mark.asyncio
+
+PORT = 38288
+BASE_URL = f"http://127.0.0.1:{PORT}"
+
+
+class OriginStandIn:
+    """Represent an http server serving plugin files with validators."""
+
+    def __init__(self):
+        """Set up instance."""
+        self.content = "print('version 1')"
+        self.etag = '"v1"'
+        self.requests = []
+        self.runner = None
+
+    async def handle(self, request):
+        """Serve the plugin file, or 304 if the client copy is still valid."""
+        self.requests.append(dict(request.headers))
+        headers = {"ETag": self.etag}
+        if request.path == "/fresh.py":
+            headers["Cache-Control"] = "max-age=3600"
+        if request.headers.get("If-None-Match") == self.etag:
+            return web.Response(status=304, headers=headers)
+        return web.Response(text=self.content, headers=headers)
+
+    async def start(self):
+        """Start the server."""
+        app = web.Application()
+        app.router.add_get("/{name}", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", PORT).start()
+
+    async def stop(self):
+        """Stop the server."""
+        await self.runner.cleanup()
+
+
+async def test_plugin_cache(tmp_path):
+    """Test fetching, revalidating and serving plugin files offline."""
+    origin = OriginStandIn()
+    await origin.start()
+    try:
+        cache = PluginCache(str(tmp_path))
+        url = f"{BASE_URL}/plugin.py?token=123"
+        assert await cache.fetch(url) == "print('version 1')"
+        assert "If-None-Match" not in origin.requests[-1]
+
+        # revalidated with a conditional request
+        assert await cache.fetch(url) == "print('version 1')"
+        assert origin.requests[-1]["If-None-Match"] == '"v1"'
+
+        origin.content, origin.etag = "print('version 2')", '"v2"'
+        assert await cache.fetch(url) == "print('version 2')"
+        assert len(list((tmp_path / "objects").iterdir())) == 2
+
+        # fresh entries are not revalidated
+        await cache.fetch(f"{BASE_URL}/fresh.py")
+        count = len(origin.requests)
+        assert await cache.fetch(f"{BASE_URL}/fresh.py") == "print('version 2')"
+        assert len(origin.requests) == count
+
+        offline_cache = PluginCache(str(tmp_path), offline=True)
+        assert await offline_cache.fetch(url) == "print('version 2')"
+        assert len(origin.requests) == count
+        with pytest.raises(Exception, match=r".*is not cached.*"):
+            await offline_cache.fetch(f"{BASE_URL}/other.py")
+    finally:
+        await origin.stop()
+
+    # the cached copy is used if the origin is down
+    assert await cache.fetch(url) == "print('version 2')"
+    with pytest.raises(Exception):
+        await cache.fetch(f"{BASE_URL}/other.py")
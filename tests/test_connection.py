@@ -0,0 +1,207 @@
+"""Test the core connection."""
+import asyncio
+
+import pytest
+
+from imjoy.core import metrics
+from imjoy.core.connection import BasicConnection, all_connections, encode_frame
+
+# All test coroutines will be treated as marked.
+pytestmark = pytest.mark.asyncio
+
+
+async def test_batching():
+    """Test batching messages and unpacking the batch frames in order."""
+    frames = []
+
+    async def send(frame):
+        frames.append(frame)
+
+    connection = BasicConnection(send, batch_window=0.01, batch_size=3)
+    for index in range(7):
+        connection.emit({"type": "message", "index": index})
+    await asyncio.sleep(0.05)
+    assert [frame["type"] for frame in frames] == ["batch", "batch", "message"]
+    assert [len(frame["messages"]) for frame in frames[:2]] == [3, 3]
+
+    received = []
+    receiver = BasicConnection(send)
+    receiver.on("message", lambda data: received.append(data["index"]))
+    for frame in frames:
+        receiver.handle_message(frame)
+    assert received == list(range(7))
+
+
+async def test_backpressure():
+    """Test the send queue watermarks and overflow policies."""
+    frames = []
+    release = asyncio.Event()
+
+    async def slow_send(frame):
+        await release.wait()
+        frames.append(frame)
+
+    connection = BasicConnection(slow_send, high_watermark=4, low_watermark=1)
+    for index in range(6):
+        connection.emit({"type": "message", "index": index})
+    assert connection.paused
+    assert connection.queue_size == 6
+    drained = asyncio.ensure_future(connection.drain())
+    await asyncio.sleep(0.01)
+    assert not drained.done()
+    release.set()
+    await asyncio.wait_for(drained, 1)
+    assert not connection.paused
+    await asyncio.sleep(0.01)
+    assert [frame["index"] for frame in frames] == list(range(6))
+
+    release.clear()
+    connection = BasicConnection(slow_send, high_watermark=2, overflow_policy="drop")
+    for index in range(4):
+        connection.emit({"type": "message", "index": index})
+    assert connection.queue_size == 2
+    assert connection.dropped == 2
+
+    disconnected = []
+    connection = BasicConnection(
+        slow_send, high_watermark=2, overflow_policy="disconnect"
+    )
+    connection.on("disconnected", disconnected.append)
+    for index in range(3):
+        connection.emit({"type": "message", "index": index})
+    assert connection.queue_size == 0
+    assert disconnected[0]["error"]
+    release.set()
+
+
+async def test_binary_frames():
+    """Test sending messages as msgpack binary frames."""
+    pytest.importorskip("msgpack")
+    frames = []
+
+    async def send(frame):
+        frames.append(frame)
+
+    connection = BasicConnection(send, encoding="msgpack")
+    connection.peer_id = "peer"
+    data = b"\x00\x01" * 1024
+    connection.emit(
+        {"type": "message", "value": {"_rtype": "bytes", "v": data}, "small": b"1"}
+    )
+    await asyncio.sleep(0.01)
+    assert set(frames[0]) == {"type", "peer_id", "_msgpack", "_buffers"}
+    assert isinstance(frames[0]["_msgpack"], bytes)
+    # the large buffers are sent as attachments without being copied
+    assert frames[0]["_buffers"] == [data] and frames[0]["_buffers"][0] is data
+    assert len(frames[0]["_msgpack"]) < 100
+
+    received = []
+    receiver = BasicConnection(send)
+    receiver.on("message", received.append)
+    receiver.handle_message(frames[0])
+    assert received[0]["peer_id"] == "peer"
+    assert received[0]["value"]["v"] is data
+    assert received[0]["small"] == b"1"
+
+
+async def test_relay():
+    """Test relaying frames to another peer without decoding them."""
+    pytest.importorskip("msgpack")
+    frames = {"source": [], "target": []}
+
+    def make_connection(peer_id, encoding):
+        async def send(frame):
+            frames[peer_id].append(frame)
+
+        connection = BasicConnection(send, encoding=encoding)
+        connection.peer_id = peer_id
+        all_connections[peer_id] = connection
+        return connection
+
+    source = make_connection("source", "msgpack")
+    target = make_connection("target", "msgpack")
+    try:
+        frame = encode_frame({"type": "method", "target_id": "target", "value": 1})
+        source.handle_message(frame)
+        await asyncio.sleep(0.01)
+        assert frames["source"] == []
+        # the body is forwarded as is
+        assert frames["target"][0]["_msgpack"] is frame["_msgpack"]
+        assert frames["target"][0]["peer_id"] == "target"
+        assert metrics.relayed_messages.labels("source", "target").value == 1
+        assert metrics.relayed_bytes.labels("source", "target").value == len(
+            frame["_msgpack"]
+        )
+
+        target.encoding = "json"
+        source.handle_message(frame)
+        await asyncio.sleep(0.01)
+        assert frames["target"][1]["value"] == 1
+
+        # the queue of the target applies backpressure to the source
+        target._high_watermark = 2  # pylint: disable=protected-access
+        for _ in range(3):
+            source.handle_message(frame)
+        assert target.paused and source.congested and not source.paused
+        await asyncio.wait_for(source.drain(), 1)
+        assert not source.congested
+        assert len(frames["target"]) == 5
+
+        # the frames get the access token of the receiver, like emitted ones
+        # pylint: disable=protected-access
+        target._access_token, target._expires_in = "secret", float("inf")
+        source.handle_message(dict(frame, access_token="leaked"))
+        await asyncio.sleep(0.01)
+        assert frames["target"][-1]["access_token"] == "secret"
+
+        # the metrics of a peer are removed when it is disconnected
+        target.disconnect()
+        assert 'target="target"' not in "\n".join(metrics.relayed_messages.collect())
+    finally:
+        source.disconnect()
+        target.disconnect()
+
+
+async def test_suspend():
+    """Test keeping the messages while the connection is suspended."""
+    frames = []
+
+    async def send(frame):
+        frames.append(frame)
+
+    connection = BasicConnection(send)
+    connection.suspend()
+    for index in range(3):
+        connection.emit({"type": "message", "index": index})
+    await asyncio.sleep(0.01)
+    assert not frames
+    assert connection.queue_size == 3
+    connection.resume()
+    await asyncio.sleep(0.01)
+    assert [frame["index"] for frame in frames] == [0, 1, 2]
+
+    connection.suspend()
+    connection.emit({"type": "message", "index": 3})
+    connection.disconnect()
+    assert connection.queue_size == 0
+
+
+async def test_suspend_overflow():
+    """Test capping the queue while the connection is suspended."""
+    frames = []
+
+    async def send(frame):
+        frames.append(frame)
+
+    connection = BasicConnection(send, high_watermark=2)
+    connection.suspend()
+    for index in range(5):
+        connection.emit({"type": "message", "index": index})
+    assert connection.queue_size == 2
+    assert connection.dropped == 3
+    assert not connection.paused
+    connection.resume()
+    await connection.drain()
+    await asyncio.sleep(0.01)
+    assert [frame["index"] for frame in frames] == [0, 1]
+    connection.disconnect()
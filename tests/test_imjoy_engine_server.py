@@ -1,4 +1,5 @@
 """Test the imjoy engine server."""
+import asyncio
 import os
 import subprocess
 import sys
@@ -6,8 +7,21 @@ import time
 
 import pytest
 import requests
+import socketio
 from requests import RequestException
 from imjoy_rpc import connect_to_server
+from imjoy_rpc.utils import ContextLocal
+
+from imjoy.core import WorkspaceInfo
+from imjoy.core.store import SQLiteBackend
+from imjoy.runner import (
+    PluginChannel,
+    PluginManager,
+    SharedClient,
+    list_plugin_files,
+    load_plugin,
+)
+from imjoy.supervisor import Supervisor
 
 # All test coroutines will be treated as marked.
 pytestmark = pytest.mark.asyncio
@@ -87,6 +101,104 @@ def test_plugin_runner(socketio_server):
         assert "echo: a message" in output
 
 
+def test_multi_plugin_runner(socketio_server, tmp_path):
+    """Test running several plugins in one process."""
+    for name in ("plugin_a", "plugin_b"):
+        (tmp_path / f"{name}.py").write_text(
+            f"""
+from imjoy_rpc import api
+
+NAME = "{name}"
+
+
+class ImJoyPlugin:
+    async def setup(self):
+        await api.register_service({{"name": NAME, "echo": lambda x: x}})
+        services = await api.get_services({{"name": NAME}})
+        print(f"{{NAME}} ready", len(services), flush=True)
+
+
+api.export(ImJoyPlugin())
+"""
+        )
+    (tmp_path / "README.md").write_text("not a plugin")
+    with subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "imjoy.runner",
+            f"--server-url={SERVER_URL}",
+            str(tmp_path),
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    ) as proc:
+        timeout = 10
+        while timeout > 0:
+            stats = requests.get(f"{SERVER_URL}/stats").json()
+            if stats["plugins"] == 2:
+                break
+            timeout -= 0.1
+            time.sleep(0.1)
+        time.sleep(0.5)
+        proc.terminate()
+        out, err = proc.communicate()
+    # the plugins share one connection
+    assert stats == {"sessions": 1, "users": 1, "workspaces": 1, "plugins": 2}
+    output = out.decode("utf8")
+    assert "plugin_a ready 1" in output
+    assert "plugin_b ready 1" in output
+    assert "Failed" not in output + err.decode("utf8")
+
+
+def wait_for_stats(expected, timeout=10):
+    """Wait until the server stats match the expected values."""
+    while timeout > 0:
+        stats = requests.get(f"{SERVER_URL}/stats").json()
+        if all(stats[key] == value for key, value in expected.items()):
+            return stats
+        timeout -= 0.1
+        time.sleep(0.1)
+    raise TimeoutError(f"Unexpected server stats: {stats}")
+
+
+def test_plugin_supervisor(socketio_server, tmp_path):
+    """Test running plugins in a pool of runner processes."""
+    for index in range(3):
+        (tmp_path / f"plugin_{index}.py").write_text(
+            "from imjoy_rpc import api\napi.export({'setup': lambda: None})\n"
+        )
+    supervisor = Supervisor(
+        list_plugin_files([str(tmp_path)]),
+        processes=2,
+        runner_args=[f"--server-url={SERVER_URL}"],
+        backoff=0.1,
+    )
+    assert [len(runner.plugin_files) for runner in supervisor.runners] == [2, 1]
+    supervisor.start()
+    try:
+        wait_for_stats({"sessions": 2, "plugins": 3})
+        crashed = supervisor.runners[0].proc
+        crashed.kill()
+        crashed.wait()
+        # the plugins of the crashed runner are parked for the grace period
+        wait_for_stats({"sessions": 1, "plugins": 3})
+        timeout = 5
+        while supervisor.runners[0].restarts == 0 and timeout > 0:
+            supervisor.check()
+            timeout -= 0.05
+            time.sleep(0.05)
+        assert supervisor.runners[0].proc.pid != crashed.pid
+        wait_for_stats({"sessions": 2, "plugins": 5})
+        reports = supervisor.report()
+        assert [report["restarts"] for report in reports] == [1, 0]
+        assert all(report["memory"] > 0 for report in reports)
+        assert all(report["cpu_percent"] is not None for report in reports)
+    finally:
+        supervisor.stop()
+    assert all(runner.proc.poll() is not None for runner in supervisor.runners)
+
+
 async def test_workspace(socketio_server):
     """Test the plugin runner."""
     api = await connect_to_server({"name": "my plugin", "server_url": SERVER_URL})
@@ -150,6 +262,9 @@ async def test_workspace(socketio_server):
 
     with pytest.raises(Exception, match=r".*Plugin my plugin 2 not found.*"):
         await api.get_plugin("my plugin 2")
+    # the bound workspace applies to the async functions too
+    plugin = await ws.get_plugin("my plugin 2")
+    assert plugin.foo2 == "bar2"
 
     with pytest.raises(
         Exception, match=r".*Workspace authorizer is not supported yet.*"
@@ -174,3 +289,342 @@ async def test_workspace(socketio_server):
 
     with pytest.raises(Exception):
         await ws2.set({"covers": [], "non-exist-key": 999})
+
+
+async def test_workspace_store(tmp_path):
+    """Test keeping the persistent workspaces across server restarts."""
+    port = PORT + 10
+    server_url = f"http://127.0.0.1:{port}"
+    command = [
+        sys.executable,
+        "-m",
+        "imjoy.server",
+        f"--port={port}",
+        f"--workspace-store=sqlite://{tmp_path / 'workspaces.db'}",
+    ]
+    for restarted in (False, True):
+        with subprocess.Popen(command) as proc:
+            timeout = 5
+            while timeout > 0:
+                try:
+                    if requests.get(f"{server_url}/health").ok:
+                        break
+                except RequestException:
+                    pass
+                timeout -= 0.1
+                time.sleep(0.1)
+            api = await connect_to_server(
+                {"name": "my plugin", "server_url": server_url}
+            )
+            if not restarted:
+                await api.create_workspace(
+                    {
+                        "name": "my-persistent-workspace",
+                        "owners": [],
+                        "visibility": "public",
+                        "persistent": True,
+                        "docs": "https://imjoy.io",
+                    }
+                )
+            else:
+                # a public workspace, the new anonymous user can get it
+                workspace = await api.get_workspace("my-persistent-workspace")
+                assert workspace.config["workspace"] == "my-persistent-workspace"
+                await workspace.log("hello")
+                response = requests.get(f"{server_url}/stats/workspaces")
+                assert "my-persistent-workspace" in [
+                    item["name"] for item in response.json()["items"]
+                ]
+            proc.terminate()
+
+    store = SQLiteBackend(str(tmp_path / "workspaces.db"))
+    assert store.keys("workspaces") == ["my-persistent-workspace"]
+    workspace = WorkspaceInfo.parse_raw(
+        store.get("workspaces", "my-persistent-workspace")
+    )
+    store.close()
+    assert workspace.persistent and workspace.visibility == "public"
+    assert workspace.docs == "https://imjoy.io"
+    assert len(workspace.owners) == 1
+
+
+async def test_logs(socketio_server):
+    """Test getting the logs of a plugin."""
+    api = await connect_to_server({"name": "my plugin", "server_url": SERVER_URL})
+    await api.log("first message")
+    await api.error("an error")
+    logs = await api.get_logs("my plugin")
+    assert [(entry["level"], entry["value"]) for entry in logs[-2:]] == [
+        ("info", "first message"),
+        ("error", "an error"),
+    ]
+    errors = await api.get_logs("my plugin", level="error")
+    assert [entry["value"] for entry in errors] == ["an error"]
+    assert await api.get_logs("my plugin", since=logs[-1]["time"] + 1) == []
+    with pytest.raises(Exception, match=r".*Plugin unknown not found.*"):
+        await api.get_logs("unknown")
+
+
+async def test_metrics(socketio_server):
+    """Test the metrics endpoint."""
+    api = await connect_to_server({"name": "my plugin", "server_url": SERVER_URL})
+    await api.log("hello")
+    response = requests.get(f"{SERVER_URL}/metrics")
+    assert response.ok
+    lines = response.text.splitlines()
+    assert "imjoy_plugin_registrations_total 1.0" in lines
+    assert "imjoy_sessions 1.0" in lines
+    assert any(
+        line.startswith(
+            f'imjoy_plugin_messages_total{{workspace="{api.config.workspace}"}}'
+        )
+        for line in lines
+    )
+    assert "imjoy_plugin_message_latency_seconds_count" in response.text
+    assert "imjoy_event_loop_lag_seconds" in response.text
+
+
+async def test_stats(socketio_server):
+    """Test the health and stats endpoints."""
+    assert requests.get(f"{SERVER_URL}/health").json() == {"status": "OK"}
+    api = await connect_to_server({"name": "my plugin", "server_url": SERVER_URL})
+    await api.log("hello")
+    assert requests.get(f"{SERVER_URL}/stats").json() == {
+        "sessions": 1,
+        "users": 1,
+        "workspaces": 1,
+        "plugins": 1,
+    }
+    workspace = api.config.workspace
+    response = requests.get(f"{SERVER_URL}/stats/workspaces?limit=1000").json()
+    assert response["limit"] == 100
+    assert {"name": workspace, "plugins": 1} in response["items"]
+    response = requests.get(
+        f"{SERVER_URL}/stats/workspaces?offset={response['total']}"
+    ).json()
+    assert response["items"] == []
+
+
+async def test_plugin_resumption(socketio_server, tmp_path):
+    """Test resuming a plugin after the connection is interrupted."""
+    plugin_file = tmp_path / "resumable.py"
+    plugin_file.write_text(
+        """
+from imjoy_rpc import api
+
+calls = []
+
+
+class ImJoyPlugin:
+    async def setup(self):
+        calls.append("setup")
+        await api.register_service({"name": "resumable", "echo": lambda x: x})
+
+
+api.export(ImJoyPlugin())
+"""
+    )
+    client = SharedClient(SERVER_URL)
+    await client.connect()
+    namespace = await load_plugin(client, str(plugin_file), {"name": "resumable"})
+    for _ in range(100):
+        if namespace["calls"]:
+            break
+        await asyncio.sleep(0.1)
+    (channel,) = client.channels.values()
+    assert channel.resume_token
+
+    # drop the transport, the client reconnects and resumes the plugin
+    # (engineio 4.0 waits for its write loop before noticing the closed socket)
+    await client.sio.eio.queue.put(None)
+    await client.sio.eio.ws.close()
+    for _ in range(100):
+        if not channel.online.is_set():
+            break
+        await asyncio.sleep(0.1)
+    await asyncio.wait_for(channel.online.wait(), 10)
+    services = await namespace["api"].get_services({"name": "resumable"})
+    assert len(services) == 1
+    assert namespace["calls"] == ["setup"]
+    response = requests.get(f"{SERVER_URL}/metrics")
+    assert "imjoy_plugin_resumptions_total 1.0" in response.text
+    assert "imjoy_parked_plugins 0.0" in response.text
+    await client.sio.disconnect()
+
+
+async def test_plugin_room_permission(socketio_server):
+    """Test that only the permitted sessions receive the frames of a plugin."""
+    owner = socketio.AsyncClient()
+    intruder = socketio.AsyncClient()
+    received = {"owner": [], "intruder": []}
+    owner.on("plugin_message", received["owner"].append)
+    intruder.on("plugin_message", received["intruder"].append)
+    await owner.connect(SERVER_URL)
+    await intruder.connect(SERVER_URL)
+    result = await owner.call("register_plugin", {"name": "owned"})
+    plugin_id = result["plugin_id"]
+    workspace = os.path.dirname(plugin_id)
+
+    for _ in range(3):
+        result = await intruder.call(
+            "register_plugin", {"name": "owned", "workspace": workspace}
+        )
+        assert not result["success"]
+    # a failed resumption leaves the owner in the room
+    result = await owner.call(
+        "register_plugin", {"name": "owned", "resume_token": "invalid"}
+    )
+    assert not result["success"]
+
+    # the plugin answers with an initialize frame
+    await owner.call(
+        "plugin_message",
+        {"type": "imjoyRPCReady", "config": {}, "peer_id": "p", "plugin_id": plugin_id},
+    )
+    for _ in range(50):
+        if received["owner"]:
+            break
+        await asyncio.sleep(0.1)
+    assert received["owner"] and not received["intruder"]
+    await owner.disconnect()
+    await intruder.disconnect()
+
+
+async def test_parked_plugin_expiry(tmp_path):
+    """Test removing the parked plugins after the grace period."""
+    port = PORT + 11
+    server_url = f"http://127.0.0.1:{port}"
+    plugin_file = tmp_path / "resumable.py"
+    plugin_file.write_text("from imjoy_rpc import api\napi.export({})\n")
+    with subprocess.Popen(
+        [sys.executable, "-m", "imjoy.server", f"--port={port}"],
+        env=dict(os.environ, PLUGIN_RESUME_GRACE_PERIOD="1"),
+    ) as proc:
+        timeout = 5
+        while timeout > 0:
+            try:
+                if requests.get(f"{server_url}/health").ok:
+                    break
+            except RequestException:
+                pass
+            timeout -= 0.1
+            time.sleep(0.1)
+        client = SharedClient(server_url)
+        await client.connect()
+        await load_plugin(client, str(plugin_file), {"name": "resumable"})
+        await client.sio.disconnect()
+        await asyncio.sleep(0.2)
+        stats = requests.get(f"{server_url}/stats").json()
+        assert stats == {"sessions": 0, "users": 0, "workspaces": 1, "plugins": 1}
+        await asyncio.sleep(1.5)
+        stats = requests.get(f"{server_url}/stats").json()
+        assert stats == {"sessions": 0, "users": 0, "workspaces": 0, "plugins": 0}
+        proc.terminate()
+
+
+async def test_get_plugin_waits_for_readiness(socketio_server):
+    """Test waiting for a plugin which is still initializing."""
+    api = await connect_to_server({"name": "consumer", "server_url": SERVER_URL})
+    token = (await api.generate_token())["token"]
+    client = SharedClient(SERVER_URL, token)
+    await client.connect()
+    # the plugin is registered, its handshake is run later
+    config = {"name": "slow plugin", "workspace": api.config["workspace"]}
+    result = await client.sio.call("register_plugin", config)
+    with pytest.raises(Exception, match=r".*Plugin slow plugin is not ready.*"):
+        await api.get_plugin("slow plugin", timeout=0.1)
+    waiting = [asyncio.ensure_future(api.get_plugin("slow plugin")) for _ in range(3)]
+    await asyncio.sleep(0.2)
+    assert not any(task.done() for task in waiting)
+
+    rpc_context = ContextLocal()
+    rpc_context.default_config = config
+    manager = PluginManager(rpc_context, client)
+    manager.set_interface({"echo": lambda msg: msg})
+    channel = PluginChannel(client, "slow-peer", result["plugin_id"])
+    client.channels[channel.peer_id] = channel
+    manager._create_new_connection(  # pylint: disable=protected-access
+        channel, result["plugin_id"], channel.peer_id, None, None
+    )
+    plugins = await asyncio.wait_for(asyncio.gather(*waiting), 10)
+    assert [await plugin.echo("hello") for plugin in plugins] == ["hello"] * 3
+    await client.sio.disconnect()
+
+
+async def test_get_service(socketio_server):
+    """Test balancing the calls over the replicas of a service."""
+    api = await connect_to_server({"name": "client", "server_url": SERVER_URL})
+    token = (await api.generate_token())["token"]
+    release = asyncio.Event()
+
+    async def slow_echo(msg):
+        await release.wait()
+        return msg
+
+    for index in range(2):
+        replica = await connect_to_server(
+            {
+                "name": f"replica-{index}",
+                "workspace": api.config["workspace"],
+                "server_url": SERVER_URL,
+                "token": token,
+            }
+        )
+        await replica.register_service(
+            {"name": "inference", "echo": slow_echo, "index": index}
+        )
+
+    indexes = [
+        (await api.get_service({"name": "inference"}))["index"] for _ in range(4)
+    ]
+    assert indexes == [0, 1, 0, 1]
+    # the keyword arguments are passed over RPC as a trailing dict
+    service = await api.get_service({"name": "inference"}, strategy="random")
+    assert service["index"] in (0, 1)
+
+    service = await api.get_service({"name": "inference"}, "least-in-flight")
+    busy = asyncio.ensure_future(service.echo("hello"))
+    await asyncio.sleep(0.2)
+    for _ in range(3):
+        other = await api.get_service({"name": "inference"}, "least-in-flight")
+        assert other["index"] != service["index"]
+    release.set()
+    assert await busy == "hello"
+    with pytest.raises(Exception, match=r".*Service not found.*"):
+        await api.get_service({"name": "missing"})
+
+
+async def test_concurrency_limit(socketio_server):
+    """Test queueing the calls to a plugin at its concurrency limit."""
+    api = await connect_to_server({"name": "client", "server_url": SERVER_URL})
+    token = (await api.generate_token())["token"]
+    running = []
+    concurrency = []
+
+    async def work(index):
+        running.append(index)
+        concurrency.append(len(running))
+        await asyncio.sleep(0.1)
+        running.remove(index)
+        return index
+
+    provider = await connect_to_server(
+        {
+            "name": "single threaded",
+            "workspace": api.config["workspace"],
+            "server_url": SERVER_URL,
+            "token": token,
+            "concurrency_limit": 1,
+        }
+    )
+    await provider.register_service({"_rintf": True, "name": "worker", "work": work})
+    service = await api.get_service({"name": "worker"})
+    assert await asyncio.gather(*[service.work(index) for index in range(3)]) == [
+        0,
+        1,
+        2,
+    ]
+    assert max(concurrency) == 1
+    response = requests.get(f"{SERVER_URL}/metrics")
+    # the two calls behind the first one were queued
+    assert "imjoy_call_queue_seconds_count 2\n" in response.text
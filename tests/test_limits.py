@@ -0,0 +1,111 @@
+"""Test the concurrency limits of the calls."""
+import asyncio
+
+import pytest
+
+from imjoy.core.limits import ConcurrencyLimiter, limit_calls
+
+# All test coroutines will be treated as marked.
+pytestmark = pytest.mark.asyncio
+
+
+async def test_queue_order():
+    """Test handing the free slots over by priority, then in arrival order."""
+    limiter = ConcurrencyLimiter(1)
+    order = []
+    release = asyncio.Event()
+
+    async def work(name):
+        order.append(name)
+        if name == "first":
+            await release.wait()
+
+    first = asyncio.ensure_future(limit_calls(work, [limiter])("first"))
+    await asyncio.sleep(0)
+    calls = [
+        asyncio.ensure_future(
+            limit_calls(work, [limiter], lambda priority=priority: priority)(name)
+        )
+        for name, priority in (("a", 0), ("b", 0), ("c", 5), ("d", 1))
+    ]
+    await asyncio.sleep(0)
+    assert order == ["first"]
+    assert limiter.queue_size == 4
+    release.set()
+    await asyncio.gather(first, *calls)
+    assert order == ["first", "c", "d", "a", "b"]
+    assert limiter.active == 0 and limiter.queue_size == 0
+
+
+async def test_queue_limits():
+    """Test rejecting the calls beyond the queue depth or its timeout."""
+    limiter = ConcurrencyLimiter(1, max_depth=1, timeout=0.05)
+    await limiter.acquire()
+    waiting = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    with pytest.raises(Exception, match=r".*Too many calls waiting.*"):
+        await limiter.acquire()
+    with pytest.raises(Exception, match=r".*waited for a slot.*"):
+        await waiting
+    assert limiter.queue_size == 0
+
+    # a cancelled call leaves the queue
+    waiting = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    assert limiter.queue_size == 0
+    limiter.release()
+    assert limiter.active == 0
+
+    unlimited = ConcurrencyLimiter()
+    await asyncio.gather(*[unlimited.acquire() for _ in range(10)])
+    assert unlimited.active == 10
+
+
+async def test_resize():
+    """Test changing the limit while calls are running and waiting."""
+    limiter = ConcurrencyLimiter(1)
+    await limiter.acquire()
+    waiting = [asyncio.ensure_future(limiter.acquire()) for _ in range(3)]
+    await asyncio.sleep(0)
+    limiter.resize(3)
+    await asyncio.sleep(0.01)
+    assert [task.done() for task in waiting] == [True, True, False]
+    assert limiter.active == 3 and limiter.queue_size == 1
+
+    # the running calls finish before the lower limit applies
+    limiter.resize(1)
+    limiter.release()
+    limiter.release()
+    await asyncio.sleep(0.01)
+    assert not waiting[2].done() and limiter.active == 1
+    limiter.release()
+    await asyncio.sleep(0.01)
+    assert waiting[2].done() and limiter.active == 1
+
+    limiter.resize(0)
+    assert limiter.limit is None
+
+
+async def test_unlimited_calls():
+    """Test skipping the limiters without a limit until one is set."""
+    limiter = ConcurrencyLimiter()
+    release = asyncio.Event()
+
+    async def work():
+        await release.wait()
+
+    call = limit_calls(work, [limiter])
+    running = [asyncio.ensure_future(call()) for _ in range(3)]
+    await asyncio.sleep(0.01)
+    assert limiter.active == 0
+
+    limiter.resize(1)
+    limited = [asyncio.ensure_future(call()) for _ in range(2)]
+    await asyncio.sleep(0.01)
+    assert limiter.active == 1 and limiter.queue_size == 1
+    release.set()
+    await asyncio.gather(*running, *limited)
+    assert limiter.active == 0 and limiter.queue_size == 0
@@ -0,0 +1,45 @@
+"""Test the plugin log history."""
+import pytest
+from pydantic import ValidationError
+
+from imjoy.core import WorkspaceInfo
+from imjoy.core.logs import LogBuffer
+
+
+def test_log_buffer():
+    """Test the ring buffer and its queries."""
+    logs = LogBuffer(capacity=4)
+    for index in range(6):
+        logs.append("error" if index % 2 else "info", f"message {index}", index)
+    assert len(logs) == 4 and logs.first == 2
+    assert [entry["value"] for entry in logs.get()] == [
+        "message 2",
+        "message 3",
+        "message 4",
+        "message 5",
+    ]
+    assert logs.get(limit=1) == [
+        {"seq": 5, "time": 5, "level": "error", "value": "message 5"}
+    ]
+    assert [entry["seq"] for entry in logs.get(since=3.5)] == [4, 5]
+    assert [entry["seq"] for entry in logs.get(level="error")] == [3, 5]
+    assert [entry["seq"] for entry in logs.get(since=0, level="info", limit=2)] == [
+        4,
+        5,
+    ]
+    assert logs.get(since=10) == []
+
+
+def test_log_capacity():
+    """Test rejecting the log capacities below one entry."""
+    for capacity in (0, -1):
+        with pytest.raises(ValueError):
+            LogBuffer(capacity)
+        with pytest.raises(ValidationError):
+            WorkspaceInfo(
+                name="ws",
+                persistent=False,
+                owners=[],
+                visibility="protected",
+                log_capacity=capacity,
+            )
@@ -0,0 +1,37 @@
+"""Test the core metrics."""
+from imjoy.core.metrics import Counter, Gauge, Histogram, generate_latest
+
+
+def test_metrics_format():
+    """Test rendering the metrics in the prometheus text format."""
+    registry = []
+    counter = Counter("test_total", "A counter.", ["workspace"], registry=registry)
+    counter.labels('my "ws"').inc()
+    counter.labels('my "ws"').inc(2)
+    gauge = Gauge("test_gauge", "A gauge.", registry=registry)
+    gauge.inc(5)
+    gauge.dec()
+    histogram = Histogram(
+        "test_seconds", "A histogram.", buckets=(0.1, 1), registry=registry
+    )
+    for value in (0.05, 0.5, 0.5, 2):
+        histogram.observe(value)
+
+    assert generate_latest(registry).splitlines() == [
+        "# HELP test_total A counter.",
+        "# TYPE test_total counter",
+        'test_total{workspace="my \\"ws\\""} 3.0',
+        "# HELP test_gauge A gauge.",
+        "# TYPE test_gauge gauge",
+        "test_gauge 4.0",
+        "# HELP test_seconds A histogram.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{le="0.1"} 1',
+        'test_seconds_bucket{le="1"} 3',
+        'test_seconds_bucket{le="+Inf"} 4',
+        "test_seconds_sum 3.05",
+        "test_seconds_count 4",
+    ]
+
+    counter.remove('my "ws"')
+    assert "test_total{" not in generate_latest(registry)
@@ -0,0 +1,65 @@
+"""Test the plugin file parser."""
+from imjoy.parser import iter_blocks, parse_plugin_source, select_block
+from imjoy.runner import parse_plugin
+
+SOURCE = """<docs lang="markdown">
+Returns `<script>` blocks </script> are ignored in docs.
+</docs>
+
+<config lang="json">
+{"name": "test", "tags": ["stable", "dev"]}
+</config>
+
+<script lang="javascript">
+console.log("</div>")
+</script>
+
+<script lang="python">
+print("default")
+</script>
+
+<script lang="python" tag='dev'>
+print("</script" + ">")
+</script>
+
+<window lang=html><div><window>nested</window></div></window>
+"""
+
+
+def test_parse_blocks():
+    """Test parsing all the blocks with their attributes."""
+    blocks = parse_plugin_source(SOURCE)
+    assert [(block.name, block.attrs) for block in blocks] == [
+        ("docs", {"lang": "markdown"}),
+        ("config", {"lang": "json"}),
+        ("script", {"lang": "javascript"}),
+        ("script", {"lang": "python"}),
+        ("script", {"lang": "python", "tag": "dev"}),
+        ("window", {"lang": "html"}),
+    ]
+    assert blocks[0].content == (
+        "Returns `<script>` blocks </script> are ignored in docs.\n"
+    )
+    assert blocks[5].content == "<div><window>nested</window></div>"
+    # the results are cached by the hash of the source
+    assert parse_plugin_source(SOURCE) is blocks
+    assert tuple(iter_blocks(SOURCE.splitlines(keepends=True))) == blocks
+
+
+def test_select_block():
+    """Test choosing the script by language and tag."""
+    blocks = parse_plugin_source(SOURCE)
+    assert select_block(blocks, "script", lang="python").content == (
+        'print("default")\n'
+    )
+    assert select_block(blocks, "script", lang="python", tag="dev").content == (
+        'print("</script" + ">")\n'
+    )
+    assert select_block(blocks, "script", lang="python", tag="stable").content == (
+        'print("default")\n'
+    )
+    assert select_block(blocks, "script", lang="r") is None
+
+    config, script = parse_plugin("test.imjoy.html", SOURCE, tag="dev")
+    assert config == {"name": "test", "tags": ["stable", "dev"]}
+    assert script == 'print("</script" + ">")\n'
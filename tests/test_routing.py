@@ -0,0 +1,25 @@
+"""Test the routing table for plugin messages."""
+from contextvars import ContextVar
+from types import SimpleNamespace
+
+from imjoy.core import current_plugin
+from imjoy.core.routing import create_route
+
+message_var = ContextVar("message_var", default=None)
+
+
+def test_route_context():
+    """Test dispatching each message in a fresh copy of the bound context."""
+    seen = []
+
+    def handle_message(data):
+        seen.append((current_plugin.get().id, message_var.get()))
+        message_var.set(data)
+
+    plugin = SimpleNamespace(id="p1", connection=None)
+    plugin.connection = SimpleNamespace(handle_message=handle_message)
+    route = create_route(SimpleNamespace(id="user"), plugin, SimpleNamespace(name="ws"))
+    route.dispatch("first")
+    route.dispatch("second")
+    assert seen == [("p1", None), ("p1", None)]
+    assert route.workspace == "ws" and route.user_id == "user"
@@ -0,0 +1,44 @@
+"""Test the plugin runner."""
+import asyncio
+
+import pytest
+
+from imjoy.core.connection import BasicConnection
+from imjoy.runner import PluginChannel, SharedClient
+
+# All test coroutines will be treated as marked.
+pytestmark = pytest.mark.asyncio
+
+
+async def test_shared_client_batches():
+    """Test dispatching the messages of batch frames to the plugin channels."""
+    client = SharedClient("http://127.0.0.1")
+    received = []
+
+    def plugin_message(data):
+        received.append((data["peer_id"], data["index"]))
+
+    for peer_id in ("p1", "p2"):
+        channel = PluginChannel(client, peer_id, f"ws/{peer_id}")
+        channel.event(plugin_message)
+        client.channels[peer_id] = channel
+
+    async def send(frame):
+        client._dispatch(frame)  # pylint: disable=protected-access
+
+    connection = BasicConnection(send, batch_window=0.01, batch_size=4)
+    connection.peer_id = "p1"
+    for index in range(5):
+        connection.emit({"type": "message", "index": index})
+    connection.emit({"type": "message", "peer_id": "p2", "index": 5})
+    await asyncio.sleep(0.05)
+    assert received == [("p1", index) for index in range(5)] + [("p2", 5)]
+
+    # binary frames are decoded before being dispatched
+    pytest.importorskip("msgpack")
+    received.clear()
+    connection.encoding = "msgpack"
+    for index in range(2):
+        connection.emit({"type": "message", "index": index})
+    await asyncio.sleep(0.05)
+    assert received == [("p1", 0), ("p1", 1)]
@@ -0,0 +1,93 @@
+"""Test the service registry."""
+import asyncio
+
+import pytest
+
+from imjoy.core.services import ServiceRegistry
+
+
+def _make_registry():
+    registry = ServiceRegistry()
+    services = [
+        {"name": "echo", "type": "#test", "provider": "p1", "providerId": "ws/p1"},
+        {"name": "echo", "type": "#other", "provider": "p2", "providerId": "ws/p2"},
+        {"name": "model", "type": "#test", "provider": "p2", "providerId": "ws/p2"},
+        {"name": "tags", "type": ["#a", "#b"], "providerId": "ws/p3"},
+    ]
+    for service in services:
+        registry.append(service)
+    return registry, services
+
+
+def test_query():
+    """Test querying services by indexed and non-indexed keys."""
+    registry, services = _make_registry()
+    assert registry.query({"name": "echo"}) == services[:2]
+    assert registry.query({"type": "#test", "provider": "p2"}) == [services[2]]
+    assert registry.query({"type": ["#a", "#b"]}) == [services[3]]
+    assert registry.query({"name": "echo", "extra": 1}) == []
+    assert registry.query({"name": "missing"}) == []
+    assert registry.query({}) == services
+    services[0]["extra"] = 1
+    assert registry.query({"extra": 1}) == [services[0]]
+
+
+def test_remove():
+    """Test removing services."""
+    registry, services = _make_registry()
+    registry.remove(services[0])
+    assert services[0] not in registry
+    assert registry.query({"name": "echo"}) == [services[1]]
+
+    removed = registry.remove_by_provider("ws/p2")
+    assert removed == services[1:3]
+    assert len(registry) == 1
+    assert registry.query({"providerId": "ws/p2"}) == []
+    assert registry.remove_by_provider("ws/p2") == []
+    assert list(registry) == [services[3]]
+
+
+@pytest.mark.asyncio
+async def test_select():
+    """Test spreading the calls over the providers of a service."""
+    registry = ServiceRegistry()
+    release = asyncio.Event()
+
+    async def work():
+        await release.wait()
+        return "done"
+
+    for index in range(3):
+        provider_id = f"ws/replica-{index}"
+        registry.append(
+            {
+                "name": "inference",
+                "providerId": provider_id,
+                "run": registry.track(provider_id, work),
+            }
+        )
+
+    def select(strategy):
+        return registry.select({"name": "inference"}, strategy)["providerId"]
+
+    assert [select("round-robin") for _ in range(4)] == [
+        "ws/replica-0",
+        "ws/replica-1",
+        "ws/replica-2",
+        "ws/replica-0",
+    ]
+    assert select("random").startswith("ws/replica-")
+    assert registry.select({"name": "missing"}) is None
+    with pytest.raises(ValueError):
+        registry.select({"name": "inference"}, "fastest")
+
+    calls = [
+        asyncio.ensure_future(registry.query({"providerId": provider_id})[0]["run"]())
+        for provider_id in ("ws/replica-0", "ws/replica-0", "ws/replica-2")
+    ]
+    await asyncio.sleep(0)
+    assert registry.in_flight == {"ws/replica-0": 2, "ws/replica-2": 1}
+    assert {select("least-in-flight") for _ in range(3)} == {"ws/replica-1"}
+    release.set()
+    assert await asyncio.gather(*calls) == ["done"] * 3
+    assert not registry.in_flight
@@ -0,0 +1,219 @@
+"""Test the sharding of workspaces across server nodes."""
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+import requests
+from imjoy_rpc import connect_to_server
+from requests import RequestException
+
+from imjoy.core.sharding import NODE_TIMEOUT, Cluster, HashRing
+from imjoy.core.store import MemoryBackend
+
+REDIS_PORT = 38285
+NODE_PORTS = {"node-a": 38286, "node-b": 38287}
+
+
+def test_hash_ring():
+    """Test that adding a node only moves keys to the new node."""
+    ring = HashRing(["node-a", "node-b"])
+    keys = [f"workspace-{index}" for index in range(1000)]
+    before = {key: ring.get_node(key) for key in keys}
+    assert set(before.values()) == {"node-a", "node-b"}
+
+    ring.add_node("node-c")
+    after = {key: ring.get_node(key) for key in keys}
+    moved = [key for key in keys if before[key] != after[key]]
+    assert all(after[key] == "node-c" for key in moved)
+    assert 200 < len(moved) < 500
+
+    ring.remove_node("node-c")
+    assert {key: ring.get_node(key) for key in keys} == before
+
+
+@pytest.mark.asyncio
+async def test_cluster_rebalance():
+    """Test moving the workspaces when the nodes join or leave."""
+    backend = MemoryBackend()
+    busy = set()
+
+    async def is_busy(workspace):
+        return workspace in busy
+
+    nodes = {
+        node_id: Cluster(backend, node_id, is_busy=is_busy)
+        for node_id in ("node-a", "node-b", "node-c")
+    }
+    now = time.time()
+    await nodes["node-a"].heartbeat(now)
+    await nodes["node-b"].heartbeat(now)
+    assert await nodes["node-a"].heartbeat(now)
+    assert nodes["node-a"].nodes == {"node-a", "node-b"}
+    assert nodes["node-a"].is_leader and not nodes["node-b"].is_leader
+
+    workspaces = [f"workspace-{index}" for index in range(100)]
+    owners = {ws: await nodes["node-b"].get_owner(ws) for ws in workspaces}
+    assert {await nodes["node-a"].get_owner(ws) for ws in workspaces} == {
+        "node-a",
+        "node-b",
+    }
+    busy.update(workspaces[:50])
+
+    # only the idle workspaces move to the new node
+    await nodes["node-c"].heartbeat(now)
+    await nodes["node-a"].heartbeat(now)
+    for ws in workspaces:
+        owner = await nodes["node-a"].get_owner(ws)
+        if ws in busy or owner != "node-c":
+            assert owner == owners[ws]
+    assert "node-c" in {await nodes["node-a"].get_owner(ws) for ws in workspaces[50:]}
+
+    # the workspaces of a node which left move even if they are busy
+    for moment in (now + NODE_TIMEOUT / 2, now + NODE_TIMEOUT + 1):
+        await nodes["node-a"].heartbeat(moment)
+        await nodes["node-c"].heartbeat(moment)
+    assert nodes["node-a"].nodes == {"node-a", "node-c"}
+    assert "node-b" not in {await nodes["node-c"].get_owner(ws) for ws in workspaces}
+
+
+def wait_for(url, check=lambda response: True):
+    """Wait until a url answers."""
+    timeout = 10
+    while timeout > 0:
+        try:
+            response = requests.get(url)
+            if response.ok and check(response):
+                return
+        except RequestException:
+            pass
+        timeout -= 0.1
+        time.sleep(0.1)
+    raise TimeoutError(f"{url} is not ready")
+
+
+@pytest.fixture(name="cluster")
+def cluster_fixture():
+    """Start a redis stand-in and two server nodes."""
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-m", "tests.redis_stand_in", f"--port={REDIS_PORT}"]
+        )
+    ]
+    time.sleep(0.5)
+    # the nodes must share the secret to accept the tokens of each other
+    env = dict(os.environ, NODE_HEARTBEAT_INTERVAL="0.2", JWT_SECRET="test-secret")
+    for node_id, port in NODE_PORTS.items():
+        processes.append(
+            subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "imjoy.server",
+                    f"--port={port}",
+                    f"--state-backend=redis://127.0.0.1:{REDIS_PORT}/0",
+                    "--enable-sharding",
+                    f"--node-id={node_id}",
+                ],
+                env=env,
+            )
+        )
+    try:
+        for port in NODE_PORTS.values():
+            wait_for(
+                f"http://127.0.0.1:{port}/cluster",
+                lambda response: len(response.json()["nodes"]) == 2,
+            )
+        yield
+    finally:
+        for proc in reversed(processes):
+            proc.terminate()
+            proc.wait()
+
+
+@pytest.mark.asyncio
+async def test_forwarding(cluster):
+    """Test using a workspace from the node which does not own it."""
+    ring = HashRing(NODE_PORTS)
+    name = next(
+        f"shard-{index}"
+        for index in range(100)
+        if ring.get_node(f"shard-{index}") == "node-b"
+    )
+    url_a = f"http://127.0.0.1:{NODE_PORTS['node-a']}"
+    url_b = f"http://127.0.0.1:{NODE_PORTS['node-b']}"
+
+    api = await connect_to_server({"name": "owner", "server_url": url_a})
+    ws = await api.create_workspace(
+        {"name": name, "owners": [], "visibility": "protected", "persistent": True}
+    )
+    token = (await ws.generate_token())["token"]
+
+    # connected to node-a, hosted by node-b
+    provider = await connect_to_server(
+        {"name": "provider", "workspace": name, "server_url": url_a, "token": token}
+    )
+    await provider.export({"echo": lambda msg: msg})
+    await provider.register_service({"name": "echo-service", "type": "#echo"})
+
+    consumer = await connect_to_server(
+        {"name": "consumer", "workspace": name, "server_url": url_b, "token": token}
+    )
+    services = await consumer.get_services({"type": "#echo"})
+    assert len(services) == 1 and services[0]["provider"] == "provider"
+    plugin = await consumer.get_plugin("provider")
+    assert await plugin.echo("hello") == "hello"
+
+
+@pytest.mark.asyncio
+async def test_workers():
+    """Test using a workspace from the sessions of several workers."""
+    port = NODE_PORTS["node-a"]
+    server_url = f"http://127.0.0.1:{port}"
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-m", "tests.redis_stand_in", f"--port={REDIS_PORT}"]
+        )
+    ]
+    time.sleep(0.5)
+    processes.append(
+        subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "imjoy.server",
+                f"--port={port}",
+                f"--state-backend=redis://127.0.0.1:{REDIS_PORT}/0",
+                "--workers=2",
+            ],
+            start_new_session=True,
+        )
+    )
+    try:
+        wait_for(f"{server_url}/health")
+        api = await connect_to_server({"name": "provider", "server_url": server_url})
+        await api.export({"echo": lambda msg: msg})
+        await api.register_service({"name": "echo-service", "type": "#echo"})
+        token = (await api.generate_token())["token"]
+        workspace = api.config["workspace"]
+        # the connections are spread over the workers
+        for index in range(6):
+            consumer = await connect_to_server(
+                {
+                    "name": f"consumer-{index}",
+                    "workspace": workspace,
+                    "server_url": server_url,
+                    "token": token,
+                }
+            )
+            services = await consumer.get_services({"type": "#echo"})
+            assert len(services) == 1
+            plugin = await consumer.get_plugin("provider")
+            assert await plugin.echo(index) == index
+    finally:
+        os.killpg(processes[1].pid, signal.SIGTERM)
+        processes[1].wait()
+        processes[0].terminate()
+        processes[0].wait()
@@ -0,0 +1,162 @@
+"""Test the shared state backends."""
+import asyncio
+import pickle
+import subprocess
+import sys
+import time
+
+import pytest
+
+from imjoy.core import UserInfo, WorkspaceInfo
+from imjoy.core.store import (
+    ChangeFeed,
+    MemoryBackend,
+    RedisBackend,
+    RedisPubSubManager,
+    SharedRegistry,
+    SQLiteBackend,
+)
+
+PORT = 38284
+REDIS_URI = f"redis://127.0.0.1:{PORT}/0"
+
+
+@pytest.fixture(name="redis_server")
+def redis_server_fixture():
+    """Start a redis stand-in as test fixture and tear down after test."""
+    with subprocess.Popen(
+        [sys.executable, "-m", "tests.redis_stand_in", f"--port={PORT}"]
+    ) as proc:
+        backend = RedisBackend(REDIS_URI)
+        timeout = 5
+        while timeout > 0:
+            try:
+                backend.execute("PING")
+                break
+            except OSError:
+                pass
+            timeout -= 0.1
+            time.sleep(0.1)
+        backend.close()
+        yield
+
+        proc.terminate()
+
+
+async def wait_until(condition, timeout=1):
+    """Wait until a condition is true."""
+    while not condition():
+        assert timeout > 0
+        timeout -= 0.01
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("shared", [False, True])
+async def test_shared_registry(redis_server, shared):
+    """Test sharing a registry between two workers."""
+    # pylint: disable=protected-access
+    if shared:
+        backends = RedisBackend(REDIS_URI), RedisBackend(REDIS_URI)
+    else:
+        backend = MemoryBackend()
+        backends = backend, backend
+    worker1 = SharedRegistry("users", UserInfo, backends[0])
+    worker2 = SharedRegistry("users", UserInfo, backends[1])
+    received, changed = [], []
+    if shared:
+        feeds = ChangeFeed(REDIS_URI), ChangeFeed(REDIS_URI)
+        feeds[0].watch(worker1, received.append)
+        feeds[1].watch(worker2, changed.append)
+        for feed in feeds:
+            await feed.start()
+    await worker1.put("alice", UserInfo(id="alice", roles=[], scopes=[]))
+    worker1["alice"]._sessions.append("sid1")
+    assert await worker1.acquire("alice") == 1
+    assert "alice" in worker1
+    # reading the registry only sees the loaded entries
+    assert "alice" not in worker2
+
+    if shared:
+        assert await worker2.all_keys() == ["alice"]
+        # the second worker loads the fields but not the private attributes
+        alice = await worker2.load("alice")
+        assert alice.id == "alice" and worker2["alice"] is alice
+        assert alice._sessions == []
+        assert await worker2.acquire("alice") == 2
+        alice._sessions.append("sid2")
+        await wait_until(lambda: changed == ["alice"])
+        # the loaded copy is refreshed in place when the first worker saves
+        worker1["alice"].scopes.append("ws1")
+        await worker1.save("alice")
+        await wait_until(lambda: len(changed) == 2)
+        assert worker2["alice"] is alice
+        assert alice.scopes == ["ws1"] and alice._sessions == ["sid2"]
+        # the own changes are skipped
+        await worker2.save("alice")
+        await wait_until(lambda: received == ["alice"])
+        assert len(changed) == 2
+        assert await worker2.release("alice") == 1
+    else:
+        assert await worker2.load("alice") is None
+
+    assert await worker1.release("alice") == 0
+    assert await worker1.remove("alice")
+    assert "alice" not in worker1
+    if shared:
+        # and dropped when it is removed
+        await wait_until(lambda: len(changed) == 3)
+        assert "alice" not in worker2
+        for feed in feeds:
+            await feed.stop()
+    assert await worker2.load("alice") is None
+    assert not await worker2.remove("alice")
+
+
+@pytest.mark.asyncio
+async def test_pubsub_manager(redis_server):
+    """Test publishing messages to the other workers."""
+    # pylint: disable=protected-access
+    publisher = RedisPubSubManager(REDIS_URI)
+    subscriber = RedisPubSubManager(REDIS_URI)
+    listening = asyncio.ensure_future(subscriber._listen())
+    await asyncio.sleep(0.1)
+    await publisher._publish({"method": "emit", "event": "plugin_message"})
+    message = await asyncio.wait_for(listening, 1)
+    assert pickle.loads(message) == {"method": "emit", "event": "plugin_message"}
+
+
+@pytest.mark.asyncio
+async def test_workspace_store(tmp_path):
+    """Test persisting workspaces and loading them after a restart."""
+    # pylint: disable=protected-access
+    path = str(tmp_path / "workspaces.db")
+    workspaces = SharedRegistry("workspaces", WorkspaceInfo, store=SQLiteBackend(path))
+    for name, persistent in (("kept", True), ("temporary", False), ("demoted", True)):
+        await workspaces.put(
+            name,
+            WorkspaceInfo(
+                name=name,
+                owners=["alice"],
+                visibility="protected",
+                persistent=persistent,
+            ),
+        )
+    workspaces["kept"].docs = "https://imjoy.io"
+    await workspaces.save("kept")
+    workspaces["demoted"].persistent = False
+    await workspaces.save("demoted")
+    workspaces.store.close()
+
+    # restart
+    store = SQLiteBackend(path)
+    workspaces = SharedRegistry("workspaces", WorkspaceInfo, store=store)
+    assert not workspaces.loaded()
+    assert await workspaces.all_keys() == ["kept"]
+    assert await workspaces.load("temporary") is None
+    assert await workspaces.load("demoted") is None
+    assert (await workspaces.load("kept")).docs == "https://imjoy.io"
+    assert list(workspaces.loaded()) == ["kept"]
+    assert workspaces["kept"]._plugins == {}
+    assert await workspaces.remove("kept")
+    assert store.keys("workspaces") == []